@@ -0,0 +1,211 @@
+"""Shared cache backend and cross-worker invalidation (CACHE_BACKEND).
+
+"memory" (the default) keeps everything in this process, which is all a single worker
+needs. "redis" talks to a server speaking the Redis protocol at REDIS_URL (Redis, Valkey,
+or scripts/resp_server.py in tests), so every worker and node shares one copy:
+
+- get/set/delete hold byte values under REDIS_PREFIX with a TTL. Only content-addressed
+  values (rendered QR images and PDFs) go here; they never need invalidating.
+- publish(topic, message) reaches the handlers registered with subscribe(topic, fn) in
+  every other process. The sender has already applied the change to its own caches.
+
+The per-process caches (catalog, principals) keep their in-memory copy and subscribe to
+invalidations, so a change made on one worker is dropped everywhere right away instead of
+after a version check or TTL. A failing shared backend is logged and treated as a miss;
+the database stays the source of truth.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import CACHE_BACKEND, CACHE_MEMORY_MAX_ITEMS, CACHE_TTL_SECONDS, REDIS_PREFIX, REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], None]
+
+
+class MemoryCache:
+    """In-process backend: a bounded LRU with per-entry expiry. There is no one to publish to."""
+
+    shared = False
+
+    def __init__(self, max_items: int = CACHE_MEMORY_MAX_ITEMS):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float = CACHE_TTL_SECONDS):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def publish(self, topic: str, message: dict):
+        pass
+
+    def subscribe(self, topic: str, handler: Handler):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "max_items": self.max_items, "hits": self.hits, "misses": self.misses}
+
+
+class RedisCache:
+    """Redis-protocol backend. Invalidations travel on one pub/sub channel, `<prefix>bus`,
+    read by a background thread started with start()."""
+
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX):
+        import redis  # optional dependency, only needed for CACHE_BACKEND=redis
+
+        self._errors = (redis.RedisError, OSError)
+        # RESP2 is understood by every Redis-protocol server, scripts/resp_server.py included
+        self._client = redis.Redis.from_url(url, protocol=2, socket_timeout=2, socket_connect_timeout=2, health_check_interval=30)
+        self.url = url
+        self.prefix = prefix
+        self.channel = f"{prefix}bus"
+        self.origin = uuid.uuid4().hex
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._lock = threading.Lock()
+        self._pubsub = None
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.received = 0
+
+    def _failed(self, op: str, e: Exception):
+        self.errors += 1
+        logger.warning("shared cache %s failed: %s", op, e)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            value = self._client.get(self.prefix + key)
+        except self._errors as e:
+            self._failed("get", e)
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float = CACHE_TTL_SECONDS):
+        try:
+            self._client.set(self.prefix + key, value, px=int(ttl * 1000))
+        except self._errors as e:
+            self._failed("set", e)
+
+    def delete(self, *keys: str):
+        if not keys:
+            return
+        try:
+            self._client.delete(*(self.prefix + k for k in keys))
+        except self._errors as e:
+            self._failed("delete", e)
+
+    def publish(self, topic: str, message: dict):
+        payload = json.dumps({"origin": self.origin, "topic": topic, "message": message}, separators=(",", ":"))
+        try:
+            self._client.publish(self.channel, payload)
+        except self._errors as e:
+            self._failed("publish", e)
+
+    def subscribe(self, topic: str, handler: Handler):
+        with self._lock:
+            self._handlers.setdefault(topic, []).append(handler)
+
+    def _on_message(self, raw: dict):
+        try:
+            data = json.loads(raw["data"])
+        except (TypeError, ValueError):
+            return
+        if data.get("origin") == self.origin:
+            return
+        self.received += 1
+        with self._lock:
+            handlers = list(self._handlers.get(data.get("topic"), ()))
+        for handler in handlers:
+            try:
+                handler(data["message"])
+            except Exception:
+                logger.exception("invalidation handler for %s failed", data.get("topic"))
+
+    def _on_listener_error(self, e: Exception, pubsub, thread):
+        # Keep listening; redis-py reconnects and resubscribes on the next read. Invalidations
+        # missed meanwhile are caught by the catalog version check and the principal TTL.
+        self._failed("subscribe", e)
+        time.sleep(1.0)
+
+    def start(self):
+        """Start the invalidation listener (once per process, from app startup)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{self.channel: self._on_message})
+            self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True, exception_handler=self._on_listener_error)
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.stop()
+            thread.join(timeout=2.0)
+            self._pubsub.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "url": self.url.split("@")[-1],  # no credentials
+            "prefix": self.prefix,
+            "listening": self._thread is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "invalidations_received": self.received,
+        }
+
+
+def make_cache(name: str = CACHE_BACKEND):
+    if name == "memory":
+        return MemoryCache()
+    if name == "redis":
+        return RedisCache()
+    raise ValueError(f"unknown CACHE_BACKEND {name!r}")
+
+
+shared_cache = make_cache()
@@ -21,3 +21,125 @@ SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 EMAIL_FROM = os.getenv("EMAIL_FROM", "")
 
 ACCESS_TOKEN_EXPIRE_DELTA = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+
+# Password hashing: bcrypt cost, and a process pool so hashing doesn't occupy request threads
+# (PASSWORD_HASH_WORKERS=0 hashes inline). Beyond MAX_PENDING queued calls, logins get 429.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_TIMEOUT_SECONDS", "10"))
+
+# Shared cache backend: "memory" keeps it in this process (single worker); "redis" shares cached renders
+# and broadcasts cache invalidations between workers/nodes through REDIS_URL (any Redis-protocol server).
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "checkout:")
+CACHE_MEMORY_MAX_ITEMS = int(os.getenv("CACHE_MEMORY_MAX_ITEMS", "10000"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
+
+# Run init_db (create_all + forward column/index migration) on startup. With several workers set it to
+# false and run `python scripts/migrate.py` once per deploy; workers then only check the schema.
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+
+# Product catalog cache (per process; version row in DB lets workers detect staleness)
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "true").lower() == "true"
+CATALOG_CACHE_MAX_ITEMS = int(os.getenv("CATALOG_CACHE_MAX_ITEMS", "50000"))
+CATALOG_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("CATALOG_CACHE_VERSION_CHECK_SECONDS", "2.0"))
+
+# Verified token -> principal cache (per process; entries never outlive the token's exp)
+PRINCIPAL_CACHE_ENABLED = os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() == "true"
+PRINCIPAL_CACHE_MAX_ITEMS = int(os.getenv("PRINCIPAL_CACHE_MAX_ITEMS", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+
+# Async DB mode (SQLAlchemy asyncio: aiosqlite for SQLite, asyncpg for Postgres)
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")
+
+# Connection pool (ignored for in-memory SQLite, which uses a single shared connection)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# SQLite connect-time PRAGMAs (empty value skips the pragma)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")
+SQLITE_MMAP_SIZE = os.getenv("SQLITE_MMAP_SIZE", "268435456")
+SQLITE_CACHE_SIZE = os.getenv("SQLITE_CACHE_SIZE", "-64000")  # negative = KiB
+
+# Checkout stock reservations: held this long before an unpaid invoice's stock goes back on the shelf
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "900"))
+# Stock changes that leave a product at or below this many units log a low-stock warning
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", "5"))
+
+# Idempotency-Key on checkout/finalize/pay: responses are replayed for IDEMPOTENCY_TTL_SECONDS; a claimed key
+# whose request has not finished after IDEMPOTENCY_LOCK_SECONDS (worker died) may be taken over by a retry.
+# Expired keys are deleted IDEMPOTENCY_PURGE_BATCH at a time whenever a new key is claimed.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))
+IDEMPOTENCY_PURGE_BATCH = int(os.getenv("IDEMPOTENCY_PURGE_BATCH", "100"))
+
+# /cart/scan-batch op ids are remembered for CART_OP_TTL_SECONDS (the client retry window); older ones are
+# deleted CART_OP_PURGE_BATCH at a time by idle job workers (or scripts/run_jobs.py)
+CART_OP_TTL_SECONDS = int(os.getenv("CART_OP_TTL_SECONDS", "86400"))
+CART_OP_PURGE_BATCH = int(os.getenv("CART_OP_PURGE_BATCH", "500"))
+
+# Bulk product import: rows per upsert statement/transaction
+PRODUCT_IMPORT_BATCH_SIZE = int(os.getenv("PRODUCT_IMPORT_BATCH_SIZE", "1000"))
+
+# Background jobs (outbox table + worker threads)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "5.0"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Idle workers delete finished (done/failed) jobs older than JOB_RETENTION_SECONDS, JOB_PURGE_BATCH at a time
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 86400)))
+JOB_PURGE_BATCH = int(os.getenv("JOB_PURGE_BATCH", "500"))
+
+# "smtp" sends for real; "sink" keeps messages in memory (and in EMAIL_SINK_DIR if set) for local dev/tests
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "smtp").lower()
+EMAIL_SINK_DIR = os.getenv("EMAIL_SINK_DIR", "")
+
+# Rendered invoice PDF cache (memory LRU + disk tier; empty dir disables the disk tier)
+PDF_CACHE_MEMORY_BYTES = int(os.getenv("PDF_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "var", "pdf_cache"))
+PDF_CACHE_DISK_MAX_BYTES = int(os.getenv("PDF_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Rendered QR cache (entries keyed by payload + render parameters)
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "4096"))
+
+# Analytics rollups: once the last full rebuild is older than this, a read queues a background rebuild
+# and is answered from the current rollups meanwhile (0 = trust incremental updates)
+ANALYTICS_ROLLUP_MAX_AGE_SECONDS = int(os.getenv("ANALYTICS_ROLLUP_MAX_AGE_SECONDS", "0"))
+
+# Line-level reports: window used when a request gives no start date, and how many extracted
+# ranges to keep in memory (keyed by range + paid invoice count/max id + catalog version; 0 = off)
+REPORT_DEFAULT_DAYS = int(os.getenv("REPORT_DEFAULT_DAYS", "90"))
+REPORT_CACHE_ENTRIES = int(os.getenv("REPORT_CACHE_ENTRIES", "4"))
+
+# Live cart/invoice events over SSE (/events/*): broker ("local" = this process only, "redis" = every
+# worker through CACHE_BACKEND=redis), keep-alive comment interval, and per-subscriber backlog before
+# it is told to resync
+EVENT_BROKER = os.getenv("EVENT_BROKER", "local").lower()
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+# Lifetime of the stream tokens EventSource passes as ?access_token= (only checked on (re)connect)
+STREAM_TOKEN_EXPIRE_SECONDS = int(os.getenv("STREAM_TOKEN_EXPIRE_SECONDS", "120"))
+
+# Request/SQL/pool metrics at /metrics (Prometheus text); optional Server-Timing response header
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+# Slow-request profiler (opt-in): stack samples + SQL for sampled requests slower than PROFILE_SLOW_MS,
+# kept as JSON in a ring buffer of PROFILE_MAX_FILES under PROFILE_DIR. PROFILE_ROUTES filters by route
+# template (comma-separated, e.g. "/carts/{cart_id}/checkout,/invoices/{id}/pay"); empty = all routes.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1.0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_ROUTES = [r.strip() for r in os.getenv("PROFILE_ROUTES", "").split(",") if r.strip()]
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "var", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
@@ -1,8 +1,27 @@
 import os
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-from .config import DATABASE_URL
+from .metrics import observe_pool_wait
+
+from .config import (
+    DATABASE_URL,
+    DB_ASYNC,
+    ASYNC_DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_MMAP_SIZE,
+    SQLITE_CACHE_SIZE,
+)
 
 # Resolve SQLite relative path to an absolute path rooted at the repo
 resolved_db_url = DATABASE_URL
@@ -14,19 +33,195 @@ if DATABASE_URL.startswith("sqlite:///") and not DATABASE_URL.startswith("sqlite
     # SQLAlchemy absolute path form requires four slashes
     resolved_db_url = f"sqlite:///{abs_path}"
 
-connect_args = {}
-if resolved_db_url.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+# Applied in this order on every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    "synchronous": SQLITE_SYNCHRONOUS,
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "mmap_size": SQLITE_MMAP_SIZE,
+    "cache_size": SQLITE_CACHE_SIZE,
+}
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:"
+
+
+class _TimedCheckout:
+    """Records how long each checkout waited on the pool (including opening a new connection)."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            observe_pool_wait(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
 
-engine = create_engine(resolved_db_url, echo=False, future=True, connect_args=connect_args)
+def engine_options(url: str) -> dict:
+    """Keyword arguments for create_engine/create_async_engine, driven by the DB_POOL_* settings."""
+    options = {"echo": False, "pool_pre_ping": DB_POOL_PRE_PING}
+    if url.startswith("sqlite"):
+        if _is_memory_sqlite(url):
+            return options
+        if "aiosqlite" not in url:
+            options["connect_args"] = {"check_same_thread": False}
+    options.update(
+        poolclass=TimedAsyncAdaptedQueuePool if "+aiosqlite" in url or "+asyncpg" in url else TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            if value:
+                cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def make_engine(url: str):
+    sync_engine = create_engine(url, future=True, **engine_options(url))
+    if url.startswith("sqlite"):
+        event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+    return sync_engine
+
+
+engine = make_engine(resolved_db_url)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
 Base = declarative_base()
 
 
+
+def to_async_url(url: str) -> str:
+    """Map a sync driver URL onto its asyncio driver (aiosqlite / asyncpg)."""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+# Opt-in async engine; the sync engine above stays available for scripts and sync routers
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_url = ASYNC_DATABASE_URL or to_async_url(resolved_db_url)
+    async_engine = create_async_engine(async_url, **engine_options(async_url))
+    if async_url.startswith("sqlite"):
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+
+def add_missing_columns(bind=None) -> list:
+    """Lightweight forward migration: ALTER TABLE ... ADD COLUMN for model columns an existing DB lacks."""
+    bind = bind or engine
+    insp = inspect(bind)
+    added = []
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=bind.dialect)}"
+                if col.default is not None and col.default.is_scalar:
+                    ddl += f" DEFAULT {col.default.arg!r}"
+                conn.execute(text(ddl))
+                added.append((table.name, col.name))
+    return added
+
+
+def add_missing_indexes(bind=None):
+    """create_all skips indexes on tables that already exist; create any that are missing."""
+    bind = bind or engine
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+def pending_migrations(bind=None) -> list:
+    """What init_db would add to this database: missing tables, columns (table.column) and indexes."""
+    from . import models  # ensure models are imported
+    bind = bind or engine
+    insp = inspect(bind)
+    pending = []
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            pending.append(table.name)
+            continue
+        columns = {c["name"] for c in insp.get_columns(table.name)}
+        pending += [f"{table.name}.{c.name}" for c in table.columns if c.name not in columns]
+        indexes = {i["name"] for i in insp.get_indexes(table.name)}
+        pending += [i.name for i in table.indexes if i.name not in indexes]
+    return pending
+
+
 def init_db():
     from . import models  # ensure models are imported
+    existing = set(inspect(engine).get_table_names())
     Base.metadata.create_all(bind=engine)
+    added = add_missing_columns()
+    add_missing_indexes()
+    if ("carts", "total") in added:
+        # Carts created before running totals existed: backfill them from their lines
+        from .utils.cart_lines import audit_cart_totals
+
+        db = SessionLocal()
+        try:
+            audit_cart_totals(db, fix=True, active_only=False)
+        finally:
+            db.close()
+    if existing and "sales_by_customer_day" not in existing:
+        # Per-customer daily rollup added to a database that already has sales: backfill it
+        from .utils.rollups import rebuild_rollups
+
+        db = SessionLocal()
+        try:
+            rebuild_rollups(db)
+        finally:
+            db.close()
+
+
+def dialect_insert(db):
+    """`insert` construct with ON CONFLICT support for the session's dialect (SQLite or Postgres)."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def pool_status(target) -> dict:
+    """Snapshot of a pool's counters; QueuePool-style pools expose size/checked-in/out/overflow."""
+    pool = target.pool
+    status = {"class": type(pool).__name__, "status": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            status[name] = fn()
+    return status
 
 
 def get_db():
@@ -36,3 +231,8 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
@@ -1,55 +1,127 @@
-from fastapi import Depends, HTTPException, status
+from typing import Any, Callable, Optional
+
+from fastapi import Depends, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .database import get_db
-from .security import decode_token
-from . import models
+from .database import get_db, get_async_db
+from .security import STREAM_SCOPE, decode_token
+from .utils import idempotency
+from .utils.principals import CUSTOMER, OFFICIAL, Principal, kind_for_role, load_principal, principal_cache
 
 oauth2_scheme_customer = OAuth2PasswordBearer(tokenUrl="/auth/customer/login")
 oauth2_scheme_official = OAuth2PasswordBearer(tokenUrl="/auth/official/login")
 
 
-def get_current_customer(token: str = Depends(oauth2_scheme_customer), db: Session = Depends(get_db)) -> models.Customer:
+def _authenticate(token: str, db: Session, kind: str, wrong_kind_detail: str, scope: Optional[str] = None) -> Principal:
+    # Only unscoped tokens are cached, so a scoped one is always checked against `scope` below
+    principal = principal_cache.get(token) if scope is None else None
+    if principal is None:
+        try:
+            payload = decode_token(token)
+        except Exception:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+
+        if payload.get("scope") != scope:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token not valid here")
+
+        if kind_for_role(payload.get("role")) != kind:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=wrong_kind_detail)
+
+        if not payload.get("sub"):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
+
+        principal = load_principal(db, payload)
+        if principal is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        if scope is None:
+            principal_cache.put(token, principal, payload.get("exp"))
+    elif principal.kind != kind:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=wrong_kind_detail)
+    return principal
+
+
+def get_current_customer(token: str = Depends(oauth2_scheme_customer), db: Session = Depends(get_db)) -> Principal:
+    return _authenticate(token, db, CUSTOMER, "Not a customer token")
+
+
+def get_current_official(token: str = Depends(oauth2_scheme_official), db: Session = Depends(get_db)) -> Principal:
+    return _authenticate(token, db, OFFICIAL, "Not an official token")
+
+
+def require_admin(official: Principal = Depends(get_current_official)) -> Principal:
+    if official.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return official
+
+
+def _authenticate_any(token: str, db: Session, scope: Optional[str] = None) -> Principal:
     try:
-        payload = decode_token(token)
+        kind = kind_for_role(decode_token(token).get("role"))
     except Exception:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if kind is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unknown role")
+    return _authenticate(token, db, kind, "Not allowed", scope)
+
+
+def get_current_principal(token: str = Depends(oauth2_scheme_customer), db: Session = Depends(get_db)) -> Principal:
+    """Customer or official, from the Authorization header."""
+    return _authenticate_any(token, db)
 
-    if payload.get("role") != "customer":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a customer token")
 
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
+def get_stream_principal(request: Request, access_token: Optional[str] = Query(None), db: Session = Depends(get_db)) -> Principal:
+    """Customer or official, from the Authorization header or, for EventSource (which cannot send
+    headers), `access_token`. The query string only takes short-lived stream tokens from
+    POST /events/token: URLs end up in access logs, and a login token there would outlive them."""
+    header = request.headers.get("authorization", "")
+    if header[:7].lower() == "bearer ":
+        return _authenticate_any(header[7:], db)
+    if not access_token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return _authenticate_any(access_token, db, scope=STREAM_SCOPE)
 
-    user = db.query(models.Customer).filter(models.Customer.email == email).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
 
+def idempotent(db: Session, key: Optional[str], principal: Principal, fingerprint: str, handler: Callable[[Callable[[Any], None]], Any]):
+    """Run `handler` once per Idempotency-Key; a retry with the same key gets the stored response back.
 
-def get_current_official(token: str = Depends(oauth2_scheme_official), db: Session = Depends(get_db)) -> models.StoreOfficial:
+    `handler(commit)` ends its transaction with `commit(response)` rather than db.commit(): the
+    response is stored in the same transaction as the work, so a worker dying right after that
+    commit leaves a key that a retry replays, never one that runs the handler a second time."""
+    if not key:
+        return handler(lambda result: db.commit())
+    if len(key) > 255:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Idempotency-Key is too long (max 255 characters)")
+    owner = f"{principal.kind}:{principal.id}"
     try:
-        payload = decode_token(token)
-    except Exception:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        stored = idempotency.claim(db, owner, key, fingerprint)
+    except idempotency.KeyInProgress:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A request with this Idempotency-Key is still in progress")
+    except idempotency.KeyReused:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Idempotency-Key was already used for a different request")
+    if stored is not None:
+        status_code, body = stored
+        return JSONResponse(body, status_code=status_code, headers={"Idempotent-Replayed": "true"})
 
-    if payload.get("role") not in ("cashier", "admin"):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not an official token")
+    def commit(result):
+        idempotency.complete(db, owner, key, status.HTTP_200_OK, jsonable_encoder(result))
+        db.commit()
 
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
+    try:
+        return handler(commit)
+    except BaseException:
+        # A no-op once commit() has run: the stored response keeps the key
+        idempotency.abandon(db, owner, key)
+        raise
 
-    user = db.query(models.StoreOfficial).filter(models.StoreOfficial.email == email).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
 
+# Async variants: same checks, run on the request's AsyncSession so async routes share it
+async def get_current_customer_async(token: str = Depends(oauth2_scheme_customer), db: AsyncSession = Depends(get_async_db)) -> Principal:
+    return await db.run_sync(lambda s: get_current_customer(token, db=s))
 
-def require_admin(official: models.StoreOfficial = Depends(get_current_official)) -> models.StoreOfficial:
-    if official.role != "admin":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
-    return official
 
+async def get_current_official_async(token: str = Depends(oauth2_scheme_official), db: AsyncSession = Depends(get_async_db)) -> Principal:
+    return await db.run_sync(lambda s: get_current_official(token, db=s))
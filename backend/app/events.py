@@ -0,0 +1,169 @@
+"""Cart and invoice change events for the SSE endpoints (routers/events.py).
+
+Handlers publish small diffs after they commit (a changed cart line plus the new totals, a
+status change) to a channel per cart (`cart:<id>`) or invoice (`invoice:<id>`). The broker
+fans a message out to every open subscription on the channel. LocalBroker only reaches
+subscribers in this process; SharedBroker (EVENT_BROKER=redis) also sends every message to
+the other workers through the shared cache backend's bus and delivers theirs locally.
+
+Publishing is safe from any thread (sync endpoints run in the threadpool); subscriptions
+are consumed on the event loop. A subscriber that falls EVENTS_QUEUE_SIZE messages behind
+gets a single `resync` event instead of the backlog.
+"""
+import asyncio
+import itertools
+import threading
+from collections import deque
+from typing import Dict, Optional, Set
+
+from .cache import shared_cache
+from .config import EVENT_BROKER, EVENTS_QUEUE_SIZE
+
+
+class Subscription:
+    def __init__(self, channel: str, maxsize: int = EVENTS_QUEUE_SIZE):
+        self.channel = channel
+        self.maxsize = maxsize
+        self._items: deque = deque()
+        self._lock = threading.Lock()
+        self._overflowed = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def push(self, message: dict):
+        with self._lock:
+            if len(self._items) >= self.maxsize:
+                self._items.clear()
+                self._overflowed = True
+            elif not self._overflowed:
+                self._items.append(message)
+            loop, ready = self._loop, self._ready
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass  # loop already closed; the stream is gone
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next message, or None after `timeout` seconds without one."""
+        if self._loop is None:
+            with self._lock:
+                self._loop, self._ready = asyncio.get_running_loop(), asyncio.Event()
+        while True:
+            with self._lock:
+                if self._overflowed:
+                    self._overflowed = False
+                    return {"type": "resync"}
+                if self._items:
+                    return self._items.popleft()
+                self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+
+    def subscribe(self, channel: str) -> Subscription:
+        sub = Subscription(channel)
+        with self._lock:
+            self._subs.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subs.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.channel]
+
+    def publish(self, channel: str, message: dict):
+        self._deliver(channel, message)
+
+    def _deliver(self, channel: str, message: dict):
+        with self._lock:
+            subs = list(self._subs.get(channel, ()))
+        if not subs:
+            return
+        message = {**message, "seq": next(self._seq)}
+        for sub in subs:
+            sub.push(message)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "broker": type(self).__name__,
+                "channels": len(self._subs),
+                "subscribers": sum(len(s) for s in self._subs.values()),
+            }
+
+
+class SharedBroker(LocalBroker):
+    """Delivers locally right away and relays to the other workers over the shared cache bus."""
+
+    TOPIC = "events"
+
+    def __init__(self, cache=shared_cache):
+        super().__init__()
+        self._cache = cache
+        cache.subscribe(self.TOPIC, lambda m: self._deliver(m["channel"], m["message"]))
+
+    def publish(self, channel: str, message: dict):
+        self._deliver(channel, message)
+        self._cache.publish(self.TOPIC, {"channel": channel, "message": message})
+
+
+def make_broker(name: str = EVENT_BROKER) -> LocalBroker:
+    if name == "local":
+        return LocalBroker()
+    if name == "redis":
+        if not shared_cache.shared:
+            raise ValueError("EVENT_BROKER=redis needs CACHE_BACKEND=redis")
+        return SharedBroker()
+    raise ValueError(f"unknown EVENT_BROKER {name!r}")
+
+
+broker = make_broker()
+
+
+def cart_channel(cart_id: int) -> str:
+    return f"cart:{cart_id}"
+
+
+def invoice_channel(invoice_id: int) -> str:
+    return f"invoice:{invoice_id}"
+
+
+def line_payload(product_id: int, product_name: str, quantity: int, subtotal: float, net_weight: float) -> dict:
+    """A cart line as sent to clients; quantity 0 means the line was removed."""
+    return {"product_id": product_id, "product_name": product_name, "quantity": quantity, "subtotal": subtotal, "net_weight": net_weight}
+
+
+def totals_payload(cart) -> dict:
+    return {"total": cart.total, "total_weight": cart.total_weight, "item_count": cart.item_count, "version": cart.version}
+
+
+def publish_cart_lines(cart_id: int, lines, totals: dict, replace: bool = False):
+    """Changed lines of a cart (all of them when `replace`) plus its new totals."""
+    broker.publish(cart_channel(cart_id), {"type": "lines", "replace": replace, "lines": list(lines), "totals": totals})
+
+
+def publish_cart_status(cart_id: int, status: str, invoice_id: Optional[int] = None, invoice_code: Optional[str] = None):
+    broker.publish(cart_channel(cart_id), {"type": "status", "status": status, "invoice_id": invoice_id, "invoice_code": invoice_code})
+
+
+def publish_invoice_status(invoice, **extra):
+    broker.publish(invoice_channel(invoice.id), {
+        "type": "status",
+        "invoice_id": invoice.id,
+        "code": invoice.code,
+        "status": invoice.status.value,
+        "paid_at": invoice.paid_at.isoformat() + "Z" if invoice.paid_at else None,
+        **extra,
+    })
@@ -0,0 +1,293 @@
+"""Outbox-backed background jobs.
+
+Handlers enqueue a row in `outbox_jobs` inside their own transaction; worker threads
+claim rows with a conditional UPDATE (safe across processes), run the registered
+handler and retry failures with exponential backoff.
+"""
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import (
+    EMAIL_ENABLED,
+    JOB_BACKOFF_BASE_SECONDS,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_SECONDS,
+    JOB_PURGE_BATCH,
+    JOB_RETENTION_SECONDS,
+    JOB_WORKERS,
+)
+from .database import SessionLocal, dialect_insert
+from .metrics import job_latency, job_runs
+from .queries import invoice_with_lines
+from .utils.cart_lines import purge_expired_ops
+from .utils.mailer import send_invoice_email_if_enabled
+from .utils.pdf_cache import pdf_cache
+from .utils.rollups import SALES_ROLLUP, rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+HANDLERS: Dict[str, Callable[[Session, dict], None]] = {}
+
+
+def register(kind: str):
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def enqueue(db: Session, kind: str, dedupe_key: str, payload: dict) -> bool:
+    """Add a job to the caller's transaction. A second enqueue with the same key is a no-op
+    (ON CONFLICT on the unique dedupe_key, so concurrent callers cannot race past a check).
+    Returns whether a new job was queued."""
+    insert = dialect_insert(db)
+    stmt = (
+        insert(models.OutboxJob)
+        .values(kind=kind, dedupe_key=dedupe_key, payload=json.dumps(payload))
+        .on_conflict_do_nothing(index_elements=[models.OutboxJob.dedupe_key])
+    )
+    return db.execute(stmt).rowcount == 1
+
+
+def backoff_seconds(attempts: int) -> float:
+    return JOB_BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1))
+
+
+class JobStats:
+    """Rolling in-process latency figures (enqueue -> finished) for /diagnostics/jobs; each
+    outcome is also counted in the jobs_total / job_latency_seconds series at /metrics."""
+
+    def __init__(self, window: int = 500):
+        self._latencies: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    def record(self, outcome: str, latency: Optional[float] = None, kind: str = ""):
+        job_runs.inc(kind=kind, outcome=outcome)
+        if latency is not None:
+            job_latency.observe(latency, kind=kind)
+        with self._lock:
+            if outcome == "done":
+                self.succeeded += 1
+                if latency is not None:
+                    self._latencies.append(latency)
+            elif outcome == "retry":
+                self.retried += 1
+            else:
+                self.failed += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lat = sorted(self._latencies)
+        return {
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+            "latency_seconds": {
+                "samples": len(lat),
+                "avg": (sum(lat) / len(lat)) if lat else 0.0,
+                "p95": lat[int(0.95 * (len(lat) - 1))] if lat else 0.0,
+                "max": lat[-1] if lat else 0.0,
+            },
+        }
+
+
+job_stats = JobStats()
+
+
+def claim_next(db: Session) -> Optional[int]:
+    """Atomically move one due job to running. Jobs stuck in running past the lease are reclaimed."""
+    now = datetime.utcnow()
+    due = or_(
+        and_(models.OutboxJob.status == models.JobStatus.pending, models.OutboxJob.run_after <= now),
+        and_(models.OutboxJob.status == models.JobStatus.running, models.OutboxJob.started_at < now - timedelta(seconds=JOB_LEASE_SECONDS)),
+    )
+    candidate = db.query(models.OutboxJob.id, models.OutboxJob.status, models.OutboxJob.started_at).filter(due).order_by(models.OutboxJob.id).first()
+    if not candidate:
+        return None
+    # Match the lease we read as well as the status: two workers reclaiming the same stale
+    # job both see "running", but only the first UPDATE still finds the old started_at
+    claimable = [models.OutboxJob.id == candidate.id, models.OutboxJob.status == candidate.status]
+    if candidate.started_at is not None:
+        claimable.append(models.OutboxJob.started_at == candidate.started_at)
+    res = db.execute(
+        update(models.OutboxJob)
+        .where(*claimable)
+        .values(status=models.JobStatus.running, started_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return candidate.id if res.rowcount == 1 else None
+
+
+def run_job(job_id: int):
+    db = SessionLocal()
+    try:
+        job = db.get(models.OutboxJob, job_id)
+        handler = HANDLERS.get(job.kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind {job.kind!r}")
+            handler(db, json.loads(job.payload or "{}"))
+        except Exception as e:
+            db.rollback()
+            job = db.get(models.OutboxJob, job_id)
+            job.attempts += 1
+            job.last_error = f"{type(e).__name__}: {e}"[:500]
+            if job.attempts >= JOB_MAX_ATTEMPTS:
+                job.status = models.JobStatus.failed
+                job.finished_at = datetime.utcnow()
+                job_stats.record("failed", kind=job.kind)
+                logger.error("job %s (%s) failed permanently: %s", job.id, job.kind, job.last_error)
+            else:
+                job.status = models.JobStatus.pending
+                job.run_after = datetime.utcnow() + timedelta(seconds=backoff_seconds(job.attempts))
+                job_stats.record("retry", kind=job.kind)
+            db.commit()
+            return
+        job.status = models.JobStatus.done
+        job.finished_at = datetime.utcnow()
+        job.last_error = None
+        db.commit()
+        job_stats.record("done", (job.finished_at - job.created_at).total_seconds(), kind=job.kind)
+    finally:
+        db.close()
+
+
+def purge_finished_jobs(db: Session, now: Optional[datetime] = None, limit: int = JOB_PURGE_BATCH) -> int:
+    """Delete up to `limit` done/failed jobs finished more than JOB_RETENTION_SECONDS ago, in the
+    caller's transaction; returns how many. Their dedupe keys can be queued again after that."""
+    J = models.OutboxJob
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=JOB_RETENTION_SECONDS)
+    finished = select(J.id).where(J.status.in_([models.JobStatus.done, models.JobStatus.failed]), J.finished_at < cutoff).limit(limit)
+    return db.execute(delete(J).where(J.id.in_(finished)).execution_options(synchronize_session=False)).rowcount
+
+
+def purge_old_rows(db: Session) -> int:
+    """Housekeeping for tables that only ever get appended to: old outbox jobs and scan-batch op ids."""
+    purged = purge_finished_jobs(db) + purge_expired_ops(db)
+    db.commit()
+    return purged
+
+
+def run_pending_jobs(limit: Optional[int] = None) -> int:
+    """Drain due jobs on the calling thread (scripts, tests, JOB_WORKERS=0). Returns jobs run.
+    Once the queue is empty, a batch of old rows is purged (see purge_old_rows)."""
+    ran = 0
+    while limit is None or ran < limit:
+        db = SessionLocal()
+        try:
+            job_id = claim_next(db)
+            if job_id is None:
+                purge_old_rows(db)
+        finally:
+            db.close()
+        if job_id is None:
+            break
+        run_job(job_id)
+        ran += 1
+    return ran
+
+
+def queue_stats(db: Session) -> dict:
+    counts = dict(db.query(models.OutboxJob.status, func.count(models.OutboxJob.id)).group_by(models.OutboxJob.status).all())
+    oldest = db.query(func.min(models.OutboxJob.created_at)).filter(models.OutboxJob.status == models.JobStatus.pending).scalar()
+    return {
+        "depth": counts.get(models.JobStatus.pending, 0),
+        "by_status": {s.value: counts.get(s, 0) for s in models.JobStatus},
+        "oldest_pending_age_seconds": (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+        "workers": job_workers.size if job_workers.running else 0,
+        **job_stats.snapshot(),
+    }
+
+
+class JobWorkerPool:
+    def __init__(self, size: int = JOB_WORKERS, poll_seconds: float = JOB_POLL_SECONDS):
+        self.size = size
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self):
+        if self.size <= 0 or self.running:
+            return
+        self._stop.clear()
+        for n in range(self.size):
+            t = threading.Thread(target=self._loop, name=f"job-worker-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        """Nudge idle workers after a commit that enqueued work."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                ran = run_pending_jobs(limit=1)
+            except Exception:
+                logger.exception("job worker loop error")
+                ran = 0
+            if not ran:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+
+job_workers = JobWorkerPool()
+
+
+# -- job kinds --
+
+INVOICE_EMAIL = "invoice_email"
+
+
+def enqueue_invoice_email(db: Session, invoice: models.Invoice) -> bool:
+    return enqueue(db, INVOICE_EMAIL, f"{INVOICE_EMAIL}:{invoice.code}", {"invoice_id": invoice.id})
+
+
+@register(INVOICE_EMAIL)
+def _send_invoice_email(db: Session, payload: dict):
+    invoice = db.get(models.Invoice, payload["invoice_id"], options=invoice_with_lines())
+    if invoice is None:
+        return
+    # Rendering through the cache pre-warms it for the customer's download
+    pdf_bytes, _ = pdf_cache.get_or_render(invoice)
+    if EMAIL_ENABLED:
+        send_invoice_email_if_enabled(invoice.customer.email, pdf_bytes, invoice.code)
+
+
+ROLLUP_REBUILD = "rollup_rebuild"
+
+
+def enqueue_rollup_rebuild(db: Session, rebuilt_at: Optional[datetime]) -> bool:
+    # Keyed by the rebuild being replaced, so every stale read until it lands queues one job
+    generation = rebuilt_at.isoformat() if rebuilt_at else "never"
+    return enqueue(db, ROLLUP_REBUILD, f"{ROLLUP_REBUILD}:{SALES_ROLLUP}:{generation}", {})
+
+
+@register(ROLLUP_REBUILD)
+def _rebuild_rollups(db: Session, payload: dict):
+    rebuild_rollups(db)
@@ -1,8 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import init_db
-from .routers import auth, products, cart, carts, invoices, analytics, customers
+from .cache import shared_cache
+from .config import DB_ASYNC, DB_AUTO_MIGRATE, METRICS_ENABLED, PROFILING_ENABLED
+from .database import async_engine, init_db, pending_migrations
+from .jobs import job_workers
+from .metrics import MetricsMiddleware
+from .utils.password_pool import password_pool
+from .routers import auth, products, cart, carts, invoices, analytics, customers, diagnostics, events, metrics
 
 app = FastAPI(title="Self-Checkout & Billing API")
 
@@ -14,25 +19,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+if PROFILING_ENABLED:
+    from .profiling import ProfilingMiddleware
+
+    app.add_middleware(ProfilingMiddleware)
+if METRICS_ENABLED:
+    # Added last so it is outermost and times the whole stack, CORS included
+    app.add_middleware(MetricsMiddleware)
 
 
 @app.on_event("startup")
 def on_startup():
-    init_db()
+    if DB_AUTO_MIGRATE:
+        init_db()
+    else:
+        # Several workers: scripts/migrate.py changes the schema once per deploy; a worker only checks it
+        pending = pending_migrations()
+        if pending:
+            raise RuntimeError(f"database schema is behind the models ({', '.join(pending[:10])}); run scripts/migrate.py")
+    shared_cache.start()
+    job_workers.start()
+    password_pool.start()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    job_workers.stop()
+    password_pool.stop()
+    shared_cache.stop()
+
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    # aiosqlite runs each pooled connection on a non-daemon thread, which would keep the process alive
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 # Routers
+if DB_ASYNC:
+    # Registered first so they take precedence; endpoints without an async mirror fall through to the sync routers
+    from .routers import async_cart, async_invoices, async_products
+
+    app.include_router(async_products.router)
+    app.include_router(async_cart.router)
+    app.include_router(async_invoices.router)
 app.include_router(auth.router)
 app.include_router(products.router)
 app.include_router(cart.router)  # legacy cart endpoints
 app.include_router(carts.router)  # new pluralized carts endpoints
 app.include_router(invoices.router)
+app.include_router(events.router)
 app.include_router(customers.router)
 app.include_router(analytics.router)
+app.include_router(diagnostics.router)
+if METRICS_ENABLED:
+    app.include_router(metrics.router)
 
 if __name__ == "__main__":
     import uvicorn
+    # Development server; for several workers see "Scale-out" in the README
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
 
@@ -0,0 +1,226 @@
+"""Request, SQL and pool instrumentation, rendered in Prometheus text format at /metrics.
+
+MetricsMiddleware times each request and keeps a per-request RequestStats in a context
+variable; the SQLAlchemy cursor hooks and the timed pool classes in database.py add to
+it (the context is copied into the threadpool that runs sync endpoints, so the same
+object is shared). When SERVER_TIMING_ENABLED is set, the totals are also sent to the
+client as a Server-Timing header.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import SERVER_TIMING_ENABLED
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+JOB_LATENCY_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(**kv) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in kv.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+
+def _fmt_value(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(**labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(key)} {_fmt_value(v)}")
+        return "\n".join(lines)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(**labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._series.items()):
+                running = 0
+                for bound, c in zip(self.buckets + (float("inf"),), counts):
+                    running += c
+                    le = "+Inf" if bound == float("inf") else _fmt_value(bound)
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key, ('le', le))} {running}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {n}")
+        return "\n".join(lines)
+
+
+http_requests = Counter("http_requests_total", "Requests by method, route template and status.")
+http_latency = Histogram("http_request_duration_seconds", "Request latency by method and route template.", LATENCY_BUCKETS)
+http_response_size = Histogram("http_response_size_bytes", "Response body size by method and route template.", SIZE_BUCKETS)
+http_sql_queries = Histogram("http_request_sql_queries", "SQL statements issued per request.", QUERY_COUNT_BUCKETS)
+http_sql_seconds = Histogram("http_request_sql_seconds", "Time spent in SQL per request.", LATENCY_BUCKETS)
+db_query_seconds = Histogram("db_query_duration_seconds", "Duration of individual SQL statements.", SQL_LATENCY_BUCKETS)
+db_pool_wait_seconds = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting to check a connection out of the pool.", SQL_LATENCY_BUCKETS)
+job_runs = Counter("jobs_total", "Background job runs by kind and outcome (done, retry, failed).")
+job_latency = Histogram("job_latency_seconds", "Time from enqueue to successful completion, by job kind.", JOB_LATENCY_BUCKETS)
+
+REGISTRY = [
+    http_requests, http_latency, http_response_size, http_sql_queries, http_sql_seconds, db_query_seconds, db_pool_wait_seconds,
+    job_runs, job_latency,
+]
+
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_seconds", "pool_wait_seconds")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def observe_pool_wait(seconds: float):
+    db_pool_wait_seconds.observe(seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_metrics_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("_metrics_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    db_query_seconds.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_seconds += elapsed
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+
+def server_timing(app_seconds: float, stats: RequestStats) -> str:
+    return (
+        f'app;dur={app_seconds * 1e3:.1f}, '
+        f'db;dur={stats.sql_seconds * 1e3:.1f};desc="{stats.sql_count} queries", '
+        f'pool;dur={stats.pool_wait_seconds * 1e3:.1f}'
+    )
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware) so streaming responses pass through untouched."""
+
+    def __init__(self, app, server_timing: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(time.perf_counter() - start, stats).encode()))
+                    message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - start
+            method, route = scope["method"], _route_template(scope)
+            http_requests.inc(method=method, route=route, status=status)
+            http_latency.observe(elapsed, method=method, route=route)
+            http_response_size.observe(size, method=method, route=route)
+            http_sql_queries.observe(stats.sql_count, method=method, route=route)
+            http_sql_seconds.observe(stats.sql_seconds, method=method, route=route)
+
+
+def _gauge(name: str, samples) -> str:
+    lines = [f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{_fmt_labels(labels)} {_fmt_value(v)}" for labels, v in samples)
+    return "\n".join(lines)
+
+
+def render_metrics(pools: Dict[str, dict] = None, jobs: Optional[dict] = None) -> str:
+    """All metrics in Prometheus text exposition format; `pools` adds db_pool_* gauges from pool_status(),
+    `jobs` adds job_queue_* gauges from jobs.queue_stats()."""
+    parts = [m.render() for m in REGISTRY]
+    if pools:
+        for field in ("size", "checkedin", "checkedout", "overflow"):
+            samples = [(_labels(engine=name), status[field]) for name, status in pools.items() if field in status]
+            if samples:
+                parts.append(_gauge(f"db_pool_{field}", samples))
+    if jobs:
+        parts.append(_gauge("job_queue_depth", [((), jobs["depth"])]))
+        parts.append(_gauge("job_queue_jobs", [(_labels(status=s), n) for s, n in sorted(jobs["by_status"].items())]))
+        parts.append(_gauge("job_queue_oldest_pending_age_seconds", [((), jobs["oldest_pending_age_seconds"])]))
+        parts.append(_gauge("job_workers", [((), jobs["workers"])]))
+    return "\n".join(parts) + "\n"
@@ -6,10 +6,12 @@ from sqlalchemy import (
     Integer,
     String,
     Float,
+    Date,
     DateTime,
     ForeignKey,
     Enum as SAEnum,
     UniqueConstraint,
+    Index,
 )
 from sqlalchemy.orm import relationship
 
@@ -26,6 +28,19 @@ class InvoiceStatus(str, Enum):
     paid = "paid"
 
 
+class ReservationStatus(str, Enum):
+    held = "held"
+    committed = "committed"
+    released = "released"
+
+
+class JobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
 class Customer(Base):
     __tablename__ = "customers"
     id = Column(Integer, primary_key=True, index=True)
@@ -64,6 +79,13 @@ class Product(Base):
     cart_items = relationship("CartItem", back_populates="product")
 
 
+class CacheVersion(Base):
+    """Shared version counters; bumped on writes so every worker can spot stale caches."""
+    __tablename__ = "cache_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
 class Cart(Base):
     __tablename__ = "carts"
     id = Column(Integer, primary_key=True, index=True)
@@ -71,6 +93,12 @@ class Cart(Base):
     status = Column(SAEnum(CartStatus), default=CartStatus.active, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Running totals, kept in step with cart_items by the cart handlers (item_count = total units)
+    total = Column(Float, nullable=False, default=0.0)
+    total_weight = Column(Float, nullable=False, default=0.0)
+    item_count = Column(Integer, nullable=False, default=0)
+    # Bumped with every change to the lines (alongside the totals); clients key deltas on it
+    version = Column(Integer, nullable=False, default=0)
 
     customer = relationship("Customer", back_populates="carts")
     items = relationship("CartItem", back_populates="cart", cascade="all, delete-orphan")
@@ -94,6 +122,21 @@ class CartItem(Base):
     )
 
 
+class CartOp(Base):
+    """Client op ids already applied to a cart, so a retried /cart/scan-batch does not scan twice."""
+    __tablename__ = "cart_ops"
+    id = Column(Integer, primary_key=True, index=True)
+    cart_id = Column(Integer, ForeignKey("carts.id"), nullable=False)
+    op_id = Column(String, nullable=False)
+    version = Column(Integer, nullable=False)  # cart version the op was applied in
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("cart_id", "op_id", name="uq_cart_op"),
+        Index("ix_cart_ops_created_at", "created_at"),
+    )
+
+
 class Invoice(Base):
     __tablename__ = "invoices"
     id = Column(Integer, primary_key=True, index=True)
@@ -112,6 +155,11 @@ class Invoice(Base):
     official = relationship("StoreOfficial", back_populates="invoices")
     items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Backs keyset pagination of a customer's history on (date, id)
+        Index("ix_invoices_customer_date", "customer_id", "date"),
+    )
+
 
 class InvoiceItem(Base):
     __tablename__ = "invoice_items"
@@ -126,3 +174,84 @@ class InvoiceItem(Base):
     # product relationship optional; not strictly needed for lookups
     product = relationship("Product")
 
+
+
+class StockReservation(Base):
+    """Stock taken out of products.available_qty at checkout; committed on payment, returned on release/expiry."""
+    __tablename__ = "stock_reservations"
+    id = Column(Integer, primary_key=True, index=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    status = Column(SAEnum(ReservationStatus), default=ReservationStatus.held, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    released_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_stock_reservations_status_expires", "status", "expires_at"),)
+
+
+class OutboxJob(Base):
+    """Durable background job, written in the same transaction as the change that needs it."""
+    __tablename__ = "outbox_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    dedupe_key = Column(String, unique=True, index=True, nullable=False)  # e.g., invoice_email:<code>
+    payload = Column(String, nullable=False, default="{}")  # JSON
+    status = Column(SAEnum(JobStatus), default=JobStatus.pending, nullable=False, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_outbox_jobs_status_finished", "status", "finished_at"),)
+
+
+class IdempotencyKey(Base):
+    """Stored response of a checkout/finalize/pay request, replayed when the client retries with the same Idempotency-Key."""
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True, index=True)
+    owner = Column(String, nullable=False)  # principal the key belongs to, e.g. customer:12
+    key = Column(String, nullable=False)
+    request_hash = Column(String, nullable=False)  # route + parameters the key was first used with
+    status_code = Column(Integer, nullable=True)  # NULL while the first request is still running
+    response = Column(String, nullable=True)  # JSON body
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("owner", "key", name="uq_idempotency_owner_key"),
+    )
+
+
+class DailySales(Base):
+    """Paid-invoice rollup per invoice date; maintained on payment, rebuilt by scripts/rebuild_rollups.py."""
+    __tablename__ = "sales_daily"
+    day = Column(Date, primary_key=True)
+    revenue = Column(Float, nullable=False, default=0.0)
+    invoice_count = Column(Integer, nullable=False, default=0)
+
+
+class CustomerSales(Base):
+    """All-time paid-invoice rollup per customer."""
+    __tablename__ = "sales_by_customer"
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    spent = Column(Float, nullable=False, default=0.0)
+    invoice_count = Column(Integer, nullable=False, default=0)
+
+
+class CustomerDailySales(Base):
+    """Paid-invoice rollup per customer and invoice date, so date-filtered top customers read rollups too."""
+    __tablename__ = "sales_by_customer_day"
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    spent = Column(Float, nullable=False, default=0.0)
+    invoice_count = Column(Integer, nullable=False, default=0)
+
+
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+    name = Column(String, primary_key=True)
+    rebuilt_at = Column(DateTime, nullable=True)
@@ -0,0 +1,259 @@
+"""Opt-in sampling profiler for slow requests.
+
+ProfilingMiddleware opens a ProfileSession for a PROFILE_SAMPLE_RATE fraction of requests.
+While any session is open, one sampler thread snapshots the stacks of the threads that
+session runs on every PROFILE_INTERVAL_MS: the event-loop thread, plus each threadpool
+thread the request issued SQL from (sync endpoints run in the threadpool, where cProfile
+enabled on the loop thread would see nothing). Statements are captured via the cursor
+hooks below. If the request took at least PROFILE_SLOW_MS and its route matches
+PROFILE_ROUTES, the session is written as JSON into PROFILE_DIR, which keeps only the
+newest PROFILE_MAX_FILES.
+"""
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Optional
+from uuid import uuid4
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_MAX_FILES, PROFILE_ROUTES, PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS
+
+logger = logging.getLogger(__name__)
+
+MAX_STATEMENTS = 500
+MAX_STACK_DEPTH = 64
+PROFILE_ID_RE = re.compile(r"^[0-9]{13}-[0-9a-f]{8}$")
+
+
+class ProfileSession:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.thread_ids = {threading.get_ident()}
+        self.samples: Counter = Counter()
+        self.statements: List[dict] = []
+        self.dropped_statements = 0
+        self.lock = threading.Lock()
+
+    def add_statement(self, statement: str, seconds: float, executemany: bool):
+        with self.lock:
+            if len(self.statements) >= MAX_STATEMENTS:
+                self.dropped_statements += 1
+                return
+            self.statements.append({
+                "sql": " ".join(statement.split())[:2000],
+                "ms": round(seconds * 1e3, 3),
+                "executemany": executemany,
+                "thread": threading.get_ident(),
+            })
+
+
+_current: ContextVar[Optional[ProfileSession]] = ContextVar("profile_session", default=None)
+
+
+def _fold(frame) -> str:
+    """Root-first `module:function:line` frames joined by ';' (flamegraph "folded" format)."""
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class Sampler:
+    """One daemon thread shared by all open sessions; idle when there are none."""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = max(0.001, interval_ms / 1000)
+        self._sessions: set = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.add(session)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="profile-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.discard(session)
+
+    def _loop(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                sessions = list(self._sessions)
+            if not sessions:
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for session in sessions:
+                with session.lock:
+                    tids = list(session.thread_ids)
+                for tid in tids:
+                    frame = frames.get(tid)
+                    if frame is not None and tid != me:
+                        session.samples[_fold(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+sampler = Sampler()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    session = _current.get()
+    if session is not None:
+        with session.lock:
+            session.thread_ids.add(threading.get_ident())
+        conn.info.setdefault("_profile_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    session = _current.get()
+    started = conn.info.get("_profile_started")
+    if session is not None and started:
+        session.add_statement(statement, time.perf_counter() - started.pop(), executemany)
+
+
+class ProfileStore:
+    """Bounded directory of profile JSON files, oldest deleted first."""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def save(self, profile: dict) -> str:
+        profile_id = f"{int(time.time() * 1000):013d}-{uuid4().hex[:8]}"
+        profile["id"] = profile_id
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(profile_id)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(profile, f)
+        os.replace(tmp, path)
+        with self._lock:
+            for stale in self._ids()[self.max_files:]:
+                try:
+                    os.remove(self._path(stale))
+                except FileNotFoundError:
+                    pass
+        return profile_id
+
+    def _ids(self) -> List[str]:
+        """Newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        ids = [n[:-5] for n in os.listdir(self.directory) if n.endswith(".json") and PROFILE_ID_RE.match(n[:-5])]
+        return sorted(ids, reverse=True)
+
+    def list(self) -> List[dict]:
+        out = []
+        for profile_id in self._ids():
+            profile = self.load(profile_id)
+            if profile is None:
+                continue
+            out.append({k: profile.get(k) for k in ("id", "method", "path", "route", "status", "duration_ms", "started_at", "sample_count", "statement_count")})
+        return out
+
+    def load(self, profile_id: str) -> Optional[dict]:
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        try:
+            with open(self._path(profile_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+profile_store = ProfileStore()
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, slow_ms: float = PROFILE_SLOW_MS, sample_rate: float = PROFILE_SAMPLE_RATE, routes=PROFILE_ROUTES, store: ProfileStore = profile_store):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.routes = set(routes)
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        # SSE streams (/events/*) stay open for minutes; profiling them would only record waiting
+        if scope["type"] != "http" or scope["path"].startswith("/events/") or random.random() >= self.sample_rate:
+            return await self.app(scope, receive, send)
+        session = ProfileSession(scope["method"], scope["path"])
+        token = _current.set(session)
+        sampler.add(session)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.remove(session)
+            _current.reset(token)
+            elapsed_ms = (time.perf_counter() - start) * 1e3
+            route = _route_template(scope)
+            if elapsed_ms >= self.slow_ms and (not self.routes or route in self.routes):
+                self._save(session, route, status, elapsed_ms)
+
+    def _save(self, session: ProfileSession, route: str, status: int, elapsed_ms: float):
+        with session.lock:
+            samples = session.samples.most_common()
+            statements = list(session.statements)
+        try:
+            self.store.save({
+                "method": session.method,
+                "path": session.path,
+                "route": route,
+                "status": status,
+                "duration_ms": round(elapsed_ms, 1),
+                "started_at": session.started_at.isoformat() + "Z",
+                "interval_ms": sampler.interval * 1e3,
+                "sample_count": sum(n for _, n in samples),
+                "statement_count": len(statements) + session.dropped_statements,
+                "sql_ms": round(sum(s["ms"] for s in statements), 3),
+                "statements": statements,
+                "stacks": [{"stack": stack, "samples": n} for stack, n in samples],
+            })
+        except OSError:
+            logger.exception("could not write profile for %s %s", session.method, session.path)
+
+
+def folded(profile: dict) -> str:
+    """Brendan Gregg's folded-stack text, for flamegraph.pl / speedscope."""
+    return "".join(f"{s['stack']} {s['samples']}\n" for s in profile.get("stacks", []))
@@ -0,0 +1,17 @@
+"""Eager-loading strategies for the hot read paths, so serializers never trigger lazy loads."""
+from sqlalchemy.orm import joinedload, selectinload
+
+from . import models
+
+
+def cart_with_lines():
+    # cart -> items (one SELECT ... IN) -> product (joined into that SELECT)
+    return (selectinload(models.Cart.items).joinedload(models.CartItem.product),)
+
+
+def invoice_with_lines():
+    # customer is many-to-one: join it; items + product come in one extra SELECT
+    return (
+        joinedload(models.Invoice.customer),
+        selectinload(models.Invoice.items).joinedload(models.InvoiceItem.product),
+    )
@@ -1,41 +1,68 @@
+import io
 from datetime import date
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import Response
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from ..database import get_db
 from .. import models
-from ..dependencies import get_current_official
+from ..dependencies import get_current_official, require_admin
+from ..utils import reporting
+from ..jobs import enqueue_rollup_rebuild, job_workers
+from ..utils.rollups import SALES_ROLLUP, rebuild_rollups, rollup_status
 from ..schemas import AnalyticsSummary
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
 
 @router.get("/summary", response_model=AnalyticsSummary)
-def summary(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(get_current_official)):
-    total_revenue = db.query(func.coalesce(func.sum(models.Invoice.total), 0.0)).filter(models.Invoice.status == models.InvoiceStatus.paid).scalar() or 0.0
-    total_paid_invoices = db.query(func.count(models.Invoice.id)).filter(models.Invoice.status == models.InvoiceStatus.paid).scalar() or 0
-
-    # daily sales
-    rows = (
-        db.query(func.date(models.Invoice.date).label("d"), func.coalesce(func.sum(models.Invoice.total), 0.0))
-        .filter(models.Invoice.status == models.InvoiceStatus.paid)
-        .group_by(func.date(models.Invoice.date))
-        .order_by(func.date(models.Invoice.date))
-        .all()
-    )
-    daily_sales = [{"date": str(r[0]), "total": float(r[1])} for r in rows]
-
-    # top customers by total spent
-    rows2 = (
-        db.query(models.Customer.id, models.Customer.name, func.coalesce(func.sum(models.Invoice.total), 0.0).label("spent"))
-        .join(models.Invoice, models.Invoice.customer_id == models.Customer.id)
-        .filter(models.Invoice.status == models.InvoiceStatus.paid)
-        .group_by(models.Customer.id, models.Customer.name)
-        .order_by(func.sum(models.Invoice.total).desc())
-        .limit(5)
-        .all()
-    )
+def summary(
+    start: date | None = None,
+    end: date | None = None,
+    db: Session = Depends(get_db),
+    _: models.StoreOfficial = Depends(get_current_official),
+):
+    # Serve the rollups as they are; a stale (or never built) set is rebuilt by a background job
+    as_of, stale = rollup_status(db)
+    if stale and enqueue_rollup_rebuild(db, as_of):
+        db.commit()
+        job_workers.wake()
+
+    # daily sales (and totals) from the daily rollup
+    q = db.query(models.DailySales)
+    if start:
+        q = q.filter(models.DailySales.day >= start)
+    if end:
+        q = q.filter(models.DailySales.day <= end)
+    days = q.order_by(models.DailySales.day).all()
+    daily_sales = [{"date": str(d.day), "total": float(d.revenue)} for d in days]
+    total_revenue = sum(d.revenue for d in days)
+    total_paid_invoices = sum(d.invoice_count for d in days)
+
+    # top customers by total spent: all-time rollup, or the per-customer daily rollup inside the range
+    if start is None and end is None:
+        rows2 = (
+            db.query(models.Customer.id, models.Customer.name, models.CustomerSales.spent)
+            .join(models.CustomerSales, models.CustomerSales.customer_id == models.Customer.id)
+            .order_by(models.CustomerSales.spent.desc())
+            .limit(5)
+            .all()
+        )
+    else:
+        spent = func.sum(models.CustomerDailySales.spent)
+        q2 = db.query(models.CustomerDailySales.customer_id, spent.label("spent"))
+        if start:
+            q2 = q2.filter(models.CustomerDailySales.day >= start)
+        if end:
+            q2 = q2.filter(models.CustomerDailySales.day <= end)
+        top = q2.group_by(models.CustomerDailySales.customer_id).order_by(spent.desc()).limit(5).subquery()
+        rows2 = (
+            db.query(models.Customer.id, models.Customer.name, top.c.spent)
+            .join(top, top.c.customer_id == models.Customer.id)
+            .order_by(top.c.spent.desc())
+            .all()
+        )
     top_customers = [{"customer_id": r[0], "name": r[1], "spent": float(r[2])} for r in rows2]
 
     return AnalyticsSummary(
@@ -43,5 +70,75 @@ def summary(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(get
         total_paid_invoices=int(total_paid_invoices or 0),
         daily_sales=daily_sales,
         top_customers=top_customers,
+        as_of=as_of,
+        rebuild_pending=stale,
     )
 
+
+@router.post("/rollups/rebuild")
+def rebuild(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(require_admin)):
+    rebuild_rollups(db)
+    return {"rebuilt_at": db.get(models.RollupState, SALES_ROLLUP).rebuilt_at}
+
+
+@router.get("/basket-sizes")
+def basket_sizes(
+    start: date | None = None,
+    end: date | None = None,
+    max_size: int = Query(50, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    _: models.StoreOfficial = Depends(get_current_official),
+):
+    return reporting.basket_size_distribution(reporting.extract_lines(db, start, end), max_size=max_size)
+
+
+@router.get("/product-revenue")
+def product_revenue(
+    start: date | None = None,
+    end: date | None = None,
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db),
+    _: models.StoreOfficial = Depends(get_current_official),
+):
+    rows = reporting.product_revenue(reporting.extract_lines(db, start, end), limit=limit)
+    names = dict(db.query(models.Product.id, models.Product.name).filter(models.Product.id.in_([r["product_id"] for r in rows])).all())
+    return [{**r, "name": names.get(r["product_id"])} for r in rows]
+
+
+@router.get("/hourly-heatmap")
+def hourly_heatmap(
+    start: date | None = None,
+    end: date | None = None,
+    tz_offset_minutes: int = Query(330, ge=-720, le=840),
+    db: Session = Depends(get_db),
+    _: models.StoreOfficial = Depends(get_current_official),
+):
+    return reporting.hourly_heatmap(reporting.extract_lines(db, start, end), tz_offset_minutes=tz_offset_minutes)
+
+
+@router.get("/reconciliation")
+def reconciliation(
+    start: date | None = None,
+    end: date | None = None,
+    tolerance: float = Query(0.01, ge=0),
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db),
+    _: models.StoreOfficial = Depends(get_current_official),
+):
+    return reporting.weight_price_reconciliation(reporting.extract_lines(db, start, end), tolerance=tolerance, limit=limit)
+
+
+@router.get("/export.npz")
+def export_lines(
+    start: date | None = None,
+    end: date | None = None,
+    db: Session = Depends(get_db),
+    _: models.StoreOfficial = Depends(get_current_official),
+):
+    buf = io.BytesIO()
+    reporting.extract_lines(db, start, end).save(buf)
+    return Response(
+        buf.getvalue(),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": 'attachment; filename="invoice_lines.npz"'},
+    )
@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, Header, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_async_db
+from .. import models
+from ..schemas import CartDeltaOut, CartOut, ScanBatchRequest, ScanRequest, UpdateQuantityRequest, InvoiceOut, FinalizeFromItemsRequest
+from ..dependencies import get_current_customer_async
+from . import cart
+
+# Async mirror of routers/cart.py (DB_ASYNC=true)
+router = APIRouter(prefix="/cart", tags=["cart"])
+
+
+@router.get("/", response_model=CartOut)
+async def get_cart(response: Response, if_none_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer_async), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: cart.get_cart(response, if_none_match, customer=customer, db=s))
+
+
+@router.post("/scan", response_model=CartOut)
+async def scan_product(payload: ScanRequest, response: Response, if_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer_async), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: cart.scan_product(payload, response, if_match, customer=customer, db=s))
+
+
+@router.post("/update", response_model=CartOut)
+async def update_quantity(payload: UpdateQuantityRequest, response: Response, if_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer_async), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: cart.update_quantity(payload, response, if_match, customer=customer, db=s))
+
+
+@router.post("/scan-batch", response_model=CartDeltaOut)
+async def scan_batch(payload: ScanBatchRequest, response: Response, if_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer_async), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: cart.scan_batch(payload, response, if_match, customer=customer, db=s))
+
+
+@router.post("/finalize", response_model=InvoiceOut)
+async def finalize_cart(idempotency_key: str | None = Header(None), customer: models.Customer = Depends(get_current_customer_async), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: cart.finalize_cart(idempotency_key, customer=customer, db=s))
+
+
+@router.post("/finalize-from-items", response_model=InvoiceOut)
+async def finalize_from_items(payload: FinalizeFromItemsRequest, idempotency_key: str | None = Header(None), customer: models.Customer = Depends(get_current_customer_async), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: cart.finalize_from_items(payload, idempotency_key, customer=customer, db=s))
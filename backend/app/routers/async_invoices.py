@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, Header
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..database import get_async_db
+from ..dependencies import get_current_official_async, get_current_customer_async
+from ..schemas import InvoiceOut, InvoiceDetailOut
+from . import invoices
+
+# Async mirror of routers/invoices.py (DB_ASYNC=true). Only DB-bound endpoints are mirrored;
+# PDF/QR rendering stays on the sync router's threadpool so CPU work never runs on the event loop.
+router = APIRouter(prefix="/invoices", tags=["invoices"])
+
+
+@router.get("/by-code/{code}", response_model=InvoiceDetailOut)
+async def get_invoice_by_code(code: str, db: AsyncSession = Depends(get_async_db), official: models.StoreOfficial = Depends(get_current_official_async)):
+    return await db.run_sync(lambda s: invoices.get_invoice_by_code(code, db=s, official=official))
+
+
+@router.post("/{id}/pay", response_model=InvoiceOut)
+async def pay_invoice(id: int, idempotency_key: str | None = Header(None), db: AsyncSession = Depends(get_async_db), official: models.StoreOfficial = Depends(get_current_official_async)):
+    return await db.run_sync(lambda s: invoices.pay_invoice(id, idempotency_key, db=s, official=official))
+
+
+@router.post("/{code}/mark_paid", response_model=InvoiceOut)
+async def mark_paid(code: str, db: AsyncSession = Depends(get_async_db), official: models.StoreOfficial = Depends(get_current_official_async)):
+    return await db.run_sync(lambda s: invoices.mark_paid(code, db=s, official=official))
+
+
+@router.get("/me/history", response_model=list[InvoiceOut])
+async def my_invoices(db: AsyncSession = Depends(get_async_db), customer: models.Customer = Depends(get_current_customer_async)):
+    return await db.run_sync(lambda s: invoices.my_invoices(db=s, customer=customer))
@@ -0,0 +1,39 @@
+from typing import List
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_async_db
+from .. import models
+from ..schemas import ProductCreate, ProductOut
+from ..dependencies import get_current_official_async
+from . import products
+
+# Async mirror of routers/products.py (DB_ASYNC=true). Handlers run the sync logic on the
+# request's AsyncSession via run_sync, so I/O goes through the asyncio driver.
+router = APIRouter(prefix="/products", tags=["products"])
+
+
+@router.get("/", response_model=List[ProductOut])
+async def list_products(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: products.list_products(db=s))
+
+
+@router.get("/by-id/{product_id}", response_model=ProductOut)
+async def get_product_by_id(product_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: products.get_product_by_id(product_id, db=s))
+
+
+@router.get("/{code}", response_model=ProductOut)
+async def get_product_by_code_public(code: str, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: products.get_product_by_code_public(code, db=s))
+
+
+@router.get("/by-code/{code}", response_model=ProductOut)
+async def get_product_by_code(code: str, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda s: products.get_product_by_code(code, db=s))
+
+
+@router.post("/", response_model=ProductOut)
+async def create_product(payload: ProductCreate, db: AsyncSession = Depends(get_async_db), official: models.StoreOfficial = Depends(get_current_official_async)):
+    return await db.run_sync(lambda s: products.create_product(payload, db=s, _=official))
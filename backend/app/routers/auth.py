@@ -4,10 +4,12 @@ from sqlalchemy.orm import Session
 from .. import models
 from ..database import get_db
 from ..schemas import CustomerCreate, OfficialCreate, OfficialOut, CustomerOut, LoginRequest, Token
-from ..security import verify_password, get_password_hash, create_access_token
+from ..security import create_access_token
 from fastapi import Header
 from ..dependencies import require_admin, get_current_official
 from ..security import decode_token
+from ..utils.password_pool import PasswordPoolBusy, password_pool
+from ..utils.principals import load_principal, principal_cache
 from pydantic import BaseModel, EmailStr
 
 # Google id_token verification
@@ -18,6 +20,29 @@ from ..config import GOOGLE_CLIENT_ID
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
+def _busy():
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many logins in progress, retry shortly", headers={"Retry-After": "1"})
+
+
+def _hash_password(password: str) -> str:
+    try:
+        return password_pool.hash(password)
+    except PasswordPoolBusy:
+        raise _busy()
+
+
+def _check_password(db: Session, user, password: str) -> bool:
+    """Verify off-thread; on success, upgrade a hash made with an outdated bcrypt cost."""
+    try:
+        ok, new_hash = password_pool.verify_and_update(password, user.hashed_password)
+    except PasswordPoolBusy:
+        raise _busy()
+    if ok and new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+    return ok
+
+
 class MeOut(BaseModel):
     role: str
     name: str
@@ -33,7 +58,7 @@ def customer_signup(payload: CustomerCreate, db: Session = Depends(get_db)):
         name=payload.name,
         email=payload.email,
         phone=payload.phone,
-        hashed_password=get_password_hash(payload.password),
+        hashed_password=_hash_password(payload.password),
     )
     db.add(user)
     db.commit()
@@ -44,9 +69,9 @@ def customer_signup(payload: CustomerCreate, db: Session = Depends(get_db)):
 @router.post("/customer/login", response_model=Token)
 def customer_login(payload: LoginRequest, db: Session = Depends(get_db)):
     user = db.query(models.Customer).filter(models.Customer.email == payload.email).first()
-    if not user or not verify_password(payload.password, user.hashed_password):
+    if not user or not _check_password(db, user, payload.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-    token = create_access_token(subject=user.email, role="customer")
+    token = create_access_token(subject=user.email, role="customer", uid=user.id)
     return Token(access_token=token, role="customer")
 
 
@@ -75,23 +100,23 @@ def customer_google_login(payload: GoogleLoginRequest, db: Session = Depends(get
             name=name,
             email=email,
             phone=None,
-            hashed_password=get_password_hash(email + "_google"),
+            hashed_password=_hash_password(email + "_google"),
         )
         db.add(user)
         db.commit()
         db.refresh(user)
 
-    token = create_access_token(subject=user.email, role="customer")
+    token = create_access_token(subject=user.email, role="customer", uid=user.id)
     return Token(access_token=token, role="customer")
 
 
 @router.post("/official/login", response_model=Token)
 def official_login(payload: LoginRequest, db: Session = Depends(get_db)):
     user = db.query(models.StoreOfficial).filter(models.StoreOfficial.email == payload.email).first()
-    if not user or not verify_password(payload.password, user.hashed_password):
+    if not user or not _check_password(db, user, payload.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     role = user.role or "cashier"
-    token = create_access_token(subject=user.email, role=role)
+    token = create_access_token(subject=user.email, role=role, uid=user.id)
     return Token(access_token=token, role=role)
 
 
@@ -104,7 +129,7 @@ def official_signup(payload: OfficialCreate, db: Session = Depends(get_db), _: m
         name=payload.name,
         email=payload.email,
         role=payload.role,
-        hashed_password=get_password_hash(payload.password),
+        hashed_password=_hash_password(payload.password),
     )
     db.add(user)
     db.commit()
@@ -117,22 +142,20 @@ def me(authorization: str | None = Header(None), db: Session = Depends(get_db)):
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
     token = authorization.split(" ", 1)[1]
-    try:
-        payload = decode_token(token)
-    except Exception:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    email = payload.get("sub")
-    role = payload.get("role")
-    if not email or not role:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
-    if role == "customer":
-        user = db.query(models.Customer).filter(models.Customer.email == email).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        return MeOut(role="customer", name=user.name, email=user.email)
-    else:
-        user = db.query(models.StoreOfficial).filter(models.StoreOfficial.email == email).first()
-        if not user:
+    principal = principal_cache.get(token)
+    if principal is None:
+        try:
+            payload = decode_token(token)
+        except Exception:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        if not payload.get("sub") or not payload.get("role"):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
+        # Scoped (stream) tokens are refused here as everywhere but their own route; caching one
+        # would let the principal cache answer for it as a login token
+        if payload.get("scope") is not None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token not valid here")
+        principal = load_principal(db, payload)
+        if not principal:
             raise HTTPException(status_code=404, detail="User not found")
-        return MeOut(role=user.role or "cashier", name=user.name, email=user.email)
-
+        principal_cache.put(token, principal, payload.get("exp"))
+    return MeOut(role=principal.role, name=principal.name, email=principal.email)
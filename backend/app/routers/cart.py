@@ -1,22 +1,29 @@
 from uuid import uuid4
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Callable, List
 
 from ..database import get_db
 from .. import models
-from ..schemas import CartOut, CartItemOut, ScanRequest, UpdateQuantityRequest, InvoiceOut, FinalizeFromItemsRequest
-from ..dependencies import get_current_customer
+from ..schemas import CartDeltaOut, CartOut, CartItemOut, ScanBatchRequest, ScanRequest, UpdateQuantityRequest, InvoiceOut, FinalizeFromItemsRequest
+from ..dependencies import get_current_customer, idempotent
+from ..events import line_payload, publish_cart_lines, publish_cart_status, totals_payload
+from ..queries import cart_with_lines
+from ..utils.catalog import catalog_cache
+from ..utils.cart_lines import bulk_insert_cart_items, bump_cart_totals, cart_etag, claim_cart_version, merge_by_code, set_cart_totals
+from ..utils.idempotency import request_hash
+from ..utils.pdf_cache import etag_matches
 
 router = APIRouter(prefix="/cart", tags=["cart"])
 
 
-def _get_or_create_active_cart(db: Session, customer_id: int) -> models.Cart:
-    cart = (
-        db.query(models.Cart)
-        .filter(models.Cart.customer_id == customer_id, models.Cart.status == models.CartStatus.active)
-        .first()
-    )
+def _get_or_create_active_cart(db: Session, customer_id: int, with_lines: bool = False) -> models.Cart:
+    q = db.query(models.Cart).filter(models.Cart.customer_id == customer_id, models.Cart.status == models.CartStatus.active)
+    if with_lines:
+        q = q.options(*cart_with_lines())
+    cart = q.first()
     if not cart:
         cart = models.Cart(customer_id=customer_id, status=models.CartStatus.active)
         db.add(cart)
@@ -25,74 +32,112 @@ def _get_or_create_active_cart(db: Session, customer_id: int) -> models.Cart:
     return cart
 
 
-def _recalc_item(item: models.CartItem):
-    p = item.product
+def _recalc_item(item: models.CartItem, product=None):
+    p = product or item.product
     item.subtotal = p.price_per_unit * item.quantity
     item.net_weight = p.weight_per_unit * item.quantity
 
 
-def _cart_totals(cart: models.Cart):
-    total = sum(i.subtotal for i in cart.items)
-    total_weight = sum(i.net_weight for i in cart.items)
-    return total, total_weight
+def _reload_cart(db: Session, cart_id: int) -> models.Cart:
+    """Re-read a cart after a write with its lines and products in two queries."""
+    return db.get(models.Cart, cart_id, options=cart_with_lines(), populate_existing=True)
+
+
+def _publish_lines(cart: models.Cart, products):
+    """Push the cart's lines for `products` (quantity 0 once removed) and totals to /events subscribers."""
+    items = {i.product_id: i for i in cart.items}
+    lines = []
+    for p in products:
+        item = items.get(p.id)
+        lines.append(line_payload(p.id, p.name, item.quantity, item.subtotal, item.net_weight) if item else line_payload(p.id, p.name, 0, 0.0, 0.0))
+    publish_cart_lines(cart.id, lines, totals_payload(cart))
+
+
+def _item_out(i: models.CartItem) -> CartItemOut:
+    return CartItemOut(
+        id=i.id,
+        product_id=i.product_id,
+        product_name=i.product.name,
+        quantity=i.quantity,
+        subtotal=i.subtotal,
+        net_weight=i.net_weight,
+    )
 
 
 def _cart_to_out(cart: models.Cart) -> CartOut:
-    items_out: List[CartItemOut] = []
-    for i in cart.items:
-        items_out.append(
-            CartItemOut(
-                id=i.id,
-                product_id=i.product_id,
-                product_name=i.product.name,
-                quantity=i.quantity,
-                subtotal=i.subtotal,
-                net_weight=i.net_weight,
-            )
-        )
-    total, total_weight = _cart_totals(cart)
-    return CartOut(id=cart.id, items=items_out, total=total, total_weight=total_weight)
+    items_out: List[CartItemOut] = [_item_out(i) for i in cart.items]
+    return CartOut(id=cart.id, items=items_out, total=cart.total, total_weight=cart.total_weight, version=cart.version)
+
+
+def check_if_match(db: Session, cart: models.Cart, if_match: str | None) -> bool:
+    """Enforce an If-Match precondition on a cart write. Returns True when it claimed the next version
+    (the caller must then not bump it again); raises 412 with the current cart when it changed elsewhere."""
+    if not if_match:
+        return False
+    if etag_matches(if_match, cart_etag(cart.id, cart.version)) and claim_cart_version(db, cart.id, cart.version):
+        db.expire(cart, ["version"])
+        return True
+    db.rollback()
+    current = _reload_cart(db, cart.id)
+    raise HTTPException(
+        status_code=412,
+        detail={"message": "Cart was changed on another device", "version": current.version, "cart": _cart_to_out(current).model_dump()},
+        headers={"ETag": cart_etag(current.id, current.version)},
+    )
+
+
+def _with_etag(response: Response, cart: models.Cart):
+    response.headers["ETag"] = cart_etag(cart.id, cart.version)
+    response.headers["Cache-Control"] = "private, no-cache"
 
 
 @router.get("/", response_model=CartOut)
-def get_cart(customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
-    cart = _get_or_create_active_cart(db, customer.id)
-    # ensure calculations are correct
-    for item in cart.items:
-        _recalc_item(item)
-    db.commit()
-    db.refresh(cart)
+def get_cart(response: Response, if_none_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+    # Read-only: totals are maintained on write, so nothing is recomputed or committed here.
+    # A conditional GET is answered from the cart row alone.
+    cart = _get_or_create_active_cart(db, customer.id, with_lines=not if_none_match)
+    etag = cart_etag(cart.id, cart.version)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    if if_none_match:
+        cart = _reload_cart(db, cart.id)
+    _with_etag(response, cart)
     return _cart_to_out(cart)
 
 
 @router.post("/scan", response_model=CartOut)
-def scan_product(payload: ScanRequest, customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == payload.product_id).first()
+def scan_product(payload: ScanRequest, response: Response, if_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+    product = catalog_cache.get_by_id(db, payload.product_id)
     if not product:
         raise HTTPException(status_code=400, detail="Invalid Product")
 
     cart = _get_or_create_active_cart(db, customer.id)
+    claimed = check_if_match(db, cart, if_match)
     item = db.query(models.CartItem).filter(models.CartItem.cart_id == cart.id, models.CartItem.product_id == product.id).first()
 
+    qty = max(1, payload.quantity)
     if item:
-        item.quantity += max(1, payload.quantity)
+        old_subtotal, old_weight = item.subtotal, item.net_weight
+        item.quantity += qty
     else:
-        item = models.CartItem(cart_id=cart.id, product_id=product.id, quantity=max(1, payload.quantity))
+        old_subtotal, old_weight = 0.0, 0.0
+        item = models.CartItem(cart_id=cart.id, product_id=product.id, quantity=qty)
         db.add(item)
 
-    db.flush()
-    db.refresh(item)
-
-    _recalc_item(item)
+    _recalc_item(item, product)
+    bump_cart_totals(cart, item.subtotal - old_subtotal, item.net_weight - old_weight, qty, bump_version=not claimed)
     db.commit()
-    db.refresh(cart)
 
+    cart = _reload_cart(db, cart.id)
+    _publish_lines(cart, [product])
+    _with_etag(response, cart)
     return _cart_to_out(cart)
 
 
 @router.post("/update", response_model=CartOut)
-def update_quantity(payload: UpdateQuantityRequest, customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+def update_quantity(payload: UpdateQuantityRequest, response: Response, if_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
     cart = _get_or_create_active_cart(db, customer.id)
+    claimed = check_if_match(db, cart, if_match)
     item = (
         db.query(models.CartItem)
         .filter(models.CartItem.cart_id == cart.id, models.CartItem.product_id == payload.product_id)
@@ -100,23 +145,129 @@ def update_quantity(payload: UpdateQuantityRequest, customer: models.Customer =
     )
     if not item:
         raise HTTPException(status_code=404, detail="Item not in cart")
+    old_subtotal, old_weight, old_qty = item.subtotal, item.net_weight, item.quantity
+    product = catalog_cache.get_by_id(db, item.product_id)
     if payload.quantity <= 0:
         db.delete(item)
+        bump_cart_totals(cart, -old_subtotal, -old_weight, -old_qty, bump_version=not claimed)
     else:
         item.quantity = payload.quantity
-        _recalc_item(item)
+        _recalc_item(item, product)
+        bump_cart_totals(cart, item.subtotal - old_subtotal, item.net_weight - old_weight, item.quantity - old_qty, bump_version=not claimed)
     db.commit()
-    db.refresh(cart)
+    cart = _reload_cart(db, cart.id)
+    _publish_lines(cart, [product])
+    _with_etag(response, cart)
     return _cart_to_out(cart)
 
 
+@router.post("/scan-batch", response_model=CartDeltaOut)
+def scan_batch(payload: ScanBatchRequest, response: Response, if_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+    """Apply buffered scan/set ops in one transaction; by default answer with only the lines they changed."""
+    # Resolve every product up front and reject the whole batch if any is unknown
+    codes = {op.code for op in payload.ops if op.code is not None}
+    by_code, missing = catalog_cache.get_many_by_code(db, codes) if codes else ({}, [])
+    by_id = {}
+    for pid in {op.product_id for op in payload.ops if op.product_id is not None}:
+        product = catalog_cache.get_by_id(db, pid)
+        if product is None:
+            missing.append(str(pid))
+        else:
+            by_id[pid] = product
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Invalid Product: {', '.join(missing)}")
+
+    cart = _get_or_create_active_cart(db, customer.id, with_lines=True)
+    base_version = cart.version
+    claimed = check_if_match(db, cart, if_match)
+    op_ids = {op.op_id for op in payload.ops if op.op_id}
+    seen = set()
+    if op_ids:
+        seen = {r.op_id for r in db.query(models.CartOp.op_id).filter(models.CartOp.cart_id == cart.id, models.CartOp.op_id.in_(op_ids))}
+
+    lines = {i.product_id: i for i in cart.items}
+    touched = {}
+    new_op_ids = []
+    applied = duplicates = 0
+    d_total = d_weight = 0.0
+    d_count = 0
+    for op in payload.ops:
+        if op.op_id:
+            if op.op_id in seen:
+                duplicates += 1
+                continue
+            seen.add(op.op_id)
+            new_op_ids.append(op.op_id)
+        applied += 1
+        product = by_code[op.code] if op.code is not None else by_id[op.product_id]
+        item = lines.get(product.id)
+        old_subtotal, old_weight, old_qty = (item.subtotal, item.net_weight, item.quantity) if item else (0.0, 0.0, 0)
+        new_qty = old_qty + max(1, op.quantity) if op.op == "scan" else max(0, op.quantity)
+        if item is None:
+            if new_qty == 0:
+                continue
+            item = lines[product.id] = models.CartItem(cart_id=cart.id, product_id=product.id)
+            db.add(item)
+        # Emptied lines are deleted after the loop, so a later op in the batch can bring them back
+        item.quantity = new_qty
+        _recalc_item(item, product)
+        d_total += item.subtotal - old_subtotal
+        d_weight += item.net_weight - old_weight
+        d_count += new_qty - old_qty
+        touched[product.id] = product
+
+    if applied:
+        if touched:
+            for pid in touched:
+                if lines[pid].quantity == 0:
+                    # A line added and emptied within this batch was never inserted
+                    if lines[pid] in db.new:
+                        db.expunge(lines[pid])
+                    else:
+                        db.delete(lines[pid])
+            bump_cart_totals(cart, d_total, d_weight, d_count, bump_version=not claimed)
+        try:
+            if new_op_ids:
+                db.flush()
+                db.execute(insert(models.CartOp), [{"cart_id": cart.id, "op_id": op_id, "version": cart.version} for op_id in new_op_ids])
+            db.commit()
+        except IntegrityError:
+            # A concurrent retry of the same ops got there first; resending now reports them as duplicates
+            db.rollback()
+            raise HTTPException(status_code=409, detail="These ops are being applied by another request; retry")
+    cart = _reload_cart(db, cart.id)
+    if touched:
+        _publish_lines(cart, touched.values())
+
+    _with_etag(response, cart)
+    items = {i.product_id: i for i in cart.items}
+    full = not payload.delta or (payload.base_version is not None and payload.base_version != base_version)
+    return CartDeltaOut(
+        id=cart.id,
+        version=cart.version,
+        base_version=base_version,
+        applied=applied,
+        duplicates=duplicates,
+        changed=[_item_out(items[pid]) for pid in touched if pid in items],
+        removed=[pid for pid in touched if pid not in items],
+        items=[_item_out(i) for i in cart.items] if full else None,
+        total=cart.total,
+        total_weight=cart.total_weight,
+        item_count=cart.item_count,
+    )
+
+
 @router.post("/finalize", response_model=InvoiceOut)
-def finalize_cart(customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+def finalize_cart(idempotency_key: str | None = Header(None), customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+    return idempotent(db, idempotency_key, customer, request_hash("finalize"), lambda commit: _finalize_cart(customer, db, commit))
+
+
+def _finalize_cart(customer: models.Customer, db: Session, commit: Callable[[InvoiceOut], None]) -> InvoiceOut:
     cart = _get_or_create_active_cart(db, customer.id)
     if not cart.items:
         raise HTTPException(status_code=400, detail="Cart is empty")
-    # calculate totals and create invoice
-    total, total_weight = _cart_totals(cart)
+    # running totals are already on the cart
+    total, total_weight = cart.total, cart.total_weight
     code = str(uuid4())
     invoice = models.Invoice(
         code=code,
@@ -127,8 +278,14 @@ def finalize_cart(customer: models.Customer = Depends(get_current_customer), db:
     )
     db.add(invoice)
     cart.status = models.CartStatus.checkedout
-    db.commit()
-    db.refresh(invoice)
+    db.flush()
+    out = _finalize_out(invoice, total_weight)
+    commit(out)
+    publish_cart_status(out.cart_id, models.CartStatus.checkedout.value, out.id, out.code)
+    return out
+
+
+def _finalize_out(invoice: models.Invoice, total_weight) -> InvoiceOut:
     return InvoiceOut(
         id=invoice.id,
         code=invoice.code,
@@ -142,31 +299,29 @@ def finalize_cart(customer: models.Customer = Depends(get_current_customer), db:
 
 
 @router.post("/finalize-from-items", response_model=InvoiceOut)
-def finalize_from_items(payload: FinalizeFromItemsRequest, customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+def finalize_from_items(payload: FinalizeFromItemsRequest, idempotency_key: str | None = Header(None), customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+    fingerprint = request_hash("finalize-from-items", payload.model_dump())
+    return idempotent(db, idempotency_key, customer, fingerprint, lambda commit: _finalize_from_items(payload, customer, db, commit))
+
+
+def _finalize_from_items(payload: FinalizeFromItemsRequest, customer: models.Customer, db: Session, commit: Callable[[InvoiceOut], None]) -> InvoiceOut:
     if not payload.items:
         raise HTTPException(status_code=400, detail="Cart is empty")
 
+    # resolve all codes in one query; report every invalid code at once
+    merged = merge_by_code((item.code, max(1, item.quantity)) for item in payload.items)
+    products, missing = catalog_cache.get_many_by_code(db, merged.keys())
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Invalid Product: {', '.join(missing)}")
+
     # create a new cart for this checkout
     cart = models.Cart(customer_id=customer.id, status=models.CartStatus.active)
     db.add(cart)
     db.flush()
-    db.refresh(cart)
-
-    # add items by code
-    for item in payload.items:
-        product = db.query(models.Product).filter(models.Product.code == item.code).first()
-        if not product:
-            raise HTTPException(status_code=400, detail=f"Invalid Product: {item.code}")
-        cart_item = models.CartItem(cart_id=cart.id, product_id=product.id, quantity=max(1, item.quantity))
-        db.add(cart_item)
-        db.flush()
-        db.refresh(cart_item)
-        _recalc_item(cart_item)
-
-    # finalize
-    db.flush()
-    db.refresh(cart)
-    total, total_weight = _cart_totals(cart)
+
+    # add all lines in a single bulk insert
+    total, total_weight = bulk_insert_cart_items(db, cart.id, [(products[code], qty) for code, qty in merged.items()])
+    set_cart_totals(cart, total, total_weight, sum(merged.values()))
 
     code = str(uuid4())
     invoice = models.Invoice(
@@ -178,17 +333,8 @@ def finalize_from_items(payload: FinalizeFromItemsRequest, customer: models.Cust
     )
     db.add(invoice)
     cart.status = models.CartStatus.checkedout
-    db.commit()
-    db.refresh(invoice)
-
-    return InvoiceOut(
-        id=invoice.id,
-        code=invoice.code,
-        customer_id=invoice.customer_id,
-        cart_id=invoice.cart_id,
-        total=invoice.total,
-        date=invoice.date,
-        status=invoice.status.value,
-        total_weight=total_weight,
-    )
+    db.flush()
+    out = _finalize_out(invoice, total_weight)
+    commit(out)
+    return out
 
@@ -1,16 +1,25 @@
 from uuid import uuid4
 from base64 import b64encode
 from datetime import datetime
-from typing import List
+from typing import Any, Callable, List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
 
 from ..database import get_db
 from .. import models
 from ..schemas import ItemInput
-from ..dependencies import get_current_customer
+from ..dependencies import get_current_customer, idempotent
+from ..events import line_payload, publish_cart_lines, publish_cart_status
+from ..queries import cart_with_lines
 from ..utils.qr import generate_qr_png
+from ..utils.catalog import bump_catalog_version, catalog_cache
+from ..utils.cart_lines import bulk_insert_cart_items, cart_etag, merge_by_code, set_cart_totals
+from ..utils.idempotency import request_hash
+from ..utils.inventory import InsufficientStock, hold_reservations, reserve_stock, warn_low_stock
+
+from .cart import check_if_match
 
 router = APIRouter(prefix="/carts", tags=["carts"])
 
@@ -34,58 +43,78 @@ def _get_or_create_active_cart(db: Session, customer_id: int) -> models.Cart:
 
 
 @router.post("/attach")
-def attach_cart(payload: dict, customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+def attach_cart(payload: dict, response: Response, if_match: str | None = Header(None), customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
     items_payload = payload.get("items", [])
     if not items_payload:
         raise HTTPException(status_code=400, detail="Cart is empty")
 
-    cart = _get_or_create_active_cart(db, customer.id)
-
-    # Clear existing items
-    for it in list(cart.items):
-        db.delete(it)
-    db.flush()
-
-    # Add items by product code, dedupe by code and sum quantities
-    merged: dict[str, int] = {}
+    # Dedupe by code and sum quantities
+    pairs = []
     for item in items_payload:
         code = item.get("code")
-        qty = int(item.get("quantity", 1))
         if not code:
             raise HTTPException(status_code=400, detail="Invalid item payload: missing code")
-        if qty <= 0:
+        pairs.append((code, int(item.get("quantity", 1))))
+    merged = merge_by_code(pairs)
+
+    # Resolve every code in one query and report all invalid ones together
+    products, missing = catalog_cache.get_many_by_code(db, merged.keys())
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Invalid product — not available in this store: {', '.join(missing)}")
+
+    cart = _get_or_create_active_cart(db, customer.id)
+    cart_id = cart.id
+    # With If-Match, a cart edited elsewhere since the client read it is answered with 412 + the current lines
+    claimed = check_if_match(db, cart, if_match)
+
+    # Apply only the difference to the stored lines: untouched lines keep their rows
+    wanted = {products[code].id: (products[code], qty) for code, qty in merged.items()}
+    existing = {i.product_id: i for i in db.query(models.CartItem).filter(models.CartItem.cart_id == cart_id)}
+    changed = []
+    for pid, item in existing.items():
+        if pid not in wanted:
+            db.delete(item)
+            product = catalog_cache.get_by_id(db, pid)
+            changed.append(line_payload(pid, product.name if product else "Item", 0, 0.0, 0.0))
+    new_lines = []
+    for pid, (product, qty) in wanted.items():
+        subtotal, net_weight = product.price_per_unit * qty, product.weight_per_unit * qty
+        item = existing.get(pid)
+        if item is None:
+            new_lines.append((product, qty))
+        elif (item.quantity, item.subtotal, item.net_weight) != (qty, subtotal, net_weight):
+            item.quantity, item.subtotal, item.net_weight = qty, subtotal, net_weight
+        else:
             continue
-        merged[code] = merged.get(code, 0) + qty
-
-    for code, qty in merged.items():
-        product = db.query(models.Product).filter(models.Product.code == code).first()
-        if not product:
-            raise HTTPException(status_code=400, detail=f"Invalid product — not available in this store")
-        ci = models.CartItem(cart_id=cart.id, product_id=product.id, quantity=qty)
-        db.add(ci)
-        db.flush()
-        # compute subtotal and net weight
-        ci.subtotal = product.price_per_unit * ci.quantity
-        ci.net_weight = product.weight_per_unit * ci.quantity
+        changed.append(line_payload(pid, product.name, qty, subtotal, net_weight))
+    bulk_insert_cart_items(db, cart_id, new_lines)
 
+    total = sum(p.price_per_unit * q for p, q in wanted.values())
+    total_weight = sum(p.weight_per_unit * q for p, q in wanted.values())
+    if changed:
+        set_cart_totals(cart, total, total_weight, sum(merged.values()), bump_version=not claimed)
     db.commit()
-    db.refresh(cart)
 
-    total = sum(i.subtotal for i in cart.items)
-    total_weight = sum(i.net_weight for i in cart.items)
+    items = db.query(models.CartItem).filter(models.CartItem.cart_id == cart_id).order_by(models.CartItem.id).all()
+    names = {p.id: p.name for p in products.values()}
+    version = db.query(models.Cart.version).filter(models.Cart.id == cart_id).scalar()
+    if changed:
+        publish_cart_lines(cart_id, changed, {"total": total, "total_weight": total_weight, "item_count": sum(merged.values()), "version": version})
+    response.headers["ETag"] = cart_etag(cart_id, version)
 
     return {
-        "cart_id": cart.id,
+        "cart_id": cart_id,
+        "version": version,
         "items": [
             {
                 "id": i.id,
                 "product_id": i.product_id,
-                "product_name": i.product.name,
+                "product_name": names[i.product_id],
                 "quantity": i.quantity,
                 "subtotal": i.subtotal,
                 "net_weight": i.net_weight,
             }
-            for i in cart.items
+            for i in items
         ],
         "total": total,
         "total_weight": total_weight,
@@ -93,27 +122,40 @@ def attach_cart(payload: dict, customer: models.Customer = Depends(get_current_c
 
 
 @router.post("/{cart_id}/checkout")
-def checkout_cart(cart_id: int, customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
-    cart = db.query(models.Cart).filter(models.Cart.id == cart_id).first()
+def checkout_cart(cart_id: int, idempotency_key: str | None = Header(None), customer: models.Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+    # A retried checkout with the same Idempotency-Key gets the first invoice + QR back
+    return idempotent(db, idempotency_key, customer, request_hash("checkout", cart_id), lambda commit: _checkout_cart(cart_id, customer, db, commit))
+
+
+def _checkout_cart(cart_id: int, customer: models.Customer, db: Session, commit: Callable[[Any], None]):
+    cart = db.query(models.Cart).options(*cart_with_lines()).filter(models.Cart.id == cart_id).first()
     if not cart or cart.customer_id != customer.id or cart.status != models.CartStatus.active:
         raise HTTPException(status_code=404, detail="Cart not found or not active")
 
     if not cart.items:
         raise HTTPException(status_code=400, detail="Cart is empty")
 
-    # Stock validation
-    for item in cart.items:
-        product = item.product
-        if item.quantity > product.available_qty:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Insufficient stock for {product.name}. Available: {product.available_qty}",
-            )
+    # Claim the cart first so two concurrent checkouts of it cannot both reserve stock
+    claimed = db.execute(
+        update(models.Cart)
+        .where(models.Cart.id == cart_id, models.Cart.status == models.CartStatus.active)
+        .values(status=models.CartStatus.checkedout)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Cart not found or not active")
+
+    # Take the stock for every line in one conditional UPDATE; fails as a whole if any line is short
+    lines = {item.product_id: item.quantity for item in cart.items}
+    try:
+        reserved = reserve_stock(db, lines)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=400, detail=f"Insufficient stock for {e}")
 
     # Create invoice code and invoice
     inv_code = f"INV-{uuid4().hex[:12].upper()}"
-    total = sum(i.subtotal for i in cart.items)
-    total_weight = sum(i.net_weight for i in cart.items)
+    total, total_weight = cart.total, cart.total_weight
 
     invoice = models.Invoice(
         code=inv_code,
@@ -124,32 +166,40 @@ def checkout_cart(cart_id: int, customer: models.Customer = Depends(get_current_
     )
     db.add(invoice)
     db.flush()
-    db.refresh(invoice)
-
-    # Snapshot items into invoice_items to prevent later drift
-    for item in cart.items:
-        inv_item = models.InvoiceItem(
-            invoice_id=invoice.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            subtotal=item.subtotal,
-            net_weight=item.net_weight,
-        )
-        db.add(inv_item)
-
-    cart.status = models.CartStatus.checkedout
-    db.commit()
-    db.refresh(invoice)
+    invoice_id = invoice.id
 
-    # Generate QR image (base64)
+    # Snapshot items into invoice_items to prevent later drift (one executemany)
+    db.execute(
+        insert(models.InvoiceItem),
+        [
+            {
+                "invoice_id": invoice_id,
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "subtotal": item.subtotal,
+                "net_weight": item.net_weight,
+            }
+            for item in cart.items
+        ],
+    )
+
+    hold_reservations(db, invoice_id, lines)
+    version = bump_catalog_version(db)
+
+    # Generate QR image (base64); the response is committed with the invoice
     png_bytes = generate_qr_png(inv_code)
     qr_b64 = b64encode(png_bytes).decode("utf-8")
-
-    return {
-        "invoice_id": invoice.id,
+    out = {
+        "invoice_id": invoice_id,
         "qr_code": inv_code,
         "qr_base64": qr_b64,
         "total": total,
         "total_net_weight": total_weight,
     }
+    commit(out)
+    # Write the rows the UPDATE returned through to the catalog cache
+    catalog_cache.store(reserved, version)
+    warn_low_stock(reserved)
+    publish_cart_status(cart_id, models.CartStatus.checkedout.value, invoice_id, inv_code)
+    return out
 
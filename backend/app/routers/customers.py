@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from ..database import get_db
 from ..dependencies import get_current_customer
 from .. import models
-from ..schemas import InvoiceOut
+from ..schemas import InvoiceOut, InvoicePage
+from ..utils.pagination import invoice_keyset_page
 
 router = APIRouter(prefix="/customers", tags=["customers"])
 
@@ -30,3 +31,31 @@ def my_invoices(db: Session = Depends(get_db), customer: models.Customer = Depen
         for i in invoices
     ]
 
+
+
+@router.get("/me/invoices/page", response_model=InvoicePage)
+def my_invoices_page(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+    customer: models.Customer = Depends(get_current_customer),
+):
+    try:
+        page, next_cursor = invoice_keyset_page(db, customer.id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return InvoicePage(
+        items=[
+            InvoiceOut(
+                id=i.id,
+                code=i.code,
+                customer_id=i.customer_id,
+                cart_id=i.cart_id,
+                total=i.total,
+                date=i.date,
+                status=i.status.value,
+            )
+            for i in page
+        ],
+        next_cursor=next_cursor,
+    )
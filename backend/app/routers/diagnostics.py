@@ -0,0 +1,143 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from .. import models
+from .. import database
+from ..database import get_db, engine_options, pool_status, SQLITE_PRAGMAS
+from ..dependencies import require_admin
+from ..cache import shared_cache
+from ..events import broker
+from ..jobs import queue_stats
+from ..utils.pdf_cache import pdf_cache
+from ..profiling import folded, profile_store
+from ..utils.password_pool import password_pool
+from ..utils.principals import principal_cache
+from ..utils.qr import qr_cache_info
+from ..utils.cart_lines import audit_cart_totals
+from ..utils.catalog import bump_catalog_version, catalog_cache
+from ..utils.idempotency import key_stats, purge_expired
+from ..utils.inventory import held_stock, release_reservations
+
+router = APIRouter(prefix="/diagnostics", tags=["diagnostics"])
+
+
+@router.get("/db")
+def db_diagnostics(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(require_admin)):
+    url = database.engine.url
+    options = {k: v for k, v in engine_options(str(url)).items() if k != "connect_args"}
+    if "poolclass" in options:
+        options["poolclass"] = options["poolclass"].__name__
+    out = {
+        "url": url.render_as_string(hide_password=True),
+        "dialect": url.get_backend_name(),
+        "engine_options": options,
+        "pool": pool_status(database.engine),
+    }
+    if url.get_backend_name() == "sqlite":
+        out["sqlite_pragmas"] = {
+            "configured": SQLITE_PRAGMAS,
+            "effective": {name: db.execute(text(f"PRAGMA {name}")).scalar() for name in SQLITE_PRAGMAS},
+        }
+    if database.async_engine is not None:
+        async_url = make_url(str(database.async_engine.url))
+        out["async"] = {
+            "url": async_url.render_as_string(hide_password=True),
+            "pool": pool_status(database.async_engine.sync_engine),
+        }
+    return out
+
+
+@router.get("/jobs")
+def job_diagnostics(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(require_admin)):
+    return queue_stats(db)
+
+
+@router.get("/pdf-cache")
+def pdf_cache_diagnostics(_: models.StoreOfficial = Depends(require_admin)):
+    return pdf_cache.stats()
+
+
+@router.get("/qr-cache")
+def qr_cache_diagnostics(_: models.StoreOfficial = Depends(require_admin)):
+    return qr_cache_info()
+
+
+@router.get("/principal-cache")
+def principal_cache_diagnostics(_: models.StoreOfficial = Depends(require_admin)):
+    return principal_cache.stats()
+
+
+@router.get("/password-pool")
+def password_pool_diagnostics(_: models.StoreOfficial = Depends(require_admin)):
+    return password_pool.stats()
+
+
+@router.get("/events")
+def event_diagnostics(_: models.StoreOfficial = Depends(require_admin)):
+    return broker.stats()
+
+
+@router.get("/cache")
+def shared_cache_diagnostics(_: models.StoreOfficial = Depends(require_admin)):
+    return shared_cache.stats()
+
+
+@router.get("/carts/audit")
+def cart_totals_audit(fix: bool = False, db: Session = Depends(get_db), _: models.StoreOfficial = Depends(require_admin)):
+    drifted = audit_cart_totals(db, fix=fix)
+    return {"drifted": len(drifted), "fixed": fix, "carts": drifted}
+
+
+@router.get("/reservations")
+def reservation_diagnostics(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(require_admin)):
+    held = held_stock(db)
+    return {"products": len(held), "units": sum(held.values()), "held": held}
+
+
+@router.post("/reservations/release-expired")
+def release_expired_reservations(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(require_admin)):
+    returned = release_reservations(db, expired=True)
+    version = bump_catalog_version(db) if returned else None
+    db.commit()
+    if returned:
+        catalog_cache.evict(returned, version)
+    return {"products": len(returned), "units": sum(returned.values())}
+
+
+@router.get("/idempotency")
+def idempotency_diagnostics(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(require_admin)):
+    return key_stats(db)
+
+
+@router.post("/idempotency/purge")
+def purge_idempotency_keys(db: Session = Depends(get_db), _: models.StoreOfficial = Depends(require_admin)):
+    deleted = 0
+    while True:
+        batch = purge_expired(db)
+        db.commit()
+        deleted += batch
+        if not batch:
+            return {"deleted": deleted}
+
+
+@router.get("/profiles")
+def list_profiles(_: models.StoreOfficial = Depends(require_admin)):
+    """Slow-request profiles, newest first (PROFILING_ENABLED)."""
+    return profile_store.list()
+
+
+@router.get("/profiles/{profile_id}")
+def download_profile(
+    profile_id: str,
+    format: str = Query("json", pattern="^(json|folded)$"),
+    _: models.StoreOfficial = Depends(require_admin),
+):
+    profile = profile_store.load(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(folded(profile), headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'})
+    return profile
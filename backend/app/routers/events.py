@@ -0,0 +1,133 @@
+import json
+from datetime import timedelta
+from typing import Callable, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .. import models
+from ..config import EVENTS_HEARTBEAT_SECONDS, STREAM_TOKEN_EXPIRE_SECONDS
+from ..database import SessionLocal, get_db
+from ..dependencies import get_current_principal, get_stream_principal
+from ..events import broker, cart_channel, invoice_channel, line_payload, totals_payload
+from ..queries import cart_with_lines
+from ..schemas import StreamToken
+from ..security import STREAM_SCOPE, create_access_token
+from ..utils.principals import CUSTOMER, Principal
+
+# Server-Sent Events: a snapshot on connect, then the diffs published by the cart/invoice handlers
+router = APIRouter(prefix="/events", tags=["events"])
+
+
+def _cart_snapshot(cart_id: int) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        cart = db.get(models.Cart, cart_id, options=cart_with_lines())
+        if cart is None:
+            return None
+        invoice = cart.invoice
+        return {
+            "type": "snapshot",
+            "cart_id": cart.id,
+            "status": cart.status.value,
+            "lines": [line_payload(i.product_id, i.product.name, i.quantity, i.subtotal, i.net_weight) for i in cart.items],
+            "totals": totals_payload(cart),
+            "invoice_id": invoice.id if invoice else None,
+            "invoice_code": invoice.code if invoice else None,
+        }
+    finally:
+        db.close()
+
+
+def _invoice_snapshot(invoice_id: int) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        invoice = db.get(models.Invoice, invoice_id)
+        if invoice is None:
+            return None
+        return {
+            "type": "snapshot",
+            "invoice_id": invoice.id,
+            "code": invoice.code,
+            "cart_id": invoice.cart_id,
+            "status": invoice.status.value,
+            "total": invoice.total,
+            "paid_at": invoice.paid_at.isoformat() + "Z" if invoice.paid_at else None,
+        }
+    finally:
+        db.close()
+
+
+def _frame(message: dict) -> str:
+    seq = message.get("seq")
+    return (f"id: {seq}\n" if seq else "") + f"data: {json.dumps(message, separators=(',', ':'))}\n\n"
+
+
+def _stream(channel: str, snapshot: Callable[[], Optional[dict]]) -> StreamingResponse:
+    # Subscribe before reading the snapshot so nothing committed in between is missed;
+    # events carry absolute line quantities and totals, so a repeat is harmless
+    sub = broker.subscribe(channel)
+
+    async def body():
+        try:
+            yield "retry: 3000\n\n"
+            current = await run_in_threadpool(snapshot)
+            if current is not None:
+                yield _frame(current)
+            while True:
+                message = await sub.get(EVENTS_HEARTBEAT_SECONDS)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                elif message["type"] == "resync":
+                    current = await run_in_threadpool(snapshot)
+                    if current is not None:
+                        yield _frame(current)
+                else:
+                    yield _frame(message)
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/token", response_model=StreamToken)
+def stream_token(principal: Principal = Depends(get_current_principal)):
+    """Short-lived token for `?access_token=` on the streams below; refused by every other endpoint."""
+    token = create_access_token(
+        principal.email, principal.role, expires_delta=timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS), uid=principal.id, scope=STREAM_SCOPE
+    )
+    return StreamToken(access_token=token, expires_in=STREAM_TOKEN_EXPIRE_SECONDS)
+
+
+@router.get("/carts/{cart_id}")
+def cart_events(cart_id: int, principal: Principal = Depends(get_stream_principal), db: Session = Depends(get_db)):
+    cart = db.get(models.Cart, cart_id)
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    if principal.kind == CUSTOMER and cart.customer_id != principal.id:
+        raise HTTPException(status_code=403, detail="Not authorized to follow this cart")
+    # Hand the connection back to the pool; the stream can stay open for a long time
+    db.close()
+    return _stream(cart_channel(cart_id), lambda: _cart_snapshot(cart_id))
+
+
+def _invoice_stream(invoice: Optional[models.Invoice], principal: Principal, db: Session) -> StreamingResponse:
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    if principal.kind == CUSTOMER and invoice.customer_id != principal.id:
+        raise HTTPException(status_code=403, detail="Not authorized to follow this invoice")
+    invoice_id = invoice.id
+    db.close()
+    return _stream(invoice_channel(invoice_id), lambda: _invoice_snapshot(invoice_id))
+
+
+@router.get("/invoices/by-code/{code}")
+def invoice_events_by_code(code: str, principal: Principal = Depends(get_stream_principal), db: Session = Depends(get_db)):
+    return _invoice_stream(db.query(models.Invoice).filter(models.Invoice.code == code).first(), principal, db)
+
+
+@router.get("/invoices/{invoice_id}")
+def invoice_events(invoice_id: int, principal: Principal = Depends(get_stream_principal), db: Session = Depends(get_db)):
+    return _invoice_stream(db.get(models.Invoice, invoice_id), principal, db)
@@ -1,17 +1,27 @@
+from collections import defaultdict
 from io import BytesIO
-from typing import List
+from typing import Callable, List
 
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from datetime import datetime
 
 from .. import models
-from ..database import get_db
-from ..dependencies import get_current_official, get_current_customer
-from ..schemas import InvoiceOut, InvoiceDetailOut, CartItemOut
-from ..utils.pdf import build_invoice_pdf
-from ..utils.qr import generate_qr_png
-from ..utils.mailer import send_invoice_email_if_enabled
+from ..database import SessionLocal, get_db
+from ..dependencies import get_current_official, get_current_customer, idempotent
+from ..queries import invoice_with_lines
+from ..schemas import InvoiceOut, InvoiceDetailOut, InvoicePage, CartItemOut
+from ..utils.pdf_cache import etag_matches, pdf_cache
+from ..utils.qr import QR_CACHE_CONTROL, QR_MEDIA_TYPES, render_qr
+from ..events import publish_cart_status, publish_invoice_status
+from ..jobs import enqueue_invoice_email, job_workers
+from ..utils.catalog import CachedProduct, bump_catalog_version, catalog_cache
+from ..utils.idempotency import request_hash
+from ..utils.inventory import InsufficientStock, commit_reservations, release_reservations, reserve_stock, warn_low_stock
+from ..utils.pagination import invoice_keyset_page, iter_customer_invoices
+from ..utils.rollups import record_paid_invoice
 
 from pytz import timezone
 
@@ -48,9 +58,20 @@ def _items_out_for_invoice(invoice: models.Invoice) -> List[CartItemOut]:
     return out
 
 
+def _pdf_response(invoice: models.Invoice, if_none_match: str | None) -> Response:
+    fingerprint = pdf_cache.fingerprint(invoice)
+    etag = f'"{fingerprint[1]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    pdf, _ = pdf_cache.get_or_render(invoice, fingerprint)
+    headers["Content-Disposition"] = f"attachment; filename=invoice_{invoice.code}.pdf"
+    return Response(content=pdf, media_type="application/pdf", headers=headers)
+
+
 @router.get("/by-code/{code}", response_model=InvoiceDetailOut)
 def get_invoice_by_code(code: str, db: Session = Depends(get_db), official: models.StoreOfficial = Depends(get_current_official)):
-    invoice = db.query(models.Invoice).filter(models.Invoice.code == code).first()
+    invoice = db.query(models.Invoice).options(*invoice_with_lines()).filter(models.Invoice.code == code).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     items = _items_out_for_invoice(invoice)
@@ -72,44 +93,67 @@ def get_invoice_by_code(code: str, db: Session = Depends(get_db), official: mode
 
 
 @router.post("/{id}/pay", response_model=InvoiceOut)
-def pay_invoice(id: int, db: Session = Depends(get_db), official: models.StoreOfficial = Depends(get_current_official)):
-    invoice = db.query(models.Invoice).filter(models.Invoice.id == id).first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    if invoice.status == models.InvoiceStatus.paid:
+def pay_invoice(id: int, idempotency_key: str | None = Header(None), db: Session = Depends(get_db), official: models.StoreOfficial = Depends(get_current_official)):
+    # A retried payment with the same Idempotency-Key gets the first answer instead of "already paid"
+    return idempotent(db, idempotency_key, official, request_hash("pay", id), lambda commit: _pay_invoice(id, db, official, commit))
+
+
+def _claim_payment(db: Session, invoice: models.Invoice, official: models.StoreOfficial) -> List[CachedProduct]:
+    """Move a pending invoice to paid and settle its stock, in the caller's transaction.
+    Returns the products whose stock changed. Raises 400 when the invoice is no longer pending
+    (another payment got there first) or its stock can no longer be taken."""
+    # One conditional UPDATE decides which of several concurrent payments wins; the losers
+    # never touch stock, rollups or the outbox
+    claimed = db.execute(
+        update(models.Invoice)
+        .where(models.Invoice.id == invoice.id, models.Invoice.status == models.InvoiceStatus.pending)
+        .values(status=models.InvoiceStatus.paid, official_id=official.id, paid_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1:
+        db.rollback()
         raise HTTPException(status_code=400, detail="Invoice already paid")
 
-    # Mark as paid and set metadata
-    invoice.status = models.InvoiceStatus.paid
-    invoice.official_id = official.id
-    invoice.paid_at = datetime.utcnow()
-
-    # Decrement inventory on payment
+    # Checkout already took the stock out as held reservations; payment only commits them.
+    # Lines without a live hold (finalize paths, released or expired holds) take their stock
+    # now, with the same all-or-nothing conditional UPDATE checkout uses
+    lines = defaultdict(int)
     for item in (invoice.items or []):
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if product:
-            product.available_qty = max(0, product.available_qty - item.quantity)
-
-    db.commit()
+        lines[item.product_id] += item.quantity
+    for pid, qty in commit_reservations(db, invoice.id):
+        lines[pid] -= qty
+    try:
+        return reserve_stock(db, lines)
+    except InsufficientStock as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Insufficient stock for {e}")
+
+
+def _settle_payment(db: Session, invoice: models.Invoice, changed: List[CachedProduct], commit: Callable[[InvoiceOut], None]) -> InvoiceOut:
+    version = bump_catalog_version(db) if changed else None
+    record_paid_invoice(db, invoice)
+    # PDF + email go through the outbox; committed atomically with the payment
+    enqueue_invoice_email(db, invoice)
+    # Read the claimed row back before committing, so the response commits with the payment
     db.refresh(invoice)
+    out = _invoice_out(invoice)
+    commit(out)
+    if changed:
+        catalog_cache.store(changed, version)
+        warn_low_stock(changed)
+    job_workers.wake()
+    publish_invoice_status(invoice)
+    publish_cart_status(invoice.cart_id, invoice.status.value, invoice.id, invoice.code)
+    return out
 
-    # Email invoice (optional)
-    try:
-        pdf_bytes = build_invoice_pdf(invoice)
-        send_invoice_email_if_enabled(invoice.customer.email, pdf_bytes, invoice.code)
-    except Exception:
-        # do not block payment on email errors
-        pass
 
-    return InvoiceOut(
-        id=invoice.id,
-        code=invoice.code,
-        customer_id=invoice.customer_id,
-        cart_id=invoice.cart_id,
-        total=invoice.total,
-        date=to_ist(invoice.date),
-        status=invoice.status.value,
-    )
+def _pay_invoice(id: int, db: Session, official: models.StoreOfficial, commit: Callable[[InvoiceOut], None]) -> InvoiceOut:
+    invoice = db.query(models.Invoice).filter(models.Invoice.id == id).first()
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    if invoice.status == models.InvoiceStatus.paid:
+        raise HTTPException(status_code=400, detail="Invoice already paid")
+    return _settle_payment(db, invoice, _claim_payment(db, invoice, official), commit)
 
 
 # Legacy: mark paid by code
@@ -118,93 +162,132 @@ def mark_paid(code: str, db: Session = Depends(get_db), official: models.StoreOf
     invoice = db.query(models.Invoice).filter(models.Invoice.code == code).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
+    if invoice.status != models.InvoiceStatus.paid:
+        try:
+            return _settle_payment(db, invoice, _claim_payment(db, invoice, official), lambda out: db.commit())
+        except HTTPException:
+            db.refresh(invoice)
+            if invoice.status != models.InvoiceStatus.paid:
+                raise
+    # Already paid (possibly by a concurrent request): report it as is
+    return _invoice_out(invoice)
+
+
+@router.post("/{id}/release")
+def release_invoice_stock(id: int, db: Session = Depends(get_db), customer: models.Customer = Depends(get_current_customer)):
+    """Give back the stock held by an unpaid checkout before its reservation expires."""
+    invoice = db.query(models.Invoice).filter(models.Invoice.id == id).first()
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    if invoice.customer_id != customer.id:
+        raise HTTPException(status_code=403, detail="Not authorized to release this invoice")
     if invoice.status == models.InvoiceStatus.paid:
-        return InvoiceOut(
-            id=invoice.id,
-            code=invoice.code,
-            customer_id=invoice.customer_id,
-            cart_id=invoice.cart_id,
-            total=invoice.total,
-            date=to_ist(invoice.date),
-            status=invoice.status.value,
-        )
-    invoice.status = models.InvoiceStatus.paid
-    invoice.official_id = official.id
+        raise HTTPException(status_code=400, detail="Invoice already paid")
+    returned = release_reservations(db, invoice_id=invoice.id)
+    version = bump_catalog_version(db) if returned else None
     db.commit()
-    db.refresh(invoice)
-
-    # Email invoice (optional)
-    try:
-        pdf_bytes = build_invoice_pdf(invoice)
-        send_invoice_email_if_enabled(invoice.customer.email, pdf_bytes, invoice.code)
-    except Exception:
-        # do not block payment on email errors
-        pass
-
-    return InvoiceOut(
-        id=invoice.id,
-        code=invoice.code,
-        customer_id=invoice.customer_id,
-        cart_id=invoice.cart_id,
-        total=invoice.total,
-        date=to_ist(invoice.date),
-        status=invoice.status.value,
-    )
+    if returned:
+        catalog_cache.evict(returned, version)
+    publish_invoice_status(invoice, reservation="released")
+    return {"invoice_id": invoice.id, "released": [{"product_id": pid, "quantity": qty} for pid, qty in sorted(returned.items())]}
 
 
 @router.get("/{id}/pdf")
-def download_invoice_pdf_by_id(id: int, db: Session = Depends(get_db), customer: models.Customer = Depends(get_current_customer)):
-    invoice = db.query(models.Invoice).filter(models.Invoice.id == id).first()
+def download_invoice_pdf_by_id(id: int, db: Session = Depends(get_db), customer: models.Customer = Depends(get_current_customer), if_none_match: str | None = Header(None)):
+    invoice = db.query(models.Invoice).options(*invoice_with_lines()).filter(models.Invoice.id == id).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     if invoice.customer_id != customer.id:
         raise HTTPException(status_code=403, detail="Not authorized to download this invoice")
-    pdf = build_invoice_pdf(invoice)
-    return Response(content=pdf, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=invoice_{invoice.code}.pdf"})
+    return _pdf_response(invoice, if_none_match)
 
 
 @router.get("/{code}/pdf")
-def download_invoice_pdf(code: str, db: Session = Depends(get_db), customer: models.Customer = Depends(get_current_customer)):
-    invoice = db.query(models.Invoice).filter(models.Invoice.code == code).first()
+def download_invoice_pdf(code: str, db: Session = Depends(get_db), customer: models.Customer = Depends(get_current_customer), if_none_match: str | None = Header(None)):
+    invoice = db.query(models.Invoice).options(*invoice_with_lines()).filter(models.Invoice.code == code).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     if invoice.customer_id != customer.id:
         raise HTTPException(status_code=403, detail="Not authorized to download this invoice")
-    pdf = build_invoice_pdf(invoice)
-    return Response(content=pdf, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=invoice_{code}.pdf"})
+    return _pdf_response(invoice, if_none_match)
+
+
+def _qr_response(code: str, fmt: str, box_size: int, border: int) -> Response:
+    content = render_qr(code, fmt, box_size, border)
+    return Response(content=content, media_type=QR_MEDIA_TYPES[fmt], headers={"Cache-Control": QR_CACHE_CONTROL})
 
 
 @router.get("/{id}/qr")
-def get_invoice_qr_by_id(id: int, db: Session = Depends(get_db)):
+def get_invoice_qr_by_id(
+    id: int,
+    format: str = Query("png", pattern="^(png|svg)$"),
+    box_size: int = Query(10, ge=1, le=20),
+    border: int = Query(4, ge=0, le=8),
+    db: Session = Depends(get_db),
+):
     invoice = db.query(models.Invoice).filter(models.Invoice.id == id).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
-    png_bytes = generate_qr_png(invoice.code)
-    return Response(content=png_bytes, media_type="image/png")
+    return _qr_response(invoice.code, format, box_size, border)
 
 
 @router.get("/{code}/qr")
-def get_invoice_qr(code: str, db: Session = Depends(get_db)):
+def get_invoice_qr(
+    code: str,
+    format: str = Query("png", pattern="^(png|svg)$"),
+    box_size: int = Query(10, ge=1, le=20),
+    border: int = Query(4, ge=0, le=8),
+    db: Session = Depends(get_db),
+):
     invoice = db.query(models.Invoice).filter(models.Invoice.code == code).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
-    png_bytes = generate_qr_png(code)
-    return Response(content=png_bytes, media_type="image/png")
+    return _qr_response(code, format, box_size, border)
+
+
+def _invoice_out(i: models.Invoice) -> InvoiceOut:
+    return InvoiceOut(
+        id=i.id,
+        code=i.code,
+        customer_id=i.customer_id,
+        cart_id=i.cart_id,
+        total=i.total,
+        date=to_ist(i.date),
+        status=i.status.value,
+    )
 
 
 @router.get("/me/history", response_model=list[InvoiceOut])
 def my_invoices(db: Session = Depends(get_db), customer: models.Customer = Depends(get_current_customer)):
     invoices = db.query(models.Invoice).filter(models.Invoice.customer_id == customer.id).order_by(models.Invoice.date.desc()).all()
-    return [
-        InvoiceOut(
-            id=i.id,
-            code=i.code,
-            customer_id=i.customer_id,
-            cart_id=i.cart_id,
-            total=i.total,
-            date=to_ist(i.date),
-            status=i.status.value,
-        )
-        for i in invoices
-    ]
+    return [_invoice_out(i) for i in invoices]
 
+
+@router.get("/me/history/page", response_model=InvoicePage)
+def my_invoices_page(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+    customer: models.Customer = Depends(get_current_customer),
+):
+    try:
+        page, next_cursor = invoice_keyset_page(db, customer.id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return InvoicePage(items=[_invoice_out(i) for i in page], next_cursor=next_cursor)
+
+
+@router.get("/me/history/export.ndjson")
+def export_my_invoices(customer: models.Customer = Depends(get_current_customer)):
+    customer_id = customer.id
+
+    def lines():
+        # Own sessions per chunk: the request's session is closed before the body streams
+        for invoice in iter_customer_invoices(SessionLocal, customer_id):
+            yield _invoice_out(invoice).model_dump_json() + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=invoices.ndjson"},
+    )
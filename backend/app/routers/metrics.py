@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.orm import Session
+
+from .. import database
+from ..database import get_db, pool_status
+from ..jobs import queue_stats
+from ..metrics import render_metrics
+
+router = APIRouter(tags=["metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics(db: Session = Depends(get_db)):
+    """Prometheus scrape target. Unauthenticated, like most exporters: keep it off the public ingress."""
+    pools = {"sync": pool_status(database.engine)}
+    if database.async_engine is not None:
+        pools["async"] = pool_status(database.async_engine.sync_engine)
+    return PlainTextResponse(render_metrics(pools, jobs=queue_stats(db)), media_type=PROMETHEUS_CONTENT_TYPE)
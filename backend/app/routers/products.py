@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+import io
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
+from ..config import PRODUCT_IMPORT_BATCH_SIZE
 from ..database import get_db
 from .. import models
 from ..schemas import ProductCreate, ProductOut
-from ..dependencies import get_current_official
+from ..dependencies import get_current_official, require_admin
+from ..utils.catalog import CachedProduct, bump_catalog_version, catalog_cache
+from ..utils.product_import import FORMATS, format_for, import_products, read_rows
 
 router = APIRouter(prefix="/products", tags=["products"])
 
@@ -18,7 +23,7 @@ def list_products(db: Session = Depends(get_db)):
 
 @router.get("/by-id/{product_id}", response_model=ProductOut)
 def get_product_by_id(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    product = catalog_cache.get_by_id(db, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return product
@@ -26,7 +31,7 @@ def get_product_by_id(product_id: int, db: Session = Depends(get_db)):
 
 @router.get("/{code}", response_model=ProductOut)
 def get_product_by_code_public(code: str, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.code == code).first()
+    product = catalog_cache.get_by_code(db, code)
     if not product:
         # Exact message per spec
         raise HTTPException(status_code=404, detail="Invalid product — not available in this store")
@@ -35,7 +40,7 @@ def get_product_by_code_public(code: str, db: Session = Depends(get_db)):
 
 @router.get("/by-code/{code}", response_model=ProductOut)
 def get_product_by_code(code: str, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.code == code).first()
+    product = catalog_cache.get_by_code(db, code)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return product
@@ -55,7 +60,37 @@ def create_product(payload: ProductCreate, db: Session = Depends(get_db), _: mod
         available_qty=payload.available_qty,
     )
     db.add(product)
+    db.flush()
+    version = bump_catalog_version(db)
+    record = CachedProduct.from_model(product)
     db.commit()
-    db.refresh(product)
-    return product
+    catalog_cache.store([record], version)
+    return record
+
+
+@router.post("/import")
+def bulk_import_products(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    batch_size: int = Query(PRODUCT_IMPORT_BATCH_SIZE, ge=1, le=10000),
+    db: Session = Depends(get_db),
+    _: models.StoreOfficial = Depends(require_admin),
+):
+    """Upsert products by code from a CSV (with header) or NDJSON upload; bad rows are reported, not fatal."""
+    fmt = format or format_for(file.filename, file.content_type)
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown file format; pass format=csv or format=ndjson")
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        report = import_products(db, read_rows(stream, fmt), batch_size=batch_size)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File is not UTF-8 text; rows before the bad bytes were imported")
+    finally:
+        stream.detach()
+    return report.as_dict()
+
+
+@router.get("/cache/stats")
+def catalog_cache_stats(_: models.StoreOfficial = Depends(get_current_official)):
+    return catalog_cache.stats()
 
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, model_validator
 
 
 class Token(BaseModel):
@@ -10,6 +10,11 @@ class Token(BaseModel):
     role: str
 
 
+class StreamToken(BaseModel):
+    access_token: str
+    expires_in: int
+
+
 class CustomerCreate(BaseModel):
     name: str
     email: EmailStr
@@ -54,6 +59,16 @@ class ProductCreate(BaseModel):
     available_qty: int
 
 
+class ProductImportRow(BaseModel):
+    """One row of a bulk import; a missing available_qty keeps an existing product's stock (0 for new ones)."""
+    code: str = Field(min_length=1)
+    name: str = Field(min_length=1)
+    description: Optional[str] = None
+    price_per_unit: float = Field(ge=0)
+    weight_per_unit: float = Field(ge=0)
+    available_qty: Optional[int] = Field(default=None, ge=0)
+
+
 class ProductOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     id: int
@@ -80,6 +95,7 @@ class CartOut(BaseModel):
     items: List[CartItemOut]
     total: float
     total_weight: float
+    version: int = 0
 
 
 class ScanRequest(BaseModel):
@@ -92,6 +108,43 @@ class UpdateQuantityRequest(BaseModel):
     quantity: int
 
 
+class ScanOp(BaseModel):
+    """`scan` adds quantity (at least 1); `set` makes it the line's quantity (0 removes the line)."""
+    op: Literal["scan", "set"] = "scan"
+    product_id: Optional[int] = None
+    code: Optional[str] = None
+    quantity: int = 1
+    # Client-generated id; an op whose id was already applied to the cart is skipped on retry
+    op_id: Optional[str] = Field(default=None, min_length=1, max_length=64)
+
+    @model_validator(mode="after")
+    def _one_product_key(self):
+        if (self.product_id is None) == (self.code is None):
+            raise ValueError("give exactly one of product_id or code")
+        return self
+
+
+class ScanBatchRequest(BaseModel):
+    ops: List[ScanOp] = Field(min_length=1, max_length=500)
+    # Cart version the client last saw; when the cart has moved on since, the full lines are returned
+    base_version: Optional[int] = None
+    delta: bool = True
+
+
+class CartDeltaOut(BaseModel):
+    id: int
+    version: int
+    base_version: int  # version before this batch
+    applied: int
+    duplicates: int
+    changed: List[CartItemOut]
+    removed: List[int]  # product ids
+    items: Optional[List[CartItemOut]] = None  # full lines when not a delta
+    total: float
+    total_weight: float
+    item_count: int
+
+
 class ItemInput(BaseModel):
     code: str
     quantity: int = 1
@@ -113,6 +166,11 @@ class InvoiceOut(BaseModel):
     total_weight: float | None = None
 
 
+class InvoicePage(BaseModel):
+    items: List[InvoiceOut]
+    next_cursor: Optional[str] = None
+
+
 class InvoiceDetailOut(InvoiceOut):
     items: List[CartItemOut]
     customer_name: str
@@ -123,4 +181,6 @@ class AnalyticsSummary(BaseModel):
     total_paid_invoices: int
     daily_sales: List[dict]
     top_customers: List[dict]
+    as_of: Optional[datetime] = None  # last full rebuild; payments since then are folded in incrementally
+    rebuild_pending: bool = False
 
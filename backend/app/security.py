@@ -1,12 +1,13 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 
-from .config import JWT_SECRET, JWT_ALGORITHM, ACCESS_TOKEN_EXPIRE_DELTA
+from .config import JWT_SECRET, JWT_ALGORITHM, ACCESS_TOKEN_EXPIRE_DELTA, BCRYPT_ROUNDS
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with a different cost report needs_update, so logins migrate them to BCRYPT_ROUNDS
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -17,13 +18,27 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def create_access_token(subject: str, role: str, expires_delta: Optional[timedelta] = None) -> str:
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """(matches, replacement hash if the stored one uses an outdated scheme or cost)."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+STREAM_SCOPE = "stream"
+
+
+def create_access_token(subject: str, role: str, expires_delta: Optional[timedelta] = None, uid: Optional[int] = None, scope: Optional[str] = None) -> str:
     to_encode = {
         "sub": subject,
         "role": role,
         "exp": datetime.utcnow() + (expires_delta or ACCESS_TOKEN_EXPIRE_DELTA),
         "iat": datetime.utcnow(),
     }
+    if uid is not None:
+        # Lets the auth dependencies load the account by primary key
+        to_encode["uid"] = uid
+    if scope is not None:
+        # Scoped tokens (e.g. STREAM_SCOPE) are refused everywhere but their own endpoints
+        to_encode["scope"] = scope
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import CART_OP_PURGE_BATCH, CART_OP_TTL_SECONDS
+from .catalog import CachedProduct
+
+
+def merge_by_code(pairs: Iterable[Tuple[str, int]]) -> Dict[str, int]:
+    """Dedupe (code, quantity) pairs by code, summing quantities and dropping non-positive ones."""
+    merged: Dict[str, int] = {}
+    for code, qty in pairs:
+        if qty <= 0:
+            continue
+        merged[code] = merged.get(code, 0) + qty
+    return merged
+
+
+def bulk_insert_cart_items(db: Session, cart_id: int, lines: List[Tuple[CachedProduct, int]]) -> Tuple[float, float]:
+    """Insert every cart line with a single executemany; returns (total, total_weight)."""
+    rows = [
+        {
+            "cart_id": cart_id,
+            "product_id": product.id,
+            "quantity": qty,
+            "subtotal": product.price_per_unit * qty,
+            "net_weight": product.weight_per_unit * qty,
+        }
+        for product, qty in lines
+    ]
+    if rows:
+        db.execute(insert(models.CartItem), rows)
+    return sum(r["subtotal"] for r in rows), sum(r["net_weight"] for r in rows)
+
+
+def bump_cart_totals(cart: models.Cart, d_total: float, d_weight: float, d_count: int, bump_version: bool = True):
+    """Apply a line delta to the cart's running totals (and bump its version) as in-SQL increments (no lost updates).
+    Pass bump_version=False when claim_cart_version already advanced it in this transaction."""
+    cart.total = models.Cart.total + d_total
+    cart.total_weight = models.Cart.total_weight + d_weight
+    cart.item_count = models.Cart.item_count + d_count
+    if bump_version:
+        cart.version = models.Cart.version + 1
+
+
+def set_cart_totals(cart: models.Cart, total: float, total_weight: float, item_count: int, bump_version: bool = True):
+    cart.total = total
+    cart.total_weight = total_weight
+    cart.item_count = item_count
+    if bump_version:
+        cart.version = models.Cart.version + 1
+
+
+def cart_etag(cart_id: int, version: int) -> str:
+    return f'"cart-{cart_id}-{version}"'
+
+
+def claim_cart_version(db: Session, cart_id: int, version: int) -> bool:
+    """Advance the cart's version only if it is still `version`: the If-Match check, made atomic with the write
+    (the row stays locked until the caller commits)."""
+    res = db.execute(
+        update(models.Cart)
+        .where(models.Cart.id == cart_id, models.Cart.version == version)
+        .values(version=models.Cart.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount == 1
+
+
+def audit_cart_totals(db: Session, fix: bool = False, active_only: bool = True, tolerance: float = 1e-6) -> List[dict]:
+    """Compare stored cart totals with the sum of their lines; optionally rewrite the drifted ones."""
+    sums = (
+        db.query(
+            models.CartItem.cart_id.label("cart_id"),
+            func.sum(models.CartItem.subtotal).label("total"),
+            func.sum(models.CartItem.net_weight).label("total_weight"),
+            func.sum(models.CartItem.quantity).label("item_count"),
+        )
+        .group_by(models.CartItem.cart_id)
+        .subquery()
+    )
+    q = db.query(
+        models.Cart.id,
+        models.Cart.total,
+        models.Cart.total_weight,
+        models.Cart.item_count,
+        func.coalesce(sums.c.total, 0.0),
+        func.coalesce(sums.c.total_weight, 0.0),
+        func.coalesce(sums.c.item_count, 0),
+    ).outerjoin(sums, sums.c.cart_id == models.Cart.id)
+    if active_only:
+        q = q.filter(models.Cart.status == models.CartStatus.active)
+
+    drifted = []
+    for cart_id, total, weight, count, real_total, real_weight, real_count in q.all():
+        if (
+            total is None or weight is None or count is None
+            or abs(total - real_total) > tolerance
+            or abs(weight - real_weight) > tolerance
+            or count != real_count
+        ):
+            drifted.append({
+                "cart_id": cart_id,
+                "stored": {"total": total, "total_weight": weight, "item_count": count},
+                "actual": {"total": real_total, "total_weight": real_weight, "item_count": real_count},
+            })
+    if fix and drifted:
+        db.execute(
+            update(models.Cart),
+            [
+                {"id": d["cart_id"], **d["actual"]}
+                for d in drifted
+            ],
+        )
+        db.commit()
+    return drifted
+
+
+def purge_expired_ops(db: Session, now: Optional[datetime] = None, ttl_seconds: int = CART_OP_TTL_SECONDS, limit: int = CART_OP_PURGE_BATCH) -> int:
+    """Delete up to `limit` scan-batch op ids older than the client retry window, in the caller's
+    transaction; returns how many. A batch resent after that is applied again."""
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=ttl_seconds)
+    expired = select(models.CartOp.id).where(models.CartOp.created_at < cutoff).limit(limit)
+    return db.execute(delete(models.CartOp).where(models.CartOp.id.in_(expired)).execution_options(synchronize_session=False)).rowcount
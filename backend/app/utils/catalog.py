@@ -0,0 +1,250 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..cache import shared_cache
+from ..config import CATALOG_CACHE_ENABLED, CATALOG_CACHE_MAX_ITEMS, CATALOG_CACHE_VERSION_CHECK_SECONDS
+
+CATALOG_VERSION_KEY = "catalog"
+# Bumped only when product prices/weights may have changed (imports), not on stock changes
+PRODUCT_SPECS_VERSION_KEY = "product_specs"
+INVALIDATION_TOPIC = "catalog"
+
+
+class CachedProduct:
+    """Compact, read-only product record. Attribute-compatible with ProductOut."""
+
+    __slots__ = ("id", "name", "description", "code", "price_per_unit", "weight_per_unit", "available_qty")
+
+    def __init__(self, id, name, description, code, price_per_unit, weight_per_unit, available_qty):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.code = code
+        self.price_per_unit = price_per_unit
+        self.weight_per_unit = weight_per_unit
+        self.available_qty = available_qty
+
+    @classmethod
+    def from_model(cls, p: models.Product) -> "CachedProduct":
+        return cls(p.id, p.name, p.description, p.code, p.price_per_unit, p.weight_per_unit, p.available_qty)
+
+
+def read_version(db: Session, name: str) -> int:
+    row = db.get(models.CacheVersion, name)
+    return row.version if row else 0
+
+
+def bump_version(db: Session, name: str) -> int:
+    """Increment the shared version counter `name` inside the caller's transaction and return it."""
+    res = db.execute(
+        update(models.CacheVersion)
+        .where(models.CacheVersion.name == name)
+        .values(version=models.CacheVersion.version + 1)
+    )
+    if res.rowcount == 0:
+        db.add(models.CacheVersion(name=name, version=1))
+        db.flush()
+        return 1
+    return db.query(models.CacheVersion.version).filter(models.CacheVersion.name == name).scalar()
+
+
+def read_catalog_version(db: Session) -> int:
+    return read_version(db, CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version(db: Session) -> int:
+    """Increment the shared catalog version inside the caller's transaction and return it."""
+    return bump_version(db, CATALOG_VERSION_KEY)
+
+
+class ProductCatalogCache:
+    """In-process product cache indexed by id and code.
+
+    Entries are filled lazily on miss and written through by the handlers that change
+    products. Every CATALOG_CACHE_VERSION_CHECK_SECONDS the shared version row is read;
+    if another worker bumped it, the whole cache is dropped. With a shared cache backend,
+    each change is also broadcast, so other workers drop just the changed products and
+    adopt the new version without waiting for the check.
+    """
+
+    def __init__(self, max_items: int = CATALOG_CACHE_MAX_ITEMS, check_interval: float = CATALOG_CACHE_VERSION_CHECK_SECONDS, enabled: bool = CATALOG_CACHE_ENABLED, bus=shared_cache):
+        self.max_items = max_items
+        self.check_interval = check_interval
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._by_id: "OrderedDict[int, CachedProduct]" = OrderedDict()
+        self._id_by_code: Dict[str, int] = {}
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._bus = bus
+        bus.subscribe(INVALIDATION_TOPIC, self._on_remote_change)
+
+    # -- internal helpers (caller holds the lock) --
+    def _clear(self):
+        self._by_id.clear()
+        self._id_by_code.clear()
+        self.invalidations += 1
+
+    def _put(self, rec: CachedProduct):
+        old = self._by_id.pop(rec.id, None)
+        if old is not None and old.code != rec.code:
+            self._id_by_code.pop(old.code, None)
+        self._by_id[rec.id] = rec
+        self._id_by_code[rec.code] = rec.id
+        while len(self._by_id) > self.max_items:
+            _, evicted = self._by_id.popitem(last=False)
+            self._id_by_code.pop(evicted.code, None)
+
+    def _drop_ids(self, product_ids: Iterable[int]):
+        for pid in product_ids:
+            rec = self._by_id.pop(pid, None)
+            if rec is not None:
+                self._id_by_code.pop(rec.code, None)
+
+    def _sync_version(self, db: Session):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return
+        version = read_catalog_version(db)
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+            self._checked_at = now
+
+    def _lookup(self, db: Session, key, by_code: bool) -> Optional[CachedProduct]:
+        if self.enabled:
+            self._sync_version(db)
+            with self._lock:
+                pid = self._id_by_code.get(key) if by_code else key
+                rec = self._by_id.get(pid) if pid is not None else None
+                if rec is not None:
+                    self._by_id.move_to_end(pid)
+                    self.hits += 1
+                    return rec
+                self.misses += 1
+        column = models.Product.code if by_code else models.Product.id
+        product = db.query(models.Product).filter(column == key).first()
+        if not product:
+            return None
+        rec = CachedProduct.from_model(product)
+        if self.enabled:
+            with self._lock:
+                self._put(rec)
+        return rec
+
+    # -- public API --
+    def get_by_id(self, db: Session, product_id: int) -> Optional[CachedProduct]:
+        return self._lookup(db, product_id, by_code=False)
+
+    def get_by_code(self, db: Session, code: str) -> Optional[CachedProduct]:
+        return self._lookup(db, code, by_code=True)
+
+    def get_many_by_code(self, db: Session, codes: Iterable[str]) -> Tuple[Dict[str, CachedProduct], List[str]]:
+        """Resolve a set of codes with at most one `IN (...)` query. Returns (found, missing)."""
+        wanted = list(dict.fromkeys(codes))
+        found: Dict[str, CachedProduct] = {}
+        pending = wanted
+        if self.enabled:
+            self._sync_version(db)
+            pending = []
+            with self._lock:
+                for code in wanted:
+                    pid = self._id_by_code.get(code)
+                    rec = self._by_id.get(pid) if pid is not None else None
+                    if rec is not None:
+                        self._by_id.move_to_end(pid)
+                        found[code] = rec
+                        self.hits += 1
+                    else:
+                        pending.append(code)
+                        self.misses += 1
+        if pending:
+            fetched = [CachedProduct.from_model(p) for p in db.query(models.Product).filter(models.Product.code.in_(pending)).all()]
+            if self.enabled:
+                with self._lock:
+                    for rec in fetched:
+                        self._put(rec)
+            for rec in fetched:
+                found[rec.code] = rec
+        missing = [code for code in wanted if code not in found]
+        return found, missing
+
+    def store(self, records: Iterable[CachedProduct], version: int):
+        """Write-through after a committed change that bumped the shared version to `version`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            # Adopt our own bump; if some other worker bumped in between, start over.
+            if self._version is None or version != self._version + 1:
+                self._clear()
+            records = list(records)
+            for rec in records:
+                self._put(rec)
+            self._version = version
+            self._checked_at = time.monotonic()
+        self._bus.publish(INVALIDATION_TOPIC, {"ids": [rec.id for rec in records], "version": version})
+
+    def evict(self, product_ids: Iterable[int], version: int):
+        """Like store(), for a committed change whose new values weren't read back: drop those entries."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                self._clear()
+            product_ids = list(product_ids)
+            self._drop_ids(product_ids)
+            self._version = version
+            self._checked_at = time.monotonic()
+        self._bus.publish(INVALIDATION_TOPIC, {"ids": product_ids, "version": version})
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self._version = None
+        self._bus.publish(INVALIDATION_TOPIC, {"all": True})
+
+    def _on_remote_change(self, message: dict):
+        """Another worker committed a product change (see store/evict/invalidate)."""
+        with self._lock:
+            version = message.get("version")
+            if message.get("all") or self._version is None or version is None:
+                self._clear()
+                self._version = None
+            elif version == self._version + 1:
+                self._drop_ids(message["ids"])
+                self._version = version
+                self._checked_at = time.monotonic()
+            elif version <= self._version:
+                # Arrived after a later change was already adopted
+                self._drop_ids(message["ids"])
+            else:
+                self._clear()
+                self._version = version
+                self._checked_at = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._by_id),
+                "max_items": self.max_items,
+                "version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+catalog_cache = ProductCatalogCache()
@@ -0,0 +1,112 @@
+"""Idempotency keys for checkout, finalize and payment.
+
+A client sends `Idempotency-Key: <unique string>` and sends the same key again when it
+retries. The first request claims (owner, key) with an INSERT ... ON CONFLICT DO NOTHING
+committed before the handler runs, and its response is stored on that row in the
+handler's own transaction, so the work and the stored response commit together. A retry finds the row through the unique (owner, key) index and gets the stored
+response back without running the handler again.
+
+A retry that arrives while the first request is still running gets KeyInProgress. Using a
+key for a different request gets KeyReused. A handler that fails drops its claim, so the
+key can be retried. A claim left unfinished for IDEMPOTENCY_LOCK_SECONDS (its worker died)
+can be taken over. Rows expire after IDEMPOTENCY_TTL_SECONDS and are purged a batch at a
+time as new keys are claimed.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_PURGE_BATCH, IDEMPOTENCY_TTL_SECONDS
+from ..database import dialect_insert
+
+
+class KeyInProgress(Exception):
+    pass
+
+
+class KeyReused(Exception):
+    pass
+
+
+def request_hash(*parts) -> str:
+    """Fingerprint of what a key was used for (route, path parameters, body)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _row(owner: str, key: str):
+    K = models.IdempotencyKey
+    return and_(K.owner == owner, K.key == key)
+
+
+def claim(db: Session, owner: str, key: str, fingerprint: str, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS) -> Optional[Tuple[int, Any]]:
+    """Claim `key` for a new request (returns None) or return the (status_code, body) stored for it.
+
+    Commits either way. Raises KeyInProgress or KeyReused as described above.
+    """
+    K = models.IdempotencyKey
+    now = datetime.utcnow()
+    # An expired row or an abandoned claim for this key gives way to the new request
+    db.execute(
+        delete(K)
+        .where(_row(owner, key), or_(K.expires_at < now, and_(K.status_code.is_(None), K.created_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS))))
+        .execution_options(synchronize_session=False)
+    )
+    stmt = (
+        dialect_insert(db)(K.__table__)
+        .values(owner=owner, key=key, request_hash=fingerprint, created_at=now, expires_at=now + timedelta(seconds=ttl_seconds))
+        .on_conflict_do_nothing(index_elements=["owner", "key"])
+        .returning(K.id)
+    )
+    if db.execute(stmt).first() is not None:
+        purge_expired(db, now)
+        db.commit()
+        return None
+    row = db.query(K.request_hash, K.status_code, K.response).filter(_row(owner, key)).first()
+    db.commit()
+    if row is None or (row.request_hash == fingerprint and row.status_code is None):
+        raise KeyInProgress(key)
+    if row.request_hash != fingerprint:
+        raise KeyReused(key)
+    return row.status_code, json.loads(row.response)
+
+
+def complete(db: Session, owner: str, key: str, status_code: int, body: Any):
+    """Store the response of the request that claimed `key`, in the caller's transaction."""
+    K = models.IdempotencyKey
+    db.execute(
+        update(K)
+        .where(_row(owner, key), K.status_code.is_(None))
+        .values(status_code=status_code, response=json.dumps(body, separators=(",", ":")))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def abandon(db: Session, owner: str, key: str):
+    """Roll back a failed request and drop its claim so the key can be retried."""
+    K = models.IdempotencyKey
+    db.rollback()
+    db.execute(delete(K).where(_row(owner, key), K.status_code.is_(None)).execution_options(synchronize_session=False))
+    db.commit()
+
+
+def purge_expired(db: Session, now: Optional[datetime] = None, limit: int = IDEMPOTENCY_PURGE_BATCH) -> int:
+    """Delete up to `limit` expired keys in the caller's transaction; returns how many."""
+    K = models.IdempotencyKey
+    expired = select(K.id).where(K.expires_at < (now or datetime.utcnow())).limit(limit)
+    return db.execute(delete(K).where(K.id.in_(expired)).execution_options(synchronize_session=False)).rowcount
+
+
+def key_stats(db: Session) -> dict:
+    K = models.IdempotencyKey
+    now = datetime.utcnow()
+    total, pending, expired = db.query(
+        func.count(K.id),
+        func.count(K.id).filter(K.status_code.is_(None)),
+        func.count(K.id).filter(K.expires_at < now),
+    ).one()
+    return {"keys": total, "in_progress": pending, "expired": expired}
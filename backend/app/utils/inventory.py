@@ -0,0 +1,167 @@
+"""Stock reservations.
+
+Checkout takes stock out of products.available_qty with one conditional UPDATE over all
+lines (`available_qty >= wanted` per row, so the check and the decrement are a single
+atomic step under the row/database write lock) and records held StockReservation rows.
+Payment commits them; release or expiry puts the stock back. Every stock UPDATE returns
+the changed product rows, which feed the catalog cache and low-stock warnings directly.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import LOW_STOCK_THRESHOLD, RESERVATION_TTL_SECONDS
+from .catalog import CachedProduct
+
+logger = logging.getLogger(__name__)
+
+_RETURNED_COLUMNS = (
+    models.Product.id,
+    models.Product.name,
+    models.Product.description,
+    models.Product.code,
+    models.Product.price_per_unit,
+    models.Product.weight_per_unit,
+    models.Product.available_qty,
+)
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages: List[dict]):
+        self.shortages = shortages
+        super().__init__(", ".join(f"{s['name']} (requested {s['requested']}, available {s['available']})" for s in shortages))
+
+
+def _qty_by_product(lines: Dict[int, int]):
+    return case(lines, value=models.Product.id)
+
+
+def _update_stock(db: Session, lines: Dict[int, int], new_qty, *where) -> List[CachedProduct]:
+    stmt = (
+        update(models.Product)
+        .where(models.Product.id.in_(lines), *where)
+        .values(available_qty=new_qty)
+        .returning(*_RETURNED_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    return [CachedProduct.from_model(row) for row in db.execute(stmt)]
+
+
+def _adjust(db: Session, lines: Dict[int, int], sign: int, conditional: bool = False) -> List[CachedProduct]:
+    """available_qty += sign * qty for every line in one UPDATE; returns the rows it changed.
+    `conditional` skips rows that would go negative."""
+    qty = _qty_by_product(lines)
+    where = [models.Product.available_qty >= qty] if conditional else []
+    return _update_stock(db, lines, models.Product.available_qty + sign * qty, *where)
+
+
+def _shortages(db: Session, lines: Dict[int, int]) -> List[dict]:
+    rows = db.query(models.Product.id, models.Product.name, models.Product.available_qty).filter(models.Product.id.in_(lines)).all()
+    found = {r.id: r for r in rows}
+    return [
+        {"product_id": pid, "name": found[pid].name if pid in found else str(pid), "requested": qty, "available": found[pid].available_qty if pid in found else 0}
+        for pid, qty in lines.items()
+        if pid not in found or found[pid].available_qty < qty
+    ]
+
+
+def reserve_stock(db: Session, lines: Dict[int, int]) -> List[CachedProduct]:
+    """Take `lines` ({product_id: qty}) out of available stock in the caller's transaction, all or nothing.
+
+    Rows the conditional UPDATE did take are given back when another line falls short; the
+    expired holds of invoices holding a short product are then released and the UPDATE is
+    retried once.
+    Raises InsufficientStock if stock is still short; otherwise returns the updated products.
+    """
+    lines = {pid: qty for pid, qty in lines.items() if qty > 0}
+    if not lines:
+        return []
+    for attempt in range(2):
+        rows = _adjust(db, lines, -1, conditional=True)
+        taken = [p.id for p in rows]
+        if len(taken) == len(lines):
+            return rows
+        if taken:
+            _adjust(db, {pid: lines[pid] for pid in taken}, +1)
+        if attempt == 0 and not release_reservations(db, expired=True, product_ids=[pid for pid in lines if pid not in taken]):
+            break
+    raise InsufficientStock(_shortages(db, lines))
+
+
+def warn_low_stock(products: Iterable[CachedProduct], threshold: int = LOW_STOCK_THRESHOLD) -> List[CachedProduct]:
+    """Log the products at or below `threshold` after a stock change; returns them."""
+    low = [p for p in products if p.available_qty <= threshold]
+    for p in low:
+        logger.warning("low stock: %s (%s, id %s) has %d left", p.name, p.code, p.id, p.available_qty)
+    return low
+
+
+def hold_reservations(db: Session, invoice_id: int, lines: Dict[int, int], ttl_seconds: int = RESERVATION_TTL_SECONDS):
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl_seconds)
+    db.execute(
+        insert(models.StockReservation),
+        [
+            {"invoice_id": invoice_id, "product_id": pid, "quantity": qty, "status": models.ReservationStatus.held, "expires_at": expires_at}
+            for pid, qty in lines.items()
+        ],
+    )
+
+
+def _claim(db: Session, new_status: models.ReservationStatus, filters) -> List[Tuple[int, int]]:
+    """Move matching held reservations to `new_status`; returns the (product_id, quantity) this call claimed."""
+    R = models.StockReservation
+    values = {"status": new_status}
+    if new_status == models.ReservationStatus.released:
+        values["released_at"] = datetime.utcnow()
+    rows = db.execute(
+        update(R)
+        .where(R.status == models.ReservationStatus.held, *filters)
+        .values(**values)
+        .returning(R.product_id, R.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return [(r.product_id, r.quantity) for r in rows]
+
+
+def commit_reservations(db: Session, invoice_id: int) -> List[Tuple[int, int]]:
+    """Turn an invoice's held reservations into sold stock (payment). Returns what was committed."""
+    return _claim(db, models.ReservationStatus.committed, [models.StockReservation.invoice_id == invoice_id])
+
+
+def release_reservations(db: Session, invoice_id: Optional[int] = None, expired: bool = False, product_ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+    """Return held stock to available_qty, for one invoice and/or everything past its expiry.
+
+    `product_ids` narrows it to the invoices holding any of those products; their holds are
+    released as a whole, never line by line. The status flip and the stock increment happen in the caller's transaction; rows
+    already claimed by a concurrent release/commit are skipped. Returns {product_id: qty}.
+    """
+    R = models.StockReservation
+    filters = []
+    if invoice_id is not None:
+        filters.append(R.invoice_id == invoice_id)
+    if expired:
+        filters.append(R.expires_at < datetime.utcnow())
+    if product_ids is not None:
+        # A partly released hold would leave the invoice's other lines held, and paying it
+        # would commit those as if the whole invoice still had its stock
+        holders = select(R.invoice_id).where(R.status == models.ReservationStatus.held, R.product_id.in_(list(product_ids)), *filters)
+        filters.append(R.invoice_id.in_(holders))
+    if not filters:
+        raise ValueError("release_reservations needs an invoice_id, expired=True or product_ids")
+    returned: Dict[int, int] = defaultdict(int)
+    for pid, qty in _claim(db, models.ReservationStatus.released, filters):
+        returned[pid] += qty
+    if returned:
+        _adjust(db, dict(returned), +1)
+    return dict(returned)
+
+
+def held_stock(db: Session) -> Dict[int, int]:
+    """{product_id: qty} currently held by unpaid checkouts."""
+    R = models.StockReservation
+    rows = db.query(R.product_id, func.sum(R.quantity)).filter(R.status == models.ReservationStatus.held).group_by(R.product_id).all()
+    return {pid: int(qty) for pid, qty in rows}
@@ -1,27 +1,65 @@
+import os
 import smtplib
+import threading
+from collections import deque
 from email.message import EmailMessage
-from typing import Optional
+from typing import List, Optional
 
-from ..config import EMAIL_ENABLED, SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, EMAIL_FROM
+from ..config import EMAIL_ENABLED, SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, EMAIL_FROM, EMAIL_BACKEND, EMAIL_SINK_DIR
+
+
+class MailSink:
+    """Fake SMTP server for local runs and tests: keeps the last messages in memory."""
+
+    def __init__(self, maxlen: int = 1000, directory: str = EMAIL_SINK_DIR):
+        self.directory = directory
+        self._messages: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def deliver(self, msg: EmailMessage):
+        with self._lock:
+            self._messages.append(msg)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            name = msg["Message-ID"].strip("<>").replace("@", "_")
+            with open(os.path.join(self.directory, f"{name}.eml"), "wb") as f:
+                f.write(msg.as_bytes())
+
+    def messages(self) -> List[EmailMessage]:
+        with self._lock:
+            return list(self._messages)
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+
+
+mail_sink = MailSink()
 
 
 def send_invoice_email_if_enabled(to_email: str, pdf_bytes: bytes, invoice_code: str) -> Optional[str]:
     if not EMAIL_ENABLED:
         return None
-    if not (SMTP_HOST and SMTP_USER and SMTP_PASSWORD and EMAIL_FROM):
+    sink = EMAIL_BACKEND == "sink"
+    if not sink and not (SMTP_HOST and SMTP_USER and SMTP_PASSWORD and EMAIL_FROM):
         return None
 
     msg = EmailMessage()
     msg["Subject"] = f"Your Invoice {invoice_code}"
-    msg["From"] = EMAIL_FROM
+    msg["From"] = EMAIL_FROM or "noreply@localhost"
     msg["To"] = to_email
+    # Stable per invoice so a retried send is recognisable as the same message downstream
+    msg["Message-ID"] = f"<invoice-{invoice_code}@self-checkout>"
     msg.set_content("Thank you for shopping! Your invoice is attached.")
 
     msg.add_attachment(pdf_bytes, maintype="application", subtype="pdf", filename=f"invoice_{invoice_code}.pdf")
 
+    if sink:
+        mail_sink.deliver(msg)
+        return "sink"
+
     with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
         server.starttls()
         server.login(SMTP_USER, SMTP_PASSWORD)
         server.send_message(msg)
     return "sent"
-
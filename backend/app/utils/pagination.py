@@ -0,0 +1,47 @@
+import base64
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from .. import models
+
+
+def encode_cursor(date: datetime, id: int) -> str:
+    raw = f"{date.isoformat()}|{id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError on anything that is not a cursor we issued."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    date_s, id_s = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").split("|")
+    return datetime.fromisoformat(date_s), int(id_s)
+
+
+def invoice_keyset_page(db: Session, customer_id: int, limit: int, cursor: Optional[str] = None) -> Tuple[List[models.Invoice], Optional[str]]:
+    """Newest-first page of a customer's invoices ordered by (date, id), seeking past `cursor`."""
+    q = db.query(models.Invoice).filter(models.Invoice.customer_id == customer_id)
+    if cursor:
+        date, id = decode_cursor(cursor)
+        q = q.filter(or_(models.Invoice.date < date, and_(models.Invoice.date == date, models.Invoice.id < id)))
+    rows = q.order_by(models.Invoice.date.desc(), models.Invoice.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1].date, page[-1].id) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def iter_customer_invoices(session_factory, customer_id: int, chunk_size: int = 500) -> Iterator[models.Invoice]:
+    """Walk every invoice of a customer chunk by chunk on a private session; memory stays O(chunk_size)."""
+    cursor = None
+    while True:
+        db = session_factory()
+        try:
+            page, cursor = invoice_keyset_page(db, customer_id, chunk_size, cursor)
+            db.expunge_all()
+        finally:
+            db.close()
+        yield from page
+        if cursor is None:
+            break
@@ -0,0 +1,109 @@
+"""bcrypt off the request threads.
+
+Hashing and verification run in a small process pool, so a burst of logins costs worker
+processes' CPU instead of holding request threads (and the GIL) for ~250 ms each. A
+semaphore bounds queued + running calls; once full, callers get PasswordPoolBusy
+immediately rather than waiting behind the burst.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Optional, Tuple
+
+from .. import security
+from ..config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT_SECONDS
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when the pool already has max_pending calls queued or running."""
+
+
+def _noop():
+    return None
+
+
+class PasswordHasherPool:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING, timeout: float = PASSWORD_HASH_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self):
+        """Spawn the worker processes up front so the first login doesn't pay for it."""
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the parent has job-worker and pool threads running
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            executor = self._executor
+        for f in [executor.submit(_noop) for _ in range(self.workers)]:
+            f.result()
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordPoolBusy()
+        with self._lock:
+            self._pending += 1
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                self._release()
+        try:
+            if self._executor is None:
+                self.start()
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the worker is done with the call, not until we stop waiting:
+        # calls that time out still occupy a process, and must keep counting against max_pending
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            future.cancel()  # still queued: drop it (releases the slot); already running: no-op
+            raise PasswordPoolBusy()
+
+    # -- public API --
+    def hash(self, password: str) -> str:
+        return self._run(security.get_password_hash, password)
+
+    def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        return self._run(security.verify_and_update_password, password, hashed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self._executor is not None,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "bcrypt_rounds": security.BCRYPT_ROUNDS,
+            }
+
+
+password_pool = PasswordHasherPool()
@@ -16,7 +16,16 @@ def inr(amount: float) -> str:
     return f"{INR_SYMBOL}{amount:,.2f}"
 
 
-def build_invoice_pdf(invoice: models.Invoice) -> bytes:
+def invoice_line_items(invoice: models.Invoice):
+    """(name, qty, subtotal, net_weight) per line; invoice.items if present, else cart.items for legacy invoices."""
+    line_items = invoice.items if getattr(invoice, "items", None) else invoice.cart.items
+    return [
+        (item.product.name if getattr(item, "product", None) else "Item", item.quantity, item.subtotal, item.net_weight)
+        for item in line_items
+    ]
+
+
+def build_invoice_pdf(invoice: models.Invoice, lines=None) -> bytes:
     buffer = BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
     width, height = A4
@@ -32,14 +41,8 @@ def build_invoice_pdf(invoice: models.Invoice) -> bytes:
 
     # Table of items
     data = [["Product", "Qty", "Subtotal", "Net Wt"]]
-    # Prefer invoice.items if present, else fall back to cart.items for legacy invoices
-    line_items = invoice.items if getattr(invoice, "items", None) else invoice.cart.items
     total_weight = 0.0
-    for item in line_items:
-        name = item.product.name if getattr(item, "product", None) else "Item"
-        qty = item.quantity
-        subtotal = item.subtotal
-        net_wt = item.net_weight
+    for name, qty, subtotal, net_wt in (lines if lines is not None else invoice_line_items(invoice)):
         total_weight += net_wt
         data.append([
             name,
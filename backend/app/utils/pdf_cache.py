@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from .. import models
+from ..cache import shared_cache
+from ..config import PDF_CACHE_MEMORY_BYTES, PDF_CACHE_DIR, PDF_CACHE_DISK_MAX_BYTES
+from .pdf import build_invoice_pdf, invoice_line_items
+
+
+def invoice_fingerprint(invoice: models.Invoice, lines) -> str:
+    """Hash of everything the PDF renders; changes iff the rendered invoice would change."""
+    content = {
+        "code": invoice.code,
+        "date": invoice.date.isoformat() if invoice.date else None,
+        "customer": [invoice.customer.name, invoice.customer.email],
+        "total": invoice.total,
+        "lines": lines,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class InvoicePdfCache:
+    """Cache of rendered invoice PDFs keyed by (invoice code, content hash): memory, then disk,
+    then the shared cache backend when there is one (CACHE_BACKEND=redis)."""
+
+    def __init__(self, memory_bytes: int = PDF_CACHE_MEMORY_BYTES, directory: str = PDF_CACHE_DIR, disk_max_bytes: int = PDF_CACHE_DISK_MAX_BYTES):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _path(self, code: str, digest: str) -> str:
+        safe = re.sub(r"[^A-Za-z0-9_-]", "_", code)
+        return os.path.join(self.directory, f"{safe}-{digest}.pdf")
+
+    def _remember(self, key, pdf: bytes):
+        if len(pdf) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = pdf
+            self._size += len(pdf)
+            while self._size > self.memory_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _write_disk(self, path: str, pdf: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(pdf)
+        os.replace(tmp, path)
+        self._prune_disk()
+
+    def _prune_disk(self):
+        files = [os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith(".pdf")]
+        stats = [(os.path.getmtime(p), os.path.getsize(p), p) for p in files]
+        total = sum(s for _, s, _ in stats)
+        for _, size, p in sorted(stats):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def lookup(self, code: str, digest: str) -> Optional[bytes]:
+        key = (code, digest)
+        with self._lock:
+            pdf = self._entries.get(key)
+            if pdf is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return pdf
+        if self.directory:
+            try:
+                with open(self._path(code, digest), "rb") as f:
+                    pdf = f.read()
+            except FileNotFoundError:
+                pdf = None
+            if pdf is not None:
+                self.disk_hits += 1
+                self._remember(key, pdf)
+                return pdf
+        if shared_cache.shared:
+            pdf = shared_cache.get(f"pdf:{code}:{digest}")
+            if pdf is not None:
+                self.shared_hits += 1
+                self._remember(key, pdf)
+                return pdf
+        self.misses += 1
+        return None
+
+    def store(self, code: str, digest: str, pdf: bytes):
+        self._remember((code, digest), pdf)
+        if self.directory:
+            self._write_disk(self._path(code, digest), pdf)
+        if shared_cache.shared:
+            shared_cache.set(f"pdf:{code}:{digest}", pdf)
+
+    def fingerprint(self, invoice: models.Invoice) -> Tuple[list, str]:
+        lines = invoice_line_items(invoice)
+        return lines, invoice_fingerprint(invoice, lines)
+
+    def get_or_render(self, invoice: models.Invoice, fingerprint: Optional[Tuple[list, str]] = None) -> Tuple[bytes, str]:
+        """Return (pdf_bytes, etag) for the invoice, rendering only on a miss."""
+        lines, digest = fingerprint or self.fingerprint(invoice)
+        pdf = self.lookup(invoice.code, digest)
+        if pdf is None:
+            pdf = build_invoice_pdf(invoice, lines)
+            self.store(invoice.code, digest, pdf)
+        return pdf, f'"{digest}"'
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "memory_bytes": self._size,
+                "memory_limit_bytes": self.memory_bytes,
+                "disk_dir": self.directory or None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+            }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
+pdf_cache = InvoicePdfCache()
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..cache import shared_cache
+from ..config import PRINCIPAL_CACHE_ENABLED, PRINCIPAL_CACHE_MAX_ITEMS, PRINCIPAL_CACHE_TTL_SECONDS
+
+CUSTOMER = "customer"
+OFFICIAL = "official"
+OFFICIAL_ROLES = ("cashier", "admin")
+INVALIDATION_TOPIC = "principals"
+
+
+class Principal:
+    """The authenticated account behind a token. Attribute-compatible with what handlers read
+    from Customer / StoreOfficial (id, name, email, role)."""
+
+    __slots__ = ("kind", "id", "role", "name", "email")
+
+    def __init__(self, kind, id, role, name, email):
+        self.kind = kind
+        self.id = id
+        self.role = role
+        self.name = name
+        self.email = email
+
+    @classmethod
+    def from_customer(cls, c: models.Customer) -> "Principal":
+        return cls(CUSTOMER, c.id, CUSTOMER, c.name, c.email)
+
+    @classmethod
+    def from_official(cls, o: models.StoreOfficial) -> "Principal":
+        return cls(OFFICIAL, o.id, o.role or "cashier", o.name, o.email)
+
+
+def kind_for_role(role: Optional[str]) -> Optional[str]:
+    if role == CUSTOMER:
+        return CUSTOMER
+    if role in OFFICIAL_ROLES:
+        return OFFICIAL
+    return None
+
+
+def load_principal(db: Session, payload: dict) -> Optional[Principal]:
+    """Look up the account named by a verified token: by primary key when the token carries
+    `uid`, by email for tokens issued before it did. The email must still match either way."""
+    kind = kind_for_role(payload.get("role"))
+    email = payload.get("sub")
+    if kind is None or not email:
+        return None
+    model = models.Customer if kind == CUSTOMER else models.StoreOfficial
+    uid = payload.get("uid")
+    if uid is not None:
+        user = db.get(model, uid)
+        if user is None or user.email != email:
+            return None
+    else:
+        user = db.query(model).filter(model.email == email).first()
+        if user is None:
+            return None
+    return Principal.from_customer(user) if kind == CUSTOMER else Principal.from_official(user)
+
+
+class PrincipalCache:
+    """Bounded LRU of verified token -> Principal.
+
+    An entry lives for at most PRINCIPAL_CACHE_TTL_SECONDS and never past the token's own
+    `exp`. Account updates/deletes made through the ORM in this process drop the account's
+    entries immediately. Other workers drop them when the change is broadcast (shared cache
+    backend), or else when their entry's TTL runs out.
+    """
+
+    def __init__(self, max_items: int = PRINCIPAL_CACHE_MAX_ITEMS, ttl: float = PRINCIPAL_CACHE_TTL_SECONDS, enabled: bool = PRINCIPAL_CACHE_ENABLED, bus=shared_cache):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.enabled = enabled and ttl > 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Principal, float]]" = OrderedDict()
+        self._tokens_by_account: Dict[Tuple[str, int], Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._bus = bus
+        bus.subscribe(INVALIDATION_TOPIC, lambda m: self._forget_account(m["kind"], m["id"]))
+
+    # -- internal helpers (caller holds the lock) --
+    def _drop(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        key = (entry[0].kind, entry[0].id)
+        tokens = self._tokens_by_account.get(key)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_account[key]
+
+    # -- public API --
+    def get(self, token: str) -> Optional[Principal]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._drop(token)
+            self.misses += 1
+            return None
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float] = None):
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+        with self._lock:
+            self._drop(token)
+            self._entries[token] = (principal, expires_at)
+            self._tokens_by_account.setdefault((principal.kind, principal.id), set()).add(token)
+            while len(self._entries) > self.max_items:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_account(self, kind: str, account_id: int):
+        """Forget every cached token of one account (call after changing or removing it), in every worker."""
+        self._forget_account(kind, account_id)
+        self._bus.publish(INVALIDATION_TOPIC, {"kind": kind, "id": account_id})
+
+    def _forget_account(self, kind: str, account_id: int):
+        with self._lock:
+            for token in list(self._tokens_by_account.get((kind, account_id), ())):
+                self._drop(token)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_account.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_items": self.max_items,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+principal_cache = PrincipalCache()
+
+
+def _on_account_change(kind: str):
+    def listener(mapper, connection, target):
+        principal_cache.invalidate_account(kind, target.id)
+    return listener
+
+
+for _model, _kind in ((models.Customer, CUSTOMER), (models.StoreOfficial, OFFICIAL)):
+    event.listen(_model, "after_update", _on_account_change(_kind))
+    event.listen(_model, "after_delete", _on_account_change(_kind))
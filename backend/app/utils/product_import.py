@@ -0,0 +1,188 @@
+"""Bulk product import from CSV or NDJSON.
+
+Rows are parsed lazily from a text stream, validated one by one (bad rows are reported and
+skipped), and upserted by `code` with INSERT ... ON CONFLICT DO UPDATE, one statement and
+one transaction per batch. A batch the database rejects is retried row by row so only the
+offending rows are reported. The catalog version is bumped once at the end.
+
+An imported available_qty is a shelf count. Units held by unpaid checkouts are still on the
+shelf but already out of available_qty, so they are subtracted right after the upsert; otherwise
+releasing or expiring those holds would hand the same units back a second time.
+"""
+import csv
+import json
+import time
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from pydantic import ValidationError
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import PRODUCT_IMPORT_BATCH_SIZE
+from ..database import dialect_insert
+from ..schemas import ProductImportRow
+from .catalog import PRODUCT_SPECS_VERSION_KEY, bump_catalog_version, bump_version, catalog_cache
+
+FORMATS = ("csv", "ndjson")
+MAX_REPORTED_ERRORS = 1000
+_UPDATED_COLUMNS = ("name", "description", "price_per_unit", "weight_per_unit")
+
+
+class ImportReport:
+    def __init__(self, max_errors: int = MAX_REPORTED_ERRORS):
+        self.rows = 0
+        self.upserted = 0
+        self.batches = 0
+        self.error_count = 0
+        self.errors: List[dict] = []
+        self.max_errors = max_errors
+        self.seconds = 0.0
+
+    def error(self, row: int, code: Optional[str], message: str):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "code": code, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "upserted": self.upserted,
+            "batches": self.batches,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def format_for(filename: Optional[str], content_type: Optional[str] = None) -> Optional[str]:
+    """Guess the import format from a file name or content type."""
+    name = (filename or "").lower()
+    ctype = (content_type or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in ctype or "jsonl" in ctype:
+        return "ndjson"
+    if name.endswith(".csv") or "csv" in ctype:
+        return "csv"
+    return None
+
+
+def read_rows(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Union[dict, str]]]:
+    """Yield (row number, raw dict) or (row number, error message) without reading the whole stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for raw in reader:
+            if None in raw:
+                yield reader.line_num, "more fields than the header"
+                continue
+            # Empty cells mean "not given" (e.g. keep the current stock)
+            yield reader.line_num, {k.strip(): v.strip() for k, v in raw.items() if k and v is not None and v.strip() != ""}
+    elif fmt == "ndjson":
+        for n, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError as e:
+                yield n, f"invalid JSON: {e}"
+                continue
+            yield n, raw if isinstance(raw, dict) else "expected a JSON object"
+    else:
+        raise ValueError(f"unknown import format {fmt!r}; expected one of {FORMATS}")
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc']) or 'row'}: {err['msg']}" for err in e.errors())
+
+
+def _subtract_held(db: Session, codes: List[str]):
+    """available_qty -= units held by unpaid checkouts (not below zero) for freshly imported shelf counts."""
+    R, Product = models.StockReservation, models.Product
+    held = (
+        select(func.coalesce(func.sum(R.quantity), 0))
+        .where(R.product_id == Product.id, R.status == models.ReservationStatus.held)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(Product)
+        .where(Product.code.in_(codes))
+        .values(available_qty=case((Product.available_qty > held, Product.available_qty - held), else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _upsert(db: Session, rows: List[dict]):
+    """INSERT ... ON CONFLICT (code) DO UPDATE per column set; rows without available_qty keep their stock."""
+    insert_ = dialect_insert(db)
+    for with_qty in (True, False):
+        group = [r for r in rows if (r["available_qty"] is not None) == with_qty]
+        if not group:
+            continue
+        if not with_qty:
+            group = [{**r, "available_qty": 0} for r in group]
+        # Core table + parameter list: one cached statement run as executemany (a multi-row
+        # VALUES clause would be recompiled for every batch)
+        stmt = insert_(models.Product.__table__)
+        columns = _UPDATED_COLUMNS + (("available_qty",) if with_qty else ())
+        db.execute(stmt.on_conflict_do_update(index_elements=["code"], set_={c: stmt.excluded[c] for c in columns}), group)
+        if with_qty:
+            # Same transaction, so no hold can land between the count and the subtraction
+            _subtract_held(db, [r["code"] for r in group])
+
+
+def _flush(db: Session, batch: List[Tuple[int, dict]], report: ImportReport):
+    # Last row wins within a batch (Postgres refuses to update one row twice in a statement)
+    latest = {}
+    for n, row in batch:
+        latest[row["code"]] = (n, row)
+    report.batches += 1
+    try:
+        _upsert(db, [row for _, row in latest.values()])
+        db.commit()
+        report.upserted += len(latest)
+        return
+    except SQLAlchemyError:
+        db.rollback()
+    for n, row in latest.values():
+        try:
+            _upsert(db, [row])
+            db.commit()
+            report.upserted += 1
+        except SQLAlchemyError as e:
+            db.rollback()
+            report.error(n, row["code"], str(getattr(e, "orig", e)).splitlines()[0])
+
+
+def import_products(db: Session, rows: Iterable[Tuple[int, Union[dict, str]]], batch_size: int = PRODUCT_IMPORT_BATCH_SIZE) -> ImportReport:
+    """Upsert parsed rows (see read_rows) in batches of `batch_size`, committing each batch."""
+    started = time.perf_counter()
+    report = ImportReport()
+    batch: List[Tuple[int, dict]] = []
+    try:
+        for n, raw in rows:
+            report.rows += 1
+            if isinstance(raw, str):
+                report.error(n, None, raw)
+                continue
+            try:
+                row = ProductImportRow.model_validate(raw)
+            except ValidationError as e:
+                report.error(n, raw.get("code"), _validation_message(e))
+                continue
+            batch.append((n, row.model_dump()))
+            if len(batch) >= batch_size:
+                _flush(db, batch, report)
+                batch = []
+        if batch:
+            _flush(db, batch, report)
+    finally:
+        # One invalidation for the whole run (also when the stream breaks off after some
+        # committed batches); other workers notice the new version
+        if report.upserted:
+            bump_catalog_version(db)
+            bump_version(db, PRODUCT_SPECS_VERSION_KEY)
+            db.commit()
+            catalog_cache.invalidate()
+    report.seconds = time.perf_counter() - started
+    return report
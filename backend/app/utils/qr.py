@@ -1,10 +1,53 @@
 import qrcode
+import qrcode.image.svg
+from functools import lru_cache
 from io import BytesIO
 
+from ..cache import shared_cache
+from ..config import QR_CACHE_SIZE
 
-def generate_qr_png(data: str) -> bytes:
-    img = qrcode.make(data)
+# Invoice codes never change, so rendered QR images can be cached for as long as clients like
+QR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+QR_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def _render_cached(data: str, fmt: str, box_size: int, border: int) -> bytes:
+    # With a shared cache backend, an image rendered by any worker is reused by the others
+    key = f"qr:{fmt}:{box_size}:{border}:{data}"
+    image = shared_cache.get(key) if shared_cache.shared else None
+    if image is None:
+        image = _render(data, fmt, box_size, border)
+        if shared_cache.shared:
+            shared_cache.set(key, image)
+    return image
+
+
+def _render(data: str, fmt: str, box_size: int, border: int) -> bytes:
+    qr = qrcode.QRCode(box_size=box_size, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
     buf = BytesIO()
-    img.save(buf, format="PNG")
+    if fmt == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buf)
+    else:
+        qr.make_image().save(buf, format="PNG")
     return buf.getvalue()
 
+
+def render_qr(data: str, fmt: str = "png", box_size: int = 10, border: int = 4) -> bytes:
+    """Render (and memoise) a QR code. `svg` uses a single-path SVG, the most compact vector form."""
+    # Always call positionally so equal parameters share one lru_cache key
+    return _render_cached(data, fmt, box_size, border)
+
+
+def qr_cache_info() -> dict:
+    return _render_cached.cache_info()._asdict()
+
+
+def qr_cache_clear():
+    _render_cached.cache_clear()
+
+
+def generate_qr_png(data: str) -> bytes:
+    return render_qr(data, "png")
@@ -0,0 +1,47 @@
+import threading
+from contextlib import contextmanager
+from typing import List
+
+from sqlalchemy import event
+
+from ..database import engine
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(bind=None):
+    """Record every SQL statement sent through `bind` (default: the app engine) while the block runs."""
+    bind = bind or engine
+    counter = QueryCounter()
+    event.listen(bind, "before_cursor_execute", counter._on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", counter._on_execute)
+
+
+@contextmanager
+def assert_max_queries(budget: int, bind=None):
+    """Fail when the block issues more than `budget` statements, e.g. in tests:
+
+        with assert_max_queries(6):
+            client.get("/cart/", headers=auth)
+    """
+    with count_queries(bind) as counter:
+        yield counter
+    if counter.count > budget:
+        listing = "\n".join(f"  {i + 1}. {s}" for i, s in enumerate(counter.statements))
+        raise AssertionError(f"Expected at most {budget} queries, got {counter.count}:\n{listing}")
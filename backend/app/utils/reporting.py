@@ -0,0 +1,293 @@
+"""Columnar reporting over paid invoice lines.
+
+Lines are bulk-extracted into NumPy arrays (one array per column) and every report is a
+vectorized group-by (np.bincount, or np.unique for sparse keys), so cost scales with a few passes over
+contiguous memory rather than with per-row Python work.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select, union_all
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import REPORT_CACHE_ENTRIES, REPORT_DEFAULT_DAYS
+from .catalog import PRODUCT_SPECS_VERSION_KEY, read_version
+
+EXTRACT_CHUNK_ROWS = 100_000
+
+
+@dataclass
+class LineColumns:
+    """One element per invoice line of a paid invoice."""
+    invoice_id: np.ndarray  # int64
+    product_id: np.ndarray  # int64
+    quantity: np.ndarray  # int64
+    subtotal: np.ndarray  # float64
+    net_weight: np.ndarray  # float64
+    ts: np.ndarray  # int64, invoice date as UTC epoch seconds
+    unit_price: np.ndarray  # float64, current catalog price
+    unit_weight: np.ndarray  # float64, current catalog weight
+
+    def __len__(self):
+        return len(self.invoice_id)
+
+    def save(self, file):
+        """Write all columns to one .npz archive (a path or a binary file object)."""
+        np.savez(file, **{f.name: getattr(self, f.name) for f in fields(self)})
+
+    @classmethod
+    def load(cls, file) -> "LineColumns":
+        with np.load(file) as data:
+            return cls(**{f.name: data[f.name] for f in fields(cls)})
+
+
+_DTYPES = {
+    "invoice_id": np.int64,
+    "product_id": np.int64,
+    "quantity": np.int64,
+    "subtotal": np.float64,
+    "net_weight": np.float64,
+    "ts": np.int64,
+    "unit_price": np.float64,
+    "unit_weight": np.float64,
+}
+
+
+def _epoch_seconds(db: Session, column):
+    if db.get_bind().dialect.name == "postgresql":
+        return cast(func.extract("epoch", column), Integer)
+    return cast(func.strftime("%s", column), Integer)
+
+
+def report_range(start: Optional[date] = None, end: Optional[date] = None) -> Tuple[date, date]:
+    """Fill in a missing bound: `end` defaults to today (UTC, like invoice dates) and `start` to
+    REPORT_DEFAULT_DAYS before it, so an unfiltered request never scans the whole history."""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=REPORT_DEFAULT_DAYS - 1)
+    return start, end
+
+
+class ExtractCache:
+    """The last few extracted ranges. An entry is reused while the range's paid invoice count,
+    its highest paid invoice id and the product specs version (current price/weight columns)
+    are unchanged, which one small aggregate query checks."""
+
+    def __init__(self, max_entries: int = REPORT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, LineColumns]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[LineColumns]:
+        with self._lock:
+            cols = self._entries.get(key)
+            if cols is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cols
+
+    def put(self, key: tuple, cols: LineColumns):
+        with self._lock:
+            # Keep only the newest state of each range
+            for stale in [k for k in self._entries if k[:2] == key[:2]]:
+                del self._entries[stale]
+            self._entries[key] = cols
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+extract_cache = ExtractCache()
+
+
+def _extract_key(db: Session, start: date, end: date) -> tuple:
+    Invoice = models.Invoice
+    count, max_id = (
+        db.query(func.count(Invoice.id), func.max(Invoice.id))
+        .filter(
+            Invoice.status == models.InvoiceStatus.paid,
+            Invoice.date >= datetime.combine(start, time.min),
+            Invoice.date < datetime.combine(end + timedelta(days=1), time.min),
+        )
+        .one()
+    )
+    # Not the catalog version: every checkout and payment bumps that for the stock change alone
+    return (start, end, count, max_id, read_version(db, PRODUCT_SPECS_VERSION_KEY))
+
+
+def extract_lines(db: Session, start: Optional[date] = None, end: Optional[date] = None) -> LineColumns:
+    """Paid invoice lines between `start` and `end` (inclusive invoice dates; see report_range
+    for the defaults) as typed column arrays. The arrays are read-only: results are cached."""
+    start, end = report_range(start, end)
+    if extract_cache.max_entries <= 0:
+        return _extract_lines(db, start, end)
+    key = _extract_key(db, start, end)
+    cols = extract_cache.get(key)
+    if cols is None:
+        cols = _extract_lines(db, start, end)
+        extract_cache.put(key, cols)
+    return cols
+
+
+def _extract_lines(db: Session, start: date, end: date) -> LineColumns:
+    """Stream paid invoice lines out of the DB in chunks and pack them into typed arrays.
+
+    Lines come from the invoice_items snapshot; legacy invoices without one fall back to
+    their cart's items, as the PDF renderer does.
+    """
+    Invoice, Product = models.Invoice, models.Product
+    # Invoices with no date cannot be placed in a range (or an epoch column); leave them out
+    filters = [
+        Invoice.status == models.InvoiceStatus.paid,
+        Invoice.date.isnot(None),
+        Invoice.date >= datetime.combine(start, time.min),
+        Invoice.date < datetime.combine(end + timedelta(days=1), time.min),
+    ]
+
+    def lines_from(item, join_on, *extra):
+        return (
+            select(
+                Invoice.id,
+                item.product_id,
+                item.quantity,
+                item.subtotal,
+                item.net_weight,
+                _epoch_seconds(db, Invoice.date),
+                Product.price_per_unit,
+                Product.weight_per_unit,
+            )
+            .join(Invoice, join_on)
+            .join(Product, Product.id == item.product_id)
+            .where(*filters, *extra)
+        )
+
+    snapshot = lines_from(models.InvoiceItem, Invoice.id == models.InvoiceItem.invoice_id)
+    legacy = lines_from(
+        models.CartItem,
+        Invoice.cart_id == models.CartItem.cart_id,
+        ~select(models.InvoiceItem.id).where(models.InvoiceItem.invoice_id == Invoice.id).exists(),
+    )
+    stmt = union_all(snapshot, legacy)
+
+    names = list(_DTYPES)
+    chunks = {n: [] for n in names}
+    result = db.execute(stmt.execution_options(yield_per=EXTRACT_CHUNK_ROWS))
+    for rows in result.partitions():
+        for name, values in zip(names, zip(*rows)):
+            chunks[name].append(np.asarray(values, dtype=_DTYPES[name]))
+    columns = {n: (np.concatenate(chunks[n]) if chunks[n] else np.empty(0, dtype=_DTYPES[n])) for n in names}
+    for array in columns.values():
+        array.setflags(write=False)  # may be shared through the extract cache
+    return LineColumns(**columns)
+
+
+def _dense(keys: np.ndarray) -> bool:
+    return bool(len(keys)) and keys.min() >= 0 and keys.max() < 4 * len(keys) + 1024
+
+
+def _group(keys: np.ndarray, *weights: np.ndarray):
+    """Group-by-sum. Returns (distinct keys, row count per key, one weighted sum per `weights`).
+
+    Ids from the DB are small dense integers, so bincount over the raw key is used directly;
+    sparse keys fall back to a sort-based np.unique.
+    """
+    if _dense(keys):
+        counts = np.bincount(keys)
+        ids = np.flatnonzero(counts)
+        sums = [np.bincount(keys, weights=w, minlength=len(counts))[ids] for w in weights]
+        return ids, counts[ids], sums
+    ids, idx, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return ids, counts, [np.bincount(idx, weights=w, minlength=len(ids)) for w in weights]
+
+
+def _percentile(values: np.ndarray, q: float) -> float:
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def basket_size_distribution(cols: LineColumns, max_size: int = 50) -> Dict:
+    """Histogram of units per invoice; sizes above max_size are folded into the last bucket."""
+    if not len(cols):
+        return {"invoices": 0, "mean_units": 0.0, "p50_units": 0.0, "p95_units": 0.0, "mean_lines": 0.0, "histogram": []}
+    _, lines, (units,) = _group(cols.invoice_id, cols.quantity)
+    units = units.astype(np.int64)
+    counts = np.bincount(np.minimum(units, max_size), minlength=max_size + 1)
+    return {
+        "invoices": int(len(units)),
+        "mean_units": float(units.mean()),
+        "p50_units": _percentile(units, 50),
+        "p95_units": _percentile(units, 95),
+        "mean_lines": float(lines.mean()),
+        "histogram": [
+            {"units": f"{size}+" if size == max_size else size, "invoices": int(n)}
+            for size, n in enumerate(counts)
+            if n
+        ],
+    }
+
+
+def product_revenue(cols: LineColumns, limit: int = 20) -> list:
+    """Top products by revenue: [{product_id, revenue, units, lines}] sorted by revenue desc."""
+    if not len(cols):
+        return []
+    ids, lines, (revenue, units) = _group(cols.product_id, cols.subtotal, cols.quantity)
+    top = np.argsort(revenue)[::-1][:limit]
+    return [
+        {"product_id": int(ids[i]), "revenue": float(revenue[i]), "units": int(units[i]), "lines": int(lines[i])}
+        for i in top
+    ]
+
+
+def hourly_heatmap(cols: LineColumns, tz_offset_minutes: int = 330) -> Dict:
+    """7x24 revenue and invoice-count matrices (rows Monday..Sunday, columns hour of day) in local time."""
+    local = cols.ts + tz_offset_minutes * 60
+    days = local // 86400
+    cell = ((days + 3) % 7) * 24 + (local // 3600) % 24  # 1970-01-01 was a Thursday
+    revenue = np.bincount(cell, weights=cols.subtotal, minlength=168)
+    # count each invoice once; all lines of an invoice share its timestamp, so any line will do
+    if _dense(cols.invoice_id):
+        cell_of = np.full(cols.invoice_id.max() + 1, -1, dtype=np.int64)
+        cell_of[cols.invoice_id] = cell
+        invoice_cells = cell_of[cell_of >= 0]
+    else:
+        _, first = np.unique(cols.invoice_id, return_index=True)
+        invoice_cells = cell[first]
+    invoices = np.bincount(invoice_cells, minlength=168)
+    return {
+        "tz_offset_minutes": tz_offset_minutes,
+        "revenue": revenue.reshape(7, 24).round(2).tolist(),
+        "invoices": invoices.reshape(7, 24).tolist(),
+    }
+
+
+def weight_price_reconciliation(cols: LineColumns, tolerance: float = 0.01, limit: int = 20) -> Dict:
+    """Compare recorded line subtotal/net weight against quantity x current catalog price/weight."""
+    price_gap = cols.subtotal - cols.unit_price * cols.quantity
+    weight_gap = cols.net_weight - cols.unit_weight * cols.quantity
+    flagged = (np.abs(price_gap) > tolerance) | (np.abs(weight_gap) > tolerance)
+    out = {
+        "lines": int(len(cols)),
+        "flagged_lines": int(flagged.sum()),
+        "price_gap_total": float(price_gap.sum()),
+        "weight_gap_total": float(weight_gap.sum()),
+        "products": [],
+    }
+    if not flagged.any():
+        return out
+    ids, n, (pg, wg) = _group(cols.product_id[flagged], price_gap[flagged], weight_gap[flagged])
+    order = np.argsort(np.abs(pg))[::-1][:limit]
+    out["products"] = [
+        {"product_id": int(ids[i]), "flagged_lines": int(n[i]), "price_gap": float(pg[i]), "weight_gap": float(wg[i])}
+        for i in order
+    ]
+    return out
@@ -0,0 +1,85 @@
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import ANALYTICS_ROLLUP_MAX_AGE_SECONDS
+from ..database import dialect_insert
+
+SALES_ROLLUP = "sales"
+
+
+def _increment(db: Session, model, key: dict, amount_col: str, amount: float):
+    insert_ = dialect_insert(db)
+    stmt = insert_(model).values(**key, **{amount_col: amount, "invoice_count": 1})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={
+            amount_col: getattr(model, amount_col) + amount,
+            "invoice_count": model.invoice_count + 1,
+        },
+    )
+    db.execute(stmt)
+
+
+def record_paid_invoice(db: Session, invoice: models.Invoice):
+    """Fold one newly paid invoice into the rollups, inside the payment transaction."""
+    day = (invoice.date or datetime.utcnow()).date()
+    _increment(db, models.DailySales, {"day": day}, "revenue", invoice.total)
+    _increment(db, models.CustomerSales, {"customer_id": invoice.customer_id}, "spent", invoice.total)
+    _increment(db, models.CustomerDailySales, {"customer_id": invoice.customer_id, "day": day}, "spent", invoice.total)
+
+
+def rebuild_rollups(db: Session):
+    """Recompute the rollups from invoices in one transaction. A full scan: run it from
+    scripts/rebuild_rollups.py, the admin endpoint or the rollup_rebuild job, never a read."""
+    paid = models.Invoice.status == models.InvoiceStatus.paid
+    db.execute(delete(models.DailySales))
+    db.execute(delete(models.CustomerSales))
+    db.execute(delete(models.CustomerDailySales))
+    day = func.date(models.Invoice.date)
+    daily = db.query(day, func.sum(models.Invoice.total), func.count(models.Invoice.id)).filter(paid).group_by(day).all()
+    if daily:
+        db.execute(
+            insert(models.DailySales),
+            [{"day": d if isinstance(d, date) else date.fromisoformat(d), "revenue": r, "invoice_count": n} for d, r, n in daily],
+        )
+    per_customer = (
+        db.query(models.Invoice.customer_id, func.sum(models.Invoice.total), func.count(models.Invoice.id))
+        .filter(paid)
+        .group_by(models.Invoice.customer_id)
+        .all()
+    )
+    if per_customer:
+        db.execute(
+            insert(models.CustomerSales),
+            [{"customer_id": c, "spent": s, "invoice_count": n} for c, s, n in per_customer],
+        )
+    per_customer_day = (
+        db.query(models.Invoice.customer_id, day, func.sum(models.Invoice.total), func.count(models.Invoice.id))
+        .filter(paid)
+        .group_by(models.Invoice.customer_id, day)
+        .all()
+    )
+    if per_customer_day:
+        db.execute(
+            insert(models.CustomerDailySales),
+            [
+                {"customer_id": c, "day": d if isinstance(d, date) else date.fromisoformat(d), "spent": s, "invoice_count": n}
+                for c, d, s, n in per_customer_day
+            ],
+        )
+    state = db.get(models.RollupState, SALES_ROLLUP) or models.RollupState(name=SALES_ROLLUP)
+    state.rebuilt_at = datetime.utcnow()
+    db.add(state)
+    db.commit()
+
+
+def rollup_status(db: Session, max_age_seconds: int = ANALYTICS_ROLLUP_MAX_AGE_SECONDS) -> Tuple[Optional[datetime], bool]:
+    """(rebuilt_at, stale): stale when the rollups were never rebuilt or the last rebuild is older than the tolerance."""
+    state = db.get(models.RollupState, SALES_ROLLUP)
+    rebuilt_at = state.rebuilt_at if state is not None else None
+    stale = rebuilt_at is None or (max_age_seconds > 0 and datetime.utcnow() - rebuilt_at > timedelta(seconds=max_age_seconds))
+    return rebuilt_at, stale
@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.database import SessionLocal, init_db
+from app.utils.cart_lines import audit_cart_totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check stored cart totals against their line items")
+    parser.add_argument("--fix", action="store_true", help="rewrite drifted totals")
+    parser.add_argument("--all", action="store_true", help="include checked-out carts")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        drifted = audit_cart_totals(db, fix=args.fix, active_only=not args.all)
+        for d in drifted:
+            print(f"cart {d['cart_id']}: stored={d['stored']} actual={d['actual']}")
+        print(f"{len(drifted)} cart(s) drifted" + (" (fixed)" if args.fix and drifted else ""))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
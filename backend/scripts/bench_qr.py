@@ -0,0 +1,37 @@
+import argparse
+import os
+import sys
+import time
+from uuid import uuid4
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.utils.qr import qr_cache_clear, render_qr
+
+
+def _timed(fn, payloads):
+    start = time.perf_counter()
+    for p in payloads:
+        fn(p)
+    return (time.perf_counter() - start) / len(payloads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cold vs warm QR render times")
+    parser.add_argument("-n", type=int, default=500, help="number of distinct invoice codes")
+    args = parser.parse_args()
+
+    codes = [f"INV-{uuid4().hex[:12].upper()}" for _ in range(args.n)]
+    for fmt in ("png", "svg"):
+        qr_cache_clear()
+        cold = _timed(lambda c: render_qr(c, fmt), codes)
+        warm = _timed(lambda c: render_qr(c, fmt), codes)
+        size = len(render_qr(codes[0], fmt))
+        print(f"{fmt}: cold {cold * 1e3:.3f} ms/render, warm {warm * 1e6:.2f} us/lookup, {cold / warm:,.0f}x, {size} bytes")
+    compact = len(render_qr(codes[0], "png", 4, 4))
+    print(f"png box_size=4: {compact} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.utils.reporting import (
+    LineColumns,
+    basket_size_distribution,
+    hourly_heatmap,
+    product_revenue,
+    weight_price_reconciliation,
+)
+
+
+def synthetic_lines(n: int, products: int, seed: int = 7) -> LineColumns:
+    """n invoice lines, ~4 lines per invoice, spread over the last 90 days."""
+    rng = np.random.default_rng(seed)
+    price = rng.uniform(5, 500, products).round(2)
+    weight = rng.uniform(0.05, 5, products).round(3)
+    invoice_id = np.sort(rng.integers(0, max(1, n // 4), n))
+    product_id = rng.integers(0, products, n)
+    quantity = rng.integers(1, 6, n)
+    invoice_ts = 1_700_000_000 + np.sort(rng.integers(0, 90 * 86400, max(1, n // 4)))
+    subtotal = price[product_id] * quantity
+    # a few lines recorded at a stale price
+    drift = rng.random(n) < 0.001
+    subtotal[drift] *= 0.9
+    return LineColumns(
+        invoice_id=invoice_id,
+        product_id=product_id,
+        quantity=quantity,
+        subtotal=subtotal,
+        net_weight=weight[product_id] * quantity,
+        ts=invoice_ts[invoice_id],
+        unit_price=price[product_id],
+        unit_weight=weight[product_id],
+    )
+
+
+def _timed(label, fn):
+    start = time.perf_counter()
+    out = fn()
+    print(f"{label:<28} {time.perf_counter() - start:8.3f} s")
+    return out
+
+
+def _python_product_revenue(cols: LineColumns, limit: int = 20):
+    revenue = defaultdict(float)
+    for pid, sub in zip(cols.product_id.tolist(), cols.subtotal.tolist()):
+        revenue[pid] += sub
+    return sorted(revenue.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the vectorized reports on a synthetic dataset")
+    parser.add_argument("--lines", type=int, default=10_000_000)
+    parser.add_argument("--products", type=int, default=5_000)
+    parser.add_argument("--python-sample", type=int, default=1_000_000, help="lines for the per-row Python baseline (0 to skip)")
+    args = parser.parse_args()
+
+    cols = _timed(f"generate {args.lines:,} lines", lambda: synthetic_lines(args.lines, args.products))
+    nbytes = sum(getattr(cols, name).nbytes for name in LineColumns.__dataclass_fields__)
+    print(f"{'columns in memory':<28} {nbytes / 2**20:8.1f} MiB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lines.npz")
+        _timed("save .npz", lambda: cols.save(path))
+        print(f"{'on disk':<28} {os.path.getsize(path) / 2**20:8.1f} MiB")
+        cols = _timed("load .npz", lambda: LineColumns.load(path))
+
+    _timed("basket sizes", lambda: basket_size_distribution(cols))
+    _timed("product revenue", lambda: product_revenue(cols))
+    _timed("hourly heatmap", lambda: hourly_heatmap(cols))
+    recon = _timed("reconciliation", lambda: weight_price_reconciliation(cols))
+    print(f"{'flagged lines':<28} {recon['flagged_lines']:8,}")
+
+    if args.python_sample:
+        k = min(args.python_sample, len(cols))
+        sample = LineColumns(**{name: getattr(cols, name)[:k] for name in LineColumns.__dataclass_fields__})
+        vec = _timed(f"product revenue, numpy {k:,}", lambda: product_revenue(sample))
+        ref = _timed(f"product revenue, python {k:,}", lambda: _python_product_revenue(sample))
+        assert [r["product_id"] for r in vec] == [pid for pid, _ in ref]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import json
+import os
+import sys
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.config import PRODUCT_IMPORT_BATCH_SIZE
+from app.database import SessionLocal, init_db
+from app.utils.product_import import FORMATS, format_for, import_products, read_rows
+
+
+def main():
+    """Upsert products by code from a CSV or NDJSON file (e.g. the nightly catalog export)."""
+    parser = argparse.ArgumentParser(description="Bulk product import/upsert")
+    parser.add_argument("path", help="CSV with header or NDJSON file; '-' reads stdin")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=PRODUCT_IMPORT_BATCH_SIZE)
+    parser.add_argument("--errors", default=None, help="write rejected rows to this NDJSON file")
+    args = parser.parse_args()
+
+    fmt = args.format or format_for(args.path)
+    if fmt is None:
+        parser.error("cannot tell the format from the file name; pass --format")
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.path == "-":
+            sys.stdin.reconfigure(encoding="utf-8-sig", newline="")
+            report = import_products(db, read_rows(sys.stdin, fmt), batch_size=args.batch_size)
+        else:
+            with open(args.path, encoding="utf-8-sig", newline="") as f:
+                report = import_products(db, read_rows(f, fmt), batch_size=args.batch_size)
+    finally:
+        db.close()
+
+    print(f"{report.rows} row(s) read, {report.upserted} upserted in {report.batches} batch(es), "
+          f"{report.error_count} rejected, {report.seconds:.1f}s")
+    for e in report.errors[:20]:
+        print(f"  row {e['row']} ({e['code']}): {e['error']}")
+    if args.errors and report.errors:
+        with open(args.errors, "w") as f:
+            for e in report.errors:
+                f.write(json.dumps(e) + "\n")
+    if report.error_count:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
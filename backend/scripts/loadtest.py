@@ -0,0 +1,255 @@
+"""Drive checkout lanes against the app in-process (httpx ASGI transport, no network).
+
+Each lane repeatedly plays one shopper: login (or signup + login), N product scans,
+/carts/attach, /carts/{id}/checkout, /invoices/{id}/pay (as the admin) and the PDF
+download. Per-endpoint latency percentiles and throughput are printed and written as
+JSON; --compare fails the run when an endpoint's p95 regressed past --tolerance.
+
+    python scripts/loadtest.py --lanes 8 --iterations 25 --scans 12 --output results.json
+    python scripts/loadtest.py ... --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from uuid import uuid4
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# scripts.seed (and through it the app) is imported in main() once DATABASE_URL is set
+seed = None
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    k = min(len(sorted_values), max(1, math.ceil(q / 100 * len(sorted_values))))
+    return sorted_values[k - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, seconds: float, status: int, ok: bool):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def summary(self, wall_seconds: float) -> dict:
+        out = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            out[endpoint] = {
+                "count": len(values),
+                "errors": self.errors[endpoint],
+                "statuses": {str(k): v for k, v in sorted(self.statuses[endpoint].items())},
+                "throughput_rps": len(values) / wall_seconds if wall_seconds else 0.0,
+                "mean_ms": 1e3 * sum(values) / len(values),
+                "p50_ms": 1e3 * percentile(values, 50),
+                "p95_ms": 1e3 * percentile(values, 95),
+                "p99_ms": 1e3 * percentile(values, 99),
+                "max_ms": 1e3 * values[-1],
+            }
+        return out
+
+
+class LaneError(Exception):
+    pass
+
+
+async def call(client, rec: Recorder, endpoint: str, method: str, url: str, expect=(200,), **kwargs):
+    start = time.perf_counter()
+    r = await client.request(method, url, **kwargs)
+    elapsed = time.perf_counter() - start
+    ok = r.status_code in expect
+    rec.record(endpoint, elapsed, r.status_code, ok)
+    if not ok:
+        raise LaneError(f"{method} {url} -> {r.status_code}: {r.text[:200]}")
+    return r
+
+
+def bearer(response) -> dict:
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+
+async def shopper(client, rec: Recorder, args, rng: random.Random, admin: dict, codes, customer_email: str, password: str):
+    if rng.random() < args.signup_fraction:
+        customer_email = f"signup-{uuid4().hex[:12]}@example.com"
+        await call(client, rec, "POST /auth/customer/signup", "POST", "/auth/customer/signup",
+                   json={"name": "Load Signup", "email": customer_email, "password": password})
+    r = await call(client, rec, "POST /auth/customer/login", "POST", "/auth/customer/login",
+                   json={"email": customer_email, "password": password})
+    auth = bearer(r)
+
+    basket = defaultdict(int)
+    for _ in range(args.scans):
+        code = rng.choice(codes)
+        await call(client, rec, "GET /products/by-code/{code}", "GET", f"/products/by-code/{code}", headers=auth)
+        basket[code] += 1
+
+    r = await call(client, rec, "POST /carts/attach", "POST", "/carts/attach", headers=auth,
+                   json={"items": [{"code": c, "quantity": q} for c, q in basket.items()]})
+    cart_id = r.json()["cart_id"]
+    r = await call(client, rec, "POST /carts/{id}/checkout", "POST", f"/carts/{cart_id}/checkout", headers=auth)
+    invoice_id = r.json()["invoice_id"]
+    await call(client, rec, "POST /invoices/{id}/pay", "POST", f"/invoices/{invoice_id}/pay", headers=admin)
+    await call(client, rec, "GET /invoices/{id}/pdf", "GET", f"/invoices/{invoice_id}/pdf", headers=auth)
+
+
+async def lane(n: int, iterations: int, client, rec: Recorder, args, admin: dict, codes, emails, flow_latencies: list, failures: list):
+    rng = random.Random(args.seed * 1000 + n)
+    for i in range(iterations):
+        # Lanes never share a customer at the same time, so no two lanes fight over one active cart
+        email = emails[(i * args.lanes + n) % len(emails)]
+        start = time.perf_counter()
+        try:
+            await shopper(client, rec, args, rng, admin, codes, email, seed.SYNTHETIC_PASSWORD)
+        except LaneError as e:
+            failures.append(str(e))
+            continue
+        flow_latencies.append(time.perf_counter() - start)
+
+
+async def run(args) -> dict:
+    import httpx
+    from app.main import app
+    from app.database import engine
+
+    async with app.router.lifespan_context(app):
+        seed.run(products=args.products, customers=args.customers, stock=args.stock)
+        codes = [seed.synthetic_product_code(n) for n in range(args.products)]
+        emails = [seed.synthetic_customer_email(n) for n in range(args.customers)]
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120) as client:
+            r = await client.post("/auth/official/login", json={"email": "admin@store.example.com", "password": "admin123"})
+            r.raise_for_status()
+            admin = bearer(r)
+
+            if args.warmup:
+                await asyncio.gather(*(
+                    lane(n, args.warmup, client, Recorder(), args, admin, codes, emails[-args.lanes:], [], [])
+                    for n in range(args.lanes)
+                ))
+
+            rec, flows, failures = Recorder(), [], []
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                lane(n, args.iterations, client, rec, args, admin, codes, emails, flows, failures)
+                for n in range(args.lanes)
+            ))
+            wall = time.perf_counter() - start
+
+    flows.sort()
+    return {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat() + "Z",
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        },
+        "wall_seconds": wall,
+        "flows": {
+            "completed": len(flows),
+            "failed": len(failures),
+            "throughput_per_second": len(flows) / wall if wall else 0.0,
+            "p50_ms": 1e3 * percentile(flows, 50),
+            "p95_ms": 1e3 * percentile(flows, 95),
+            "p99_ms": 1e3 * percentile(flows, 99),
+            "first_failures": failures[:5],
+        },
+        "endpoints": rec.summary(wall),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def print_report(results: dict):
+    f = results["flows"]
+    print(f"\n{f['completed']} flows ({f['failed']} failed) in {results['wall_seconds']:.1f}s: "
+          f"{f['throughput_per_second']:.2f} flows/s, p50 {f['p50_ms']:.0f} ms, p95 {f['p95_ms']:.0f} ms, p99 {f['p99_ms']:.0f} ms")
+    print(f"\n{'endpoint':<32} {'count':>6} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for name, e in results["endpoints"].items():
+        print(f"{name:<32} {e['count']:>6} {e['errors']:>4} {e['throughput_rps']:>8.1f} "
+              f"{e['p50_ms']:>8.1f} {e['p95_ms']:>8.1f} {e['p99_ms']:>8.1f} {e['max_ms']:>8.1f}")
+    for failure in f["first_failures"]:
+        print("  failure:", failure)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print p95 deltas against a previous results file; False if any endpoint regressed past tolerance."""
+    ok = True
+    print(f"\n{'endpoint':<32} {'base p95':>9} {'p95':>9} {'delta':>8}")
+    for name, e in results["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base or not base["p95_ms"]:
+            continue
+        delta = e["p95_ms"] / base["p95_ms"] - 1
+        flag = ""
+        if delta > tolerance:
+            ok, flag = False, "  REGRESSED"
+        print(f"{name:<32} {base['p95_ms']:>9.1f} {e['p95_ms']:>9.1f} {delta:>+8.0%}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load test of the checkout flow")
+    parser.add_argument("--lanes", type=int, default=8, help="concurrent shoppers")
+    parser.add_argument("--iterations", type=int, default=20, help="checkouts per lane")
+    parser.add_argument("--scans", type=int, default=10, help="product scans per checkout")
+    parser.add_argument("--warmup", type=int, default=1, help="unrecorded checkouts per warm-up lane")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=1_000_000)
+    parser.add_argument("--signup-fraction", type=float, default=0.05, help="share of shoppers that sign up first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default=None, help="default: a fresh SQLite file in a temp dir")
+    parser.add_argument("--output", default="loadtest_results.json")
+    parser.add_argument("--compare", default=None, help="baseline results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth vs baseline")
+    args = parser.parse_args()
+    if args.customers < 2 * args.lanes:
+        parser.error("--customers must be at least twice --lanes")
+
+    # Configuration is read at import time, so the app is imported only after the env is set
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='loadtest-')}/loadtest.db"
+    os.environ.setdefault("EMAIL_ENABLED", "false")
+    global seed
+    from scripts import seed
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Bring the database schema up to the models: create missing tables, columns and indexes.
+
+Run once per deploy before starting the workers with DB_AUTO_MIGRATE=false, so that no
+worker runs create_all on boot:
+
+    DATABASE_URL=postgresql+psycopg2://... python scripts/migrate.py [--check]
+"""
+import argparse
+import os
+import sys
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.database import init_db, pending_migrations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema changes")
+    parser.add_argument("--check", action="store_true", help="only list pending changes; exit 1 if there are any")
+    args = parser.parse_args()
+
+    pending = pending_migrations()
+    for name in pending:
+        print(f"pending: {name}")
+    if args.check:
+        sys.exit(1 if pending else 0)
+    if pending:
+        init_db()
+        print(f"Applied {len(pending)} change(s)")
+    else:
+        print("Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
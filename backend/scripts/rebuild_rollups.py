@@ -0,0 +1,30 @@
+import os
+import sys
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.database import SessionLocal, init_db
+from app import models
+from app.utils.rollups import SALES_ROLLUP, rebuild_rollups
+
+
+def main():
+    """Backfill or rebuild the analytics rollups from the invoices table."""
+    init_db()
+    db = SessionLocal()
+    try:
+        rebuild_rollups(db)
+        days = db.query(models.DailySales).count()
+        customers = db.query(models.CustomerSales).count()
+        customer_days = db.query(models.CustomerDailySales).count()
+        print(
+            f"Rollups rebuilt at {db.get(models.RollupState, SALES_ROLLUP).rebuilt_at}: "
+            f"{days} day(s), {customers} customer(s), {customer_days} customer-day(s)"
+        )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
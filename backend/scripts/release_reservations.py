@@ -0,0 +1,27 @@
+import os
+import sys
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.database import SessionLocal, init_db
+from app.utils.catalog import bump_catalog_version
+from app.utils.inventory import release_reservations
+
+
+def main():
+    """Return the stock of expired, unpaid checkouts to the shelf (run from cron)."""
+    init_db()
+    db = SessionLocal()
+    try:
+        returned = release_reservations(db, expired=True)
+        if returned:
+            bump_catalog_version(db)
+        db.commit()
+        print(f"Released {sum(returned.values())} unit(s) across {len(returned)} product(s)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Minimal in-memory server speaking the Redis protocol (RESP2), for tests and local scale-out trials.
+
+Covers what CACHE_BACKEND=redis / EVENT_BROKER=redis use: GET/SET (EX/PX/NX), MGET, DEL,
+EXISTS, INCR/INCRBY, EXPIRE, TTL, PUBLISH/SUBSCRIBE and PING, plus the CLIENT/SELECT
+handshake redis-py sends. One database, no persistence.
+
+    python scripts/resp_server.py --port 6399
+    CACHE_BACKEND=redis EVENT_BROKER=redis REDIS_URL=redis://127.0.0.1:6399/0 uvicorn app.main:app --workers 4
+
+Tests can run it in-process: `port = start_in_thread()`.
+"""
+import argparse
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class RespError(Exception):
+    pass
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RespError):
+        return b"-" + str(value).encode() + b"\r\n"
+    if isinstance(value, bool):
+        return b"+OK\r\n" if value else b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(v) for v in value)
+    raise TypeError(f"cannot encode {type(value).__name__}")
+
+
+async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.split()  # inline command (telnet / nc)
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        if not header.startswith(b"$"):
+            raise RespError("ERR Protocol error: expected bulk string")
+        size = int(header[1:])
+        data = await reader.readexactly(size + 2)
+        args.append(data[:-2])
+    return args
+
+
+class RespServer:
+    def __init__(self):
+        self._data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self._channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+
+    # -- keyspace --
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def _set(self, args: List[bytes]):
+        key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+        expires = None
+        if b"NX" in options and self._get(key) is not None:
+            return None
+        for unit, scale in ((b"EX", 1.0), (b"PX", 0.001)):
+            if unit in options:
+                expires = time.monotonic() + int(args[2 + options.index(unit) + 1]) * scale
+        self._data[key] = (value, expires)
+        return True
+
+    def _incr(self, key: bytes, amount: int = 1) -> int:
+        current = self._get(key)
+        try:
+            value = int(current or 0) + amount
+        except ValueError:
+            raise RespError("ERR value is not an integer or out of range")
+        self._data[key] = (str(value).encode(), self._data[key][1] if key in self._data else None)
+        return value
+
+    def _expire(self, key: bytes, seconds: int) -> int:
+        if self._get(key) is None:
+            return 0
+        self._data[key] = (self._data[key][0], time.monotonic() + seconds)
+        return 1
+
+    def _ttl(self, key: bytes) -> int:
+        if self._get(key) is None:
+            return -2
+        expires = self._data[key][1]
+        return -1 if expires is None else max(0, round(expires - time.monotonic()))
+
+    # -- pub/sub --
+    def _publish(self, channel: bytes, message: bytes) -> int:
+        subscribers = list(self._channels.get(channel, ()))
+        for writer in subscribers:
+            writer.write(_encode([b"message", channel, message]))
+        return len(subscribers)
+
+    def _unsubscribe(self, writer: asyncio.StreamWriter, channels: Set[bytes], names: List[bytes]):
+        for name in names or sorted(channels):
+            channels.discard(name)
+            subs = self._channels.get(name)
+            if subs is not None:
+                subs.discard(writer)
+                if not subs:
+                    del self._channels[name]
+            writer.write(_encode([b"unsubscribe", name, len(channels)]))
+
+    def execute(self, args: List[bytes]):
+        name, args = args[0].upper(), args[1:]
+        if name == b"PING":
+            return args[0] if args else "PONG"
+        if name == b"ECHO":
+            return args[0]
+        if name in (b"CLIENT", b"SELECT"):
+            return True
+        if name == b"GET":
+            return self._get(args[0])
+        if name == b"SET":
+            return self._set(args)
+        if name == b"MGET":
+            return [self._get(k) for k in args]
+        if name == b"DEL":
+            return sum(1 for k in args if self._get(k) is not None and self._data.pop(k, None) is not None)
+        if name == b"EXISTS":
+            return sum(1 for k in args if self._get(k) is not None)
+        if name == b"INCR":
+            return self._incr(args[0])
+        if name == b"INCRBY":
+            return self._incr(args[0], int(args[1]))
+        if name == b"EXPIRE":
+            return self._expire(args[0], int(args[1]))
+        if name == b"TTL":
+            return self._ttl(args[0])
+        if name == b"DBSIZE":
+            return sum(1 for k in list(self._data) if self._get(k) is not None)
+        if name == b"FLUSHDB":
+            self._data.clear()
+            return True
+        if name == b"PUBLISH":
+            return self._publish(args[0], args[1])
+        raise RespError(f"ERR unknown command '{name.decode(errors='replace')}'")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channels: Set[bytes] = set()
+        try:
+            while True:
+                try:
+                    args = await _read_command(reader)
+                except RespError as e:
+                    writer.write(_encode(e))
+                    break
+                if args is None:
+                    break
+                if not args:
+                    continue
+                name = args[0].upper()
+                if name == b"QUIT":
+                    writer.write(_encode(True))
+                    break
+                if name == b"SUBSCRIBE":
+                    for channel in args[1:]:
+                        channels.add(channel)
+                        self._channels.setdefault(channel, set()).add(writer)
+                        writer.write(_encode([b"subscribe", channel, len(channels)]))
+                elif name == b"UNSUBSCRIBE":
+                    self._unsubscribe(writer, channels, args[1:])
+                elif channels and name == b"PING":
+                    writer.write(_encode([b"pong", args[1] if len(args) > 1 else b""]))
+                else:
+                    try:
+                        writer.write(_encode(self.execute(args)))
+                    except RespError as e:
+                        writer.write(_encode(e))
+                    except (IndexError, ValueError):
+                        writer.write(_encode(RespError(f"ERR wrong arguments for '{name.decode(errors='replace')}'")))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._unsubscribe(writer, channels, [])
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 6399, ready: Optional[threading.Event] = None, bound: Optional[list] = None):
+        server = await asyncio.start_server(self.handle, host, port)
+        if bound is not None:
+            bound.append(server.sockets[0].getsockname()[1])
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+
+def start_in_thread(host: str = "127.0.0.1", port: int = 0) -> int:
+    """Serve from a daemon thread; returns the bound port (port=0 picks a free one)."""
+    ready, bound = threading.Event(), []
+    thread = threading.Thread(target=lambda: asyncio.run(RespServer().serve(host, port, ready, bound)), daemon=True)
+    thread.start()
+    if not ready.wait(5):
+        raise RuntimeError("RESP server did not start")
+    return bound[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory Redis-protocol server for tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+    print(f"Serving RESP on {args.host}:{args.port}")
+    try:
+        asyncio.run(RespServer().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
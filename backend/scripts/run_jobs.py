@@ -0,0 +1,19 @@
+import os
+import sys
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app.database import init_db
+from app.jobs import run_pending_jobs
+
+
+def main():
+    """Drain due outbox jobs once (useful with JOB_WORKERS=0 or from cron)."""
+    init_db()
+    ran = run_pending_jobs()
+    print(f"Ran {ran} job(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,59 @@
+import argparse
 import os
+import random
 import sys
 
 # Allow running as a script
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
+from sqlalchemy import insert
+
 from app.database import SessionLocal, init_db
 from app import models
 from app.security import get_password_hash
 
+SYNTHETIC_PASSWORD = "password"
+
+
+def synthetic_product_code(n: int) -> str:
+    return f"SKU{n:06d}"
+
+
+def synthetic_customer_email(n: int) -> str:
+    return f"load{n:06d}@example.com"
+
+
+def seed_synthetic(db, products: int = 0, customers: int = 0, stock: int = 1_000_000, batch: int = 5000, seed: int = 42):
+    """Top up the synthetic catalog (SKU000000..) and customer base (load000000@example.com..) to the
+    requested sizes. All synthetic customers share SYNTHETIC_PASSWORD, hashed once."""
+    rng = random.Random(seed)
+    have = db.query(models.Product).filter(models.Product.code.like("SKU%")).count()
+    rows = [
+        {
+            "name": f"Synthetic item {n}",
+            "description": "Load-test product",
+            "code": synthetic_product_code(n),
+            "price_per_unit": round(rng.uniform(5, 500), 2),
+            "weight_per_unit": round(rng.uniform(0.05, 5), 3),
+            "available_qty": stock,
+        }
+        for n in range(have, products)
+    ]
+    for i in range(0, len(rows), batch):
+        db.execute(insert(models.Product), rows[i : i + batch])
+
+    have = db.query(models.Customer).filter(models.Customer.email.like("load%@example.com")).count()
+    hashed = get_password_hash(SYNTHETIC_PASSWORD)
+    rows = [
+        {"name": f"Load Customer {n}", "email": synthetic_customer_email(n), "phone": None, "hashed_password": hashed}
+        for n in range(have, customers)
+    ]
+    for i in range(0, len(rows), batch):
+        db.execute(insert(models.Customer), rows[i : i + batch])
+    db.commit()
+
 
-def run():
+def run(products: int = 0, customers: int = 0, stock: int = 1_000_000):
     init_db()
     db = SessionLocal()
     try:
@@ -39,7 +83,7 @@ def run():
 
         # Seed products with INR prices if none
         if db.query(models.Product).count() == 0:
-            products = [
+            demo_products = [
                 models.Product(name="Basmati Rice 1kg", description="Premium basmati rice", code="P1001", price_per_unit=120.00, weight_per_unit=1.0, available_qty=200),
                 models.Product(name="Toor Dal 1kg", description="Split pigeon peas", code="P1002", price_per_unit=150.00, weight_per_unit=1.0, available_qty=150),
                 models.Product(name="Sugar 1kg", description="Refined sugar", code="P1003", price_per_unit=45.00, weight_per_unit=1.0, available_qty=300),
@@ -47,7 +91,7 @@ def run():
                 models.Product(name="Milk 1L", description="Toned milk", code="P1005", price_per_unit=60.00, weight_per_unit=1.0, available_qty=180),
                 models.Product(name="Bread 400g", description="Whole wheat bread", code="P1006", price_per_unit=40.00, weight_per_unit=0.4, available_qty=100),
             ]
-            db.add_all(products)
+            db.add_all(demo_products)
 
         # Create two sample customers
         custs = [
@@ -60,11 +104,18 @@ def run():
                 db.add(models.Customer(name=name, email=email, phone=phone, hashed_password=get_password_hash("password")))
 
         db.commit()
+        if products or customers:
+            seed_synthetic(db, products=products, customers=customers, stock=stock)
         print("Seed completed. Admin login: admin@store.example.com / admin123; Cashier: cashier@store.example.com / cashier123")
     finally:
         db.close()
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Seed demo data, optionally plus a synthetic catalog and customer base")
+    parser.add_argument("--products", type=int, default=0, help="synthetic products (SKU000000..)")
+    parser.add_argument("--customers", type=int, default=0, help=f"synthetic customers (load000000@example.com.., password {SYNTHETIC_PASSWORD!r})")
+    parser.add_argument("--stock", type=int, default=1_000_000, help="available_qty for synthetic products")
+    args = parser.parse_args()
+    run(products=args.products, customers=args.customers, stock=args.stock)
 
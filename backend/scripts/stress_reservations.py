@@ -0,0 +1,146 @@
+"""Hammer checkout on a few scarce products and check that stock is never oversold.
+
+Every shopper attaches a random basket of the contested products, checks out concurrently
+with the others, then pays, releases, or leaves its reservation held. Afterwards, for each
+product: available_qty must be >= 0, the units that left the shelf must equal the units of
+successful checkouts that were not released, and the held reservations must add up to
+the checkouts left unpaid. Exits 1 on any violation.
+
+    python scripts/stress_reservations.py --shoppers 200 --products 3 --stock 40
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from collections import defaultdict
+
+# Allow running as a script
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+
+async def shopper(client, gate: asyncio.Semaphore, args, rng: random.Random, auth: dict, admin: dict, codes, outcome: dict):
+    async with gate:
+        await _shop(client, args, rng, auth, admin, codes, outcome)
+
+
+async def _shop(client, args, rng: random.Random, auth: dict, admin: dict, codes, outcome: dict):
+    basket = {code: rng.randint(1, args.max_quantity) for code in rng.sample(codes, rng.randint(1, len(codes)))}
+    r = await client.post("/carts/attach", headers=auth, json={"items": [{"code": c, "quantity": q} for c, q in basket.items()]})
+    r.raise_for_status()
+    cart_id = r.json()["cart_id"]
+    r = await client.post(f"/carts/{cart_id}/checkout", headers=auth)
+    if r.status_code == 400 and r.json()["detail"].startswith("Insufficient stock"):
+        outcome["rejected"] += 1
+        return
+    r.raise_for_status()
+    invoice_id = r.json()["invoice_id"]
+    action = rng.choice(("pay", "release", "hold"))
+    if action == "pay":
+        (await client.post(f"/invoices/{invoice_id}/pay", headers=admin)).raise_for_status()
+    elif action == "release":
+        (await client.post(f"/invoices/{invoice_id}/release", headers=auth)).raise_for_status()
+    outcome[action] += 1
+    for code, qty in basket.items():
+        if action != "release":
+            outcome["sold" if action == "pay" else "held", code] += qty
+
+
+async def run(args) -> bool:
+    from app.database import async_engine
+
+    try:
+        return await _run(args)
+    finally:
+        # The lifespan skips shutdown hooks when the run fails; an undisposed aiosqlite pool
+        # (DB_ASYNC=true) keeps non-daemon threads alive and the script would never exit
+        if async_engine is not None:
+            await async_engine.dispose()
+
+
+async def _run(args) -> bool:
+    import httpx
+    from app import models
+    from app.database import SessionLocal
+    from app.main import app
+    from app.security import create_access_token
+    from app.utils.inventory import held_stock
+    from scripts import seed
+
+    async with app.router.lifespan_context(app):
+        seed.run(customers=args.shoppers)
+        codes = [f"STRESS{n:03d}" for n in range(args.products)]
+        db = SessionLocal()
+        try:
+            for code in codes:
+                product = db.query(models.Product).filter(models.Product.code == code).first()
+                if product is None:
+                    db.add(models.Product(name=f"Scarce item {code}", code=code, price_per_unit=10.0, weight_per_unit=0.5, available_qty=args.stock))
+                else:
+                    product.available_qty = args.stock
+            db.commit()
+            customers = db.query(models.Customer).filter(models.Customer.email.like("load%@example.com")).order_by(models.Customer.id).limit(args.shoppers).all()
+            tokens = [{"Authorization": "Bearer " + create_access_token(c.email, "customer", uid=c.id)} for c in customers]
+            official = db.query(models.StoreOfficial).filter(models.StoreOfficial.role == "admin").first()
+            admin = {"Authorization": "Bearer " + create_access_token(official.email, official.role, uid=official.id)}
+        finally:
+            db.close()
+
+        outcome = defaultdict(int)
+        rng = random.Random(args.seed)
+        gate = asyncio.Semaphore(args.concurrency)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://stress", timeout=120) as client:
+            await asyncio.gather(*(
+                shopper(client, gate, args, random.Random(rng.random()), tokens[n], admin, codes, outcome)
+                for n in range(len(tokens))
+            ))
+
+        db = SessionLocal()
+        try:
+            ids = dict(db.query(models.Product.code, models.Product.id).filter(models.Product.code.in_(codes)).all())
+            available = dict(db.query(models.Product.code, models.Product.available_qty).filter(models.Product.code.in_(codes)).all())
+            held = held_stock(db)
+        finally:
+            db.close()
+
+    print(f"{len(tokens)} shoppers: {outcome['pay']} paid, {outcome['release']} released, {outcome['hold']} held, {outcome['rejected']} rejected for stock")
+    ok = True
+    for code in codes:
+        sold, kept = outcome["sold", code], outcome["held", code]
+        held_units = held.get(ids[code], 0)
+        problems = []
+        if available[code] < 0:
+            problems.append("negative stock")
+        if args.stock - available[code] != sold + kept:
+            problems.append(f"shelf lost {args.stock - available[code]} units, checkouts account for {sold + kept}")
+        if held_units != kept:
+            problems.append(f"{held_units} units held, {kept} expected")
+        ok = ok and not problems
+        print(f"  {code}: stock {args.stock} -> {available[code]}, sold {sold}, held {held_units}  {'; '.join(problems) or 'ok'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent checkout oversell check")
+    parser.add_argument("--shoppers", type=int, default=200)
+    parser.add_argument("--products", type=int, default=3, help="contested products")
+    parser.add_argument("--stock", type=int, default=40, help="starting stock of each contested product")
+    parser.add_argument("--concurrency", type=int, default=16, help="shoppers in flight at once")
+    parser.add_argument("--max-quantity", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default=None, help="default: a fresh SQLite file in a temp dir")
+    args = parser.parse_args()
+
+    # Configuration is read at import time, so the app is imported only after the env is set
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='stress-')}/stress.db"
+    os.environ.setdefault("EMAIL_ENABLED", "false")
+    os.environ.setdefault("JOB_WORKERS", "0")
+    if not asyncio.run(run(args)):
+        print("OVERSOLD or inconsistent stock")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
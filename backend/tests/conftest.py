@@ -0,0 +1,88 @@
+import itertools
+import os
+import sys
+import tempfile
+
+# Point the app at a throwaway database before anything imports app.config
+_tmp = tempfile.mkdtemp(prefix="billing-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("EMAIL_BACKEND", "sink")
+os.environ.setdefault("EMAIL_ENABLED", "true")
+os.environ.setdefault("EMAIL_SINK_DIR", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import models
+from app.database import SessionLocal
+from app.main import app
+from scripts import seed
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as c:
+        seed.run(products=20)
+        yield c
+
+
+def _login(client, path, email, password):
+    r = client.post(path, json={"email": email, "password": password})
+    assert r.status_code == 200, r.text
+    return {"Authorization": "Bearer " + r.json()["access_token"]}
+
+
+@pytest.fixture(scope="session")
+def admin(client):
+    return _login(client, "/auth/official/login", "admin@store.example.com", "admin123")
+
+
+@pytest.fixture
+def customer(client):
+    """A fresh customer per test, so carts and invoice history start empty."""
+    n = next(_ids)
+    email = f"test{n}@example.com"
+    r = client.post("/auth/customer/signup", json={"name": f"Test {n}", "email": email, "password": "password"})
+    assert r.status_code == 200, r.text
+    return _login(client, "/auth/customer/login", email, "password")
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture(scope="session")
+def products(client):
+    session = SessionLocal()
+    try:
+        # Synthetic products carry a large stock, so tests can buy freely
+        rows = session.query(models.Product).filter(models.Product.code.like("SKU%")).order_by(models.Product.id).limit(10).all()
+        return [{"id": p.id, "code": p.code} for p in rows]
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def checkout(client, products):
+    """checkout(headers, lines) attaches a cart with `lines` products and checks it out."""
+
+    def _checkout(headers, lines=1, quantity=1):
+        items = [{"code": p["code"], "quantity": quantity} for p in products[:lines]]
+        r = client.post("/carts/attach", headers=headers, json={"items": items})
+        assert r.status_code == 200, r.text
+        r = client.post(f"/carts/{r.json()['cart_id']}/checkout", headers=headers)
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    return _checkout
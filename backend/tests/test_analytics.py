@@ -0,0 +1,40 @@
+from datetime import date, timedelta
+
+from app.jobs import run_pending_jobs
+from app.utils.querycount import count_queries
+
+
+def _summary(client, admin, **params):
+    r = client.get("/analytics/summary", headers=admin, params=params)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_summary_never_rebuilds_on_read(client, admin, customer, checkout):
+    invoice = checkout(customer, 3)
+    assert client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin).status_code == 200
+    _summary(client, admin)  # queues the first rebuild, if none ran yet
+    run_pending_jobs()
+    before = _summary(client, admin)
+    assert before["as_of"] is not None and not before["rebuild_pending"]
+
+    with count_queries() as counted:
+        after = _summary(client, admin)
+    assert not any(s.lstrip().upper().startswith(("DELETE", "INSERT")) for s in counted.statements)
+    assert after["as_of"] == before["as_of"]
+
+
+def test_top_customers_in_range_read_daily_rollup(client, admin, customer, checkout):
+    name = client.get("/auth/me", headers=customer).json()["name"]
+    for _ in range(2):
+        invoice = checkout(customer, 2, quantity=40)
+        assert client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin).status_code == 200
+    today = date.today()
+    # Invoice dates are UTC; a window around today covers the payment whatever the local date is
+    window = {"start": (today - timedelta(days=1)).isoformat(), "end": (today + timedelta(days=1)).isoformat()}
+    with count_queries() as counted:
+        top = _summary(client, admin, **window)["top_customers"]
+    assert name in [c["name"] for c in top]
+    assert not any("FROM invoices" in s for s in counted.statements)
+
+    assert _summary(client, admin, start="2000-01-01", end="2000-01-31")["top_customers"] == []
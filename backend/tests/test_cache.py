@@ -0,0 +1,71 @@
+"""Cross-worker invalidation over the Redis-protocol backend, against scripts/resp_server.py."""
+import time
+
+import pytest
+
+from app.cache import RedisCache
+from app.utils.catalog import ProductCatalogCache, bump_catalog_version
+from scripts import resp_server
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture(scope="module")
+def resp_url():
+    return f"redis://127.0.0.1:{resp_server.start_in_thread()}/0"
+
+
+@pytest.fixture
+def workers(resp_url, request):
+    """Two shared-cache clients on one server and prefix, as two app workers would have."""
+    prefix = f"test:{request.node.name}:"
+    pair = [RedisCache(url=resp_url, prefix=prefix) for _ in range(2)]
+    seen = []
+    pair[1].subscribe("ping", seen.append)
+    for cache in pair:
+        cache.start()
+    # The listener subscribes from its own thread; wait until it hears the other worker
+    assert _wait_for(lambda: pair[0].publish("ping", {}) or bool(seen))
+    yield pair
+    for cache in pair:
+        cache.stop()
+
+
+def test_values_are_shared_between_workers(workers):
+    first, second = workers
+    first.set("qr:abc", b"png", ttl=60)
+    assert second.get("qr:abc") == b"png"
+    second.delete("qr:abc")
+    assert first.get("qr:abc") is None
+    assert first.errors == second.errors == 0
+
+
+def test_catalog_change_on_one_worker_drops_the_entry_on_the_other(workers, db, products):
+    first, second = workers
+    caches = [ProductCatalogCache(max_items=100, check_interval=3600, enabled=True, bus=bus) for bus in workers]
+    product_id, other_id = products[0]["id"], products[1]["id"]
+    for cache in caches:
+        cache.get_by_id(db, product_id)
+        cache.get_by_id(db, other_id)
+    assert [c.stats()["size"] for c in caches] == [2, 2]
+
+    version = bump_catalog_version(db)
+    db.commit()
+    caches[0].evict([product_id], version)
+    assert _wait_for(lambda: caches[1].stats()["version"] == version)
+    assert caches[1].stats()["size"] == 1
+    # Only the changed product is dropped, and adopting the version costs no reload
+    misses = caches[1].misses
+    caches[1].get_by_id(db, other_id)
+    assert caches[1].misses == misses
+    caches[1].get_by_id(db, product_id)
+    assert caches[1].misses == misses + 1
+    # A worker ignores its own broadcasts
+    assert first.received == 0 and second.received >= 1
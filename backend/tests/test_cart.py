@@ -0,0 +1,25 @@
+def test_scan_batch_add_then_remove_new_line(client, customer, products):
+    code = products[0]["code"]
+    r = client.post("/cart/scan-batch", headers=customer, json={"ops": [{"code": code}, {"op": "set", "code": code, "quantity": 0}]})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["applied"] == 2
+    assert body["changed"] == []
+    assert (body["total"], body["item_count"]) == (0, 0)
+    assert client.get("/cart/", headers=customer).json()["items"] == []
+
+
+def test_scan_batch_removes_existing_line_and_keeps_others(client, customer, products):
+    first, second = products[0], products[1]
+    client.post("/cart/scan", headers=customer, json={"product_id": first["id"]})
+    r = client.post("/cart/scan-batch", headers=customer, json={"ops": [
+        {"op": "set", "product_id": first["id"], "quantity": 0},
+        {"code": second["code"], "quantity": 2},
+        {"code": second["code"]},
+    ]})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["removed"] == [first["id"]]
+    assert [(line["product_id"], line["quantity"]) for line in body["changed"]] == [(second["id"], 3)]
+    items = client.get("/cart/", headers=customer).json()["items"]
+    assert [(line["product_id"], line["quantity"]) for line in items] == [(second["id"], 3)]
@@ -0,0 +1,41 @@
+def _stream_token(client, headers):
+    r = client.post("/events/token", headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["access_token"]
+
+
+def test_query_string_takes_only_stream_tokens(client, customer):
+    login_token = customer["Authorization"].split(" ", 1)[1]
+    # Authentication passes before the lookup, so a missing invoice means the token was accepted
+    r = client.get("/events/invoices/999999", params={"access_token": login_token})
+    assert r.status_code == 401
+    r = client.get("/events/invoices/999999", params={"access_token": _stream_token(client, customer)})
+    assert r.status_code == 404
+    r = client.get("/events/invoices/999999", headers=customer)
+    assert r.status_code == 404
+
+
+def test_stream_token_is_refused_elsewhere(client, customer):
+    token = _stream_token(client, customer)
+    stream_auth = {"Authorization": f"Bearer {token}"}
+    assert client.get("/cart/", headers=stream_auth).status_code == 401
+    # A leaked stream URL cannot be used to mint further tokens
+    assert client.post("/events/token", headers=stream_auth).status_code == 401
+    assert client.post("/events/token", params={"access_token": token}).status_code == 401
+
+
+def test_stream_token_for_another_customers_invoice(client, customer, checkout):
+    invoice = checkout(customer, 1)
+    other = client.post("/auth/customer/signup", json={"name": "Other", "email": "other-stream@example.com", "password": "password"})
+    assert other.status_code == 200
+    r = client.post("/auth/customer/login", json={"email": "other-stream@example.com", "password": "password"})
+    other_auth = {"Authorization": "Bearer " + r.json()["access_token"]}
+    r = client.get(f"/events/invoices/{invoice['invoice_id']}", params={"access_token": _stream_token(client, other_auth)})
+    assert r.status_code == 403
+
+
+def test_auth_me_does_not_cache_a_stream_token(client, customer):
+    stream_auth = {"Authorization": f"Bearer {_stream_token(client, customer)}"}
+    assert client.get("/auth/me", headers=stream_auth).status_code == 401
+    assert client.get("/cart/", headers=stream_auth).status_code == 401
+    assert client.post("/events/token", headers=stream_auth).status_code == 401
@@ -0,0 +1,49 @@
+import pytest
+
+from app import models
+from app.routers import carts, invoices
+
+
+def _crash(*args, **kwargs):
+    raise RuntimeError("worker died after commit")
+
+
+def test_checkout_crashing_after_commit_replays_on_retry(client, customer, products, db, monkeypatch):
+    r = client.post("/carts/attach", headers=customer, json={"items": [{"code": products[0]["code"], "quantity": 1}]})
+    cart_id = r.json()["cart_id"]
+    headers = {**customer, "Idempotency-Key": f"checkout-{cart_id}"}
+    monkeypatch.setattr(carts, "publish_cart_status", _crash)
+    with pytest.raises(RuntimeError):
+        client.post(f"/carts/{cart_id}/checkout", headers=headers)
+    monkeypatch.undo()
+
+    r = client.post(f"/carts/{cart_id}/checkout", headers=headers)
+    assert r.status_code == 200, r.text
+    assert r.headers["Idempotent-Replayed"] == "true"
+    assert r.json()["qr_code"]
+    assert db.query(models.Invoice).filter(models.Invoice.cart_id == cart_id).count() == 1
+
+
+def test_pay_crashing_after_commit_replays_on_retry(client, admin, customer, checkout, monkeypatch):
+    invoice_id = checkout(customer)["invoice_id"]
+    headers = {**admin, "Idempotency-Key": f"pay-{invoice_id}"}
+    monkeypatch.setattr(invoices, "publish_invoice_status", _crash)
+    with pytest.raises(RuntimeError):
+        client.post(f"/invoices/{invoice_id}/pay", headers=headers)
+    monkeypatch.undo()
+
+    r = client.post(f"/invoices/{invoice_id}/pay", headers=headers)
+    assert r.status_code == 200, r.text
+    assert r.headers["Idempotent-Replayed"] == "true"
+    assert r.json()["status"] == "paid"
+
+
+def test_finalize_from_items_runs_once_per_key(client, customer, products, db):
+    headers = {**customer, "Idempotency-Key": "finalize-once"}
+    body = {"items": [{"code": products[0]["code"], "quantity": 2}]}
+    first = client.post("/cart/finalize-from-items", headers=headers, json=body)
+    again = client.post("/cart/finalize-from-items", headers=headers, json=body)
+    assert first.status_code == again.status_code == 200
+    assert again.json() == first.json()
+    customer_id = first.json()["customer_id"]
+    assert db.query(models.Invoice).filter(models.Invoice.customer_id == customer_id).count() == 1
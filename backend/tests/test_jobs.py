@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+from app import models
+from app.jobs import claim_next, enqueue, purge_old_rows, run_pending_jobs
+from app.utils.mailer import mail_sink
+
+
+def test_paid_invoice_email_goes_to_sink(client, admin, customer, checkout):
+    email = client.get("/auth/me", headers=customer).json()["email"]
+    invoice = checkout(customer, 2)
+    r = client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin)
+    assert r.status_code == 200, r.text
+    # A retried pay must not queue a second email
+    client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin)
+
+    mail_sink.clear()
+    run_pending_jobs()
+    sent = [m for m in mail_sink.messages() if m["To"] == email]
+    assert len(sent) == 1
+    assert invoice["qr_code"] in sent[0]["Subject"]
+    (attachment,) = list(sent[0].iter_attachments())
+    assert attachment.get_content_type() == "application/pdf"
+    assert attachment.get_content().startswith(b"%PDF")
+
+
+def test_enqueue_is_a_noop_for_a_known_key(db):
+    assert enqueue(db, "noop", "test:dedupe", {"n": 1})
+    assert not enqueue(db, "noop", "test:dedupe", {"n": 2})
+    db.commit()
+    rows = db.query(models.OutboxJob).filter(models.OutboxJob.dedupe_key == "test:dedupe").all()
+    assert [r.payload for r in rows] == ['{"n": 1}']
+
+
+def test_stale_running_job_is_reclaimed_once(db):
+    stale = datetime.utcnow() - timedelta(days=1)
+    job = models.OutboxJob(kind="noop", dedupe_key="test:stale", status=models.JobStatus.running, started_at=stale)
+    db.add(job)
+    db.commit()
+    claimed = []
+    while (job_id := claim_next(db)) is not None:
+        claimed.append(job_id)
+    assert claimed.count(job.id) == 1
+    db.refresh(job)
+    assert job.started_at > stale
+
+
+def test_old_jobs_and_cart_ops_are_purged(client, customer, products, db):
+    r = client.post("/cart/scan-batch", headers=customer, json={"ops": [{"code": products[0]["code"], "op_id": "old"}, {"code": products[1]["code"], "op_id": "new"}]})
+    assert r.status_code == 200, r.text
+    old = datetime.utcnow() - timedelta(days=30)
+    db.query(models.CartOp).filter(models.CartOp.op_id == "old").update({"created_at": old})
+    db.add_all([
+        models.OutboxJob(kind="noop", dedupe_key="test:purge-old", status=models.JobStatus.done, finished_at=old),
+        models.OutboxJob(kind="noop", dedupe_key="test:purge-new", status=models.JobStatus.done, finished_at=datetime.utcnow()),
+    ])
+    db.commit()
+
+    assert purge_old_rows(db) >= 2
+    assert {k for (k,) in db.query(models.OutboxJob.dedupe_key).filter(models.OutboxJob.dedupe_key.like("test:purge-%"))} == {"test:purge-new"}
+    assert {o for (o,) in db.query(models.CartOp.op_id).filter(models.CartOp.op_id.in_(["old", "new"]))} == {"new"}
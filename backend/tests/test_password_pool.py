@@ -0,0 +1,26 @@
+import time
+
+import pytest
+
+from app.utils.password_pool import PasswordHasherPool, PasswordPoolBusy
+
+
+def test_timed_out_call_keeps_its_slot_until_it_finishes():
+    pool = PasswordHasherPool(workers=1, max_pending=1, timeout=0.1)
+    pool.start()
+    try:
+        with pytest.raises(PasswordPoolBusy):
+            pool._run(time.sleep, 1.0)
+        # The worker is still busy with the abandoned call, so the pool is still full
+        assert pool.stats()["pending"] == 1
+        with pytest.raises(PasswordPoolBusy):
+            pool._run(time.sleep, 0)
+        assert pool.stats()["rejected"] == 1
+
+        deadline = time.monotonic() + 5
+        while pool.stats()["pending"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert pool.stats()["pending"] == 0
+        assert pool._run(abs, -3) == 3
+    finally:
+        pool.stop()
@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import models
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _stock(db, product_id):
+    db.expire_all()
+    return db.get(models.Product, product_id).available_qty
+
+
+def _outbox_jobs(db, code):
+    return db.query(models.OutboxJob).filter(models.OutboxJob.dedupe_key.like(f"%{code}")).count()
+
+
+def test_concurrent_pays_of_a_released_invoice_take_stock_once(client, admin, customer, checkout, products, db):
+    product_id = products[0]["id"]
+    invoice = checkout(customer, 1, quantity=3)
+    assert client.post(f"/invoices/{invoice['invoice_id']}/release", headers=customer).status_code == 200
+    before = _stock(db, product_id)
+    sales_before = db.query(func.sum(models.DailySales.invoice_count)).scalar() or 0
+
+    with ThreadPoolExecutor(6) as pool:
+        codes = list(pool.map(lambda _: client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin).status_code, range(6)))
+
+    assert sorted(codes) == [200] + [400] * 5
+    assert _stock(db, product_id) == before - 3
+    db.expire_all()
+    assert (db.query(func.sum(models.DailySales.invoice_count)).scalar() or 0) == sales_before + 1
+    assert _outbox_jobs(db, invoice["qr_code"]) == 1
+
+
+def test_pay_without_hold_fails_on_shortfall(client, admin, customer, checkout, products, db):
+    product_id = products[1]["id"]
+    invoice = checkout(customer, 2, quantity=2)
+    assert client.post(f"/invoices/{invoice['invoice_id']}/release", headers=customer).status_code == 200
+    full = _stock(db, product_id)
+    db.query(models.Product).filter(models.Product.id == product_id).update({"available_qty": 1})
+    db.commit()
+    try:
+        r = client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin)
+        assert r.status_code == 400
+        assert r.json()["detail"].startswith("Insufficient stock")
+        assert _stock(db, product_id) == 1
+        assert db.get(models.Invoice, invoice["invoice_id"]).status == models.InvoiceStatus.pending
+    finally:
+        db.query(models.Product).filter(models.Product.id == product_id).update({"available_qty": full})
+        db.commit()
+
+
+def test_stress_reservations_never_oversell():
+    env = {k: v for k, v in os.environ.items() if k != "DATABASE_URL"}
+    result = subprocess.run(
+        [sys.executable, os.path.join(BACKEND, "scripts", "stress_reservations.py"), "--shoppers", "40", "--stock", "20"],
+        cwd=BACKEND, env=env, capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+def test_expired_hold_is_released_whole_and_repaid_from_stock(client, admin, customer, products, db):
+    first, second = products[2], products[3]
+    r = client.post("/carts/attach", headers=customer, json={"items": [{"code": first["code"], "quantity": 2}, {"code": second["code"], "quantity": 1}]})
+    invoice = client.post(f"/carts/{r.json()['cart_id']}/checkout", headers=customer).json()
+    R = models.StockReservation
+    db.query(R).filter(R.invoice_id == invoice["invoice_id"]).update({"expires_at": datetime.utcnow() - timedelta(minutes=1)})
+    full = _stock(db, first["id"])
+    db.query(models.Product).filter(models.Product.id == first["id"]).update({"available_qty": 0})
+    db.commit()
+    try:
+        # Another checkout of the scarce product takes the expired hold's units...
+        other = client.post("/carts/attach", headers=customer, json={"items": [{"code": first["code"], "quantity": 2}]})
+        assert client.post(f"/carts/{other.json()['cart_id']}/checkout", headers=customer).status_code == 200
+        db.expire_all()
+        held = dict(db.query(R.product_id, R.status).filter(R.invoice_id == invoice["invoice_id"]).all())
+        assert held == {first["id"]: models.ReservationStatus.released, second["id"]: models.ReservationStatus.released}
+        # ...so paying the first invoice has to take them again, and there are none left
+        r = client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin)
+        assert r.status_code == 400
+        assert r.json()["detail"].startswith("Insufficient stock")
+        assert _stock(db, first["id"]) == 0
+    finally:
+        db.query(models.Product).filter(models.Product.id == first["id"]).update({"available_qty": full})
+        db.commit()
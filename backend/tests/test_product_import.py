@@ -0,0 +1,36 @@
+from app import models
+
+
+def _import(client, admin, body):
+    r = client.post("/products/import", headers=admin, files={"file": ("catalog.csv", body, "text/csv")})
+    assert r.status_code == 200, r.text
+    assert r.json()["error_count"] == 0, r.json()
+    return r.json()
+
+
+def test_import_counts_held_units_as_on_the_shelf(client, admin, customer, db):
+    header = "code,name,price_per_unit,weight_per_unit,available_qty\n"
+    _import(client, admin, header + "IMP1,Imported,10,1,10\n")
+    product = db.query(models.Product).filter(models.Product.code == "IMP1").one()
+
+    r = client.post("/carts/attach", headers=customer, json={"items": [{"code": "IMP1", "quantity": 3}]})
+    invoice = client.post(f"/carts/{r.json()['cart_id']}/checkout", headers=customer).json()
+
+    # A stock count of 10 still includes the 3 units held by the unpaid checkout
+    _import(client, admin, header + "IMP1,Imported,10,1,10\n")
+    db.refresh(product)
+    assert product.available_qty == 7
+
+    assert client.post(f"/invoices/{invoice['invoice_id']}/release", headers=customer).status_code == 200
+    db.refresh(product)
+    assert product.available_qty == 10
+
+    # Never negative, and rows without a count keep the stock
+    r = client.post("/carts/attach", headers=customer, json={"items": [{"code": "IMP1", "quantity": 5}]})
+    client.post(f"/carts/{r.json()['cart_id']}/checkout", headers=customer)
+    _import(client, admin, header + "IMP1,Imported,10,1,2\n")
+    db.refresh(product)
+    assert product.available_qty == 0
+    _import(client, admin, header + "IMP1,Renamed,10,1,\n")
+    db.refresh(product)
+    assert (product.name, product.available_qty) == ("Renamed", 0)
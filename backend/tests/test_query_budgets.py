@@ -0,0 +1,55 @@
+"""Query budgets for the hot read paths: the statement count must not grow with the number of lines."""
+import pytest
+
+from app.utils.querycount import assert_max_queries, count_queries
+
+
+def _fill_cart(client, headers, products, lines):
+    for p in products[:lines]:
+        r = client.post("/cart/scan", headers=headers, json={"product_id": p["id"]})
+        assert r.status_code == 200, r.text
+
+
+@pytest.mark.parametrize("lines", [1, 8])
+def test_get_cart(client, customer, products, lines):
+    _fill_cart(client, customer, products, lines)
+    client.get("/cart/", headers=customer)  # warm the principal cache
+    with assert_max_queries(2):
+        r = client.get("/cart/", headers=customer)
+    assert r.status_code == 200
+    assert len(r.json()["items"]) == lines
+
+
+@pytest.mark.parametrize("lines", [1, 8])
+def test_invoice_detail(client, admin, customer, checkout, lines):
+    code = checkout(customer, lines)["qr_code"]
+    client.get(f"/invoices/by-code/{code}", headers=admin)
+    with assert_max_queries(2):
+        r = client.get(f"/invoices/by-code/{code}", headers=admin)
+    assert r.status_code == 200
+    assert len(r.json()["items"]) == lines
+
+
+def test_invoice_history(client, customer, checkout):
+    checkout(customer, 2)
+    client.get("/invoices/me/history", headers=customer)
+    with count_queries() as one:
+        client.get("/invoices/me/history", headers=customer)
+    for _ in range(4):
+        checkout(customer, 3)
+    with assert_max_queries(one.count):
+        r = client.get("/invoices/me/history", headers=customer)
+    assert len(r.json()) == 5
+
+
+@pytest.mark.parametrize("lines", [1, 8])
+def test_invoice_pdf(client, customer, checkout, lines):
+    invoice_id = checkout(customer, lines)["invoice_id"]
+    # A new invoice is a cache miss: rendering still loads it with its lines in one go
+    with assert_max_queries(2):
+        r = client.get(f"/invoices/{invoice_id}/pdf", headers=customer)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/pdf"
+    with assert_max_queries(2):
+        r = client.get(f"/invoices/{invoice_id}/pdf", headers={**customer, "If-None-Match": r.headers["etag"]})
+    assert r.status_code == 304
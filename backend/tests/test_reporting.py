@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+from app import models
+from app.utils import reporting
+from app.utils.product_import import import_products
+
+
+def test_null_dated_invoice_is_skipped(client, admin, customer, checkout, db):
+    invoice = checkout(customer, 2)
+    assert client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin).status_code == 200
+    row = db.query(models.Invoice).filter(models.Invoice.id == invoice["invoice_id"])
+    paid_at = row.one().date
+    row.update({"date": None})
+    db.commit()
+    try:
+        r = client.get("/analytics/basket-sizes", headers=admin)
+        assert r.status_code == 200, r.text
+        cols = reporting.extract_lines(db)
+        assert invoice["invoice_id"] not in cols.invoice_id
+    finally:
+        row.update({"date": paid_at})
+        db.commit()
+
+
+def test_extract_is_cached_until_a_payment_lands(client, admin, customer, checkout, db):
+    today = date.today()
+    start, end = today - timedelta(days=1), today + timedelta(days=1)
+    first = reporting.extract_lines(db, start, end)
+    assert reporting.extract_lines(db, start, end) is first
+    assert not first.quantity.flags.writeable
+
+    invoice = checkout(customer, 3)
+    assert client.post(f"/invoices/{invoice['invoice_id']}/pay", headers=admin).status_code == 200
+    again = reporting.extract_lines(db, start, end)
+    assert again is not first
+    assert len(again) == len(first) + 3
+
+
+def test_default_range_is_bounded():
+    start, end = reporting.report_range()
+    assert (end - start).days == reporting.REPORT_DEFAULT_DAYS - 1
+    assert reporting.report_range(date(2020, 1, 1), date(2020, 1, 31)) == (date(2020, 1, 1), date(2020, 1, 31))
+
+
+def test_extract_cache_survives_stock_changes_but_not_imports(client, customer, checkout, products, db):
+    today = date.today()
+    start, end = today - timedelta(days=1), today + timedelta(days=1)
+    first = reporting.extract_lines(db, start, end)
+    checkout(customer, 2)  # takes stock, bumping the catalog version
+    assert reporting.extract_lines(db, start, end) is first
+
+    product = db.get(models.Product, products[0]["id"])
+    row = {"code": product.code, "name": product.name, "price_per_unit": product.price_per_unit, "weight_per_unit": product.weight_per_unit}
+    assert import_products(db, [(1, row)]).upserted == 1
+    assert reporting.extract_lines(db, start, end) is not first
@@ -149,8 +149,8 @@ export function CustomerCart() {
   const [showLogin, setShowLogin] = useState(false)
   const tokens = getTokens()
 
-  // Poll interval ref so we can clear it
-  const pollRef = useRef<number | null>(null)
+  // Live invoice status stream (SSE) so we can close it
+  const streamRef = useRef<EventSource | null>(null)
 
   const totals = useMemo(() => {
     const total = cart.reduce((a, b) => a + b.price_per_unit * b.quantity, 0)
@@ -171,47 +171,60 @@ export function CustomerCart() {
     setInvoice(null)
   }
 
-  // Stop polling safely
-  function stopPolling() {
-    if (pollRef.current) {
-      window.clearInterval(pollRef.current)
-      pollRef.current = null
+  // Stop following the invoice
+  function stopFollowing() {
+    if (streamRef.current) {
+      streamRef.current.close()
+      streamRef.current = null
     }
   }
 
-  // Start polling invoice status by id
-  function startPolling(invoiceId: number) {
-    // stop any existing poll
-    stopPolling()
-
-    // poll every 3s
-    pollRef.current = window.setInterval(async () => {
-      try {
-        const res = await api.get(`/invoices/${invoiceId}`)
-        const latest = res.data
-        // update invoice in UI with latest info
-        setInvoice(prev => ({ ...prev, ...latest }))
-
-        if (latest.status === 'paid') {
-          // stop polling and handle paid state
-          stopPolling()
-          // clear local cart and localStorage
-          setCart([])
-          setLocalCart([])
-          // ensure invoice state contains fields our UI expects
-          setInvoice(latest)
-        }
-      } catch (err) {
-        // ignore transient errors but log if needed
-        console.error('Polling invoice failed', err)
+  // Follow invoice status by id over Server-Sent Events (the server pushes "paid" when the cashier marks it).
+  // EventSource cannot send headers, so it authenticates with a short-lived stream token in the URL
+  // rather than the login token (URLs end up in logs); each (re)open fetches a fresh one.
+  async function followInvoice(invoiceId: number) {
+    stopFollowing()
+    const base = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000'
+    let token: string
+    try {
+      token = (await api.post('/events/token')).data.access_token
+    } catch {
+      console.warn('Could not get an event stream token; invoice status will not update live')
+      return
+    }
+    const source = new EventSource(`${base}/events/invoices/${invoiceId}?access_token=${encodeURIComponent(token)}`)
+    streamRef.current = source
+
+    source.onmessage = (ev) => {
+      const latest = JSON.parse(ev.data)
+      // update invoice in UI with latest info (first message is a snapshot, then status changes)
+      setInvoice(prev => ({ ...prev, status: latest.status, paid_at: latest.paid_at }))
+
+      if (latest.status === 'paid') {
+        // stop following and handle paid state
+        stopFollowing()
+        // clear local cart and localStorage
+        setCart([])
+        setLocalCart([])
       }
-    }, 3000)
+    }
+    source.onerror = () => {
+      // EventSource reconnects on its own after transient errors; once the stream token has
+      // expired the reconnect is refused and the source closes, so reopen with a new token
+      if (source.readyState === EventSource.CLOSED && streamRef.current === source) {
+        setTimeout(() => {
+          if (streamRef.current === source) followInvoice(invoiceId)
+        }, 3000)
+      } else {
+        console.warn('Invoice event stream interrupted; reconnecting')
+      }
+    }
   }
 
-  // ensure we cleanup interval when component unmounts
+  // ensure we close the stream when component unmounts
   useEffect(() => {
     return () => {
-      stopPolling()
+      stopFollowing()
     }
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [])
@@ -228,19 +241,22 @@ export function CustomerCart() {
       // Attach local cart to server
       const attach = await api.post('/carts/attach', { items })
       const cartId = attach.data.cart_id
-      // Checkout to create invoice
-      const res = await api.post(`/carts/${cartId}/checkout`)
+      // Checkout to create invoice; the key is stable for this cart state, so a retry or
+      // double click gets the same invoice back instead of a second one
+      const res = await api.post(`/carts/${cartId}/checkout`, null, {
+        headers: { 'Idempotency-Key': `checkout-${cartId}-${attach.data.version}` },
+      })
       const created = res.data
       // created should include invoice_id (based on your backend)
       setInvoice(created)
 
-      // Start polling the invoice for status changes (cashier will mark paid)
+      // Follow the invoice for status changes (cashier will mark paid)
       // backend returns invoice_id per your earlier code; if backend returns `id`, adapt accordingly
       const invoiceId = created.invoice_id ?? created.id
       if (invoiceId) {
-        startPolling(invoiceId)
+        followInvoice(invoiceId)
       } else {
-        console.warn('No invoice id returned from checkout; cannot poll status.')
+        console.warn('No invoice id returned from checkout; cannot follow status.')
       }
       // Do not clear cart now; will be cleared when invoice becomes paid
     } catch (err: any) {
@@ -54,7 +54,9 @@ export function OfficialFetchBill() {
   async function markPaid() {
     if (!bill) return
     try {
-      const res = await api.post(`/invoices/${bill.id}/pay`)
+      const res = await api.post(`/invoices/${bill.id}/pay`, null, {
+        headers: { 'Idempotency-Key': `pay-${bill.id}` },
+      })
       setBill(res.data)
       window.location.href = `/invoices/${bill.id}/pdf`;
     } catch (e: any) {